@@ -0,0 +1,237 @@
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from main import (ADD_CLIENT_ATTEMPTS, ADD_CLIENT_SQL, UPDATE_CLIENTS_SQL, Client, UpdateResult, User,
+                  add_client_params, add_client_result, report_added_client, search_query, update_params)
+from validation import phone_key
+
+
+class AsyncClientRepository:
+
+    """
+    Asyncio counterpart of ClientRepository: the client operations over an async pool of PostgreSQL connections
+    (psycopg 3). The operations keep the semantics of the functions in main.py: they print the same messages
+    and return the same values, but never block the event loop.
+    """
+
+    def __init__(self, user=None, min_size=1, max_size=10):
+
+        """
+        Creates the connection pool, it is opened by open() or by entering the repository with "async with".
+        :param user: The connection settings (User, optional, default is read from .env).
+        :param min_size: The number of connections opened in advance (integer, optional, default 1).
+        :param max_size: The maximum number of simultaneously open connections (integer, optional, default 10).
+        """
+
+        self.user = user or User()
+        # The same server as the psycopg2 connections; libpq names the database dbname.
+        params = self.user.connect_params()
+        conninfo = make_conninfo(params.pop('dsn', ''), **{
+            'dbname' if key == 'database' else key: value for key, value in params.items()})
+        self.pool = AsyncConnectionPool(conninfo, min_size=min_size, max_size=max_size, open=False,
+                                        check=AsyncConnectionPool.check_connection)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        await self.pool.open(wait=True)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def add_client(self, name, surname, email, phones=None):
+
+        """
+        Adds a new client to the clients table, along with any associated phone numbers, in one statement.
+        :param name: The client's first name (string).
+        :param surname: The client's last name (string).
+        :param email: The client's email address (string).
+        :param phones: The client's phone numbers (list of strings, optional, default None).
+        :return: The client id and the outcome of every phone (AddClientResult), or None on error.
+        """
+
+        phones = [phone for phone in phones or [] if phone is not None]
+        params = add_client_params(name, surname, email, phones)
+        async with self.pool.connection() as conn:
+            try:
+                for _ in range(ADD_CLIENT_ATTEMPTS):
+                    cur = await conn.execute(ADD_CLIENT_SQL, params)
+                    rows = await cur.fetchall()
+                    if rows[0][0] is not None or rows[0][1] is not None:
+                        break
+                await conn.commit()
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка добавления клиента в Базу данных: ошибка при работе с PostgreSQL", error)
+                return
+        result = add_client_result(phones, rows)
+        report_added_client(email, result)
+        return result
+
+    async def add_phone(self, client_id, phone):
+
+        """
+        Adds a new phone number to the phones table for a given client.
+        :param client_id: The ID of the client to add the phone number to table (integer).
+        :param phone: The phone number to add (string).
+        :return: None.
+        """
+
+        if (key := phone_key(phone)) is None:
+            print(f'Номер {phone} не валиден.')
+            return
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute("""
+                                         INSERT INTO phones(client_id, phone, phone_key)
+                                              VALUES (%s, %s, %s)
+                                           RETURNING phone_id;
+                                         """, (client_id, phone, key))
+                print(f"Номер {phone} c id {(await cur.fetchone())[0]} успешно добавлен для клиента {client_id}")
+                await conn.commit()
+            except psycopg.errors.ForeignKeyViolation:
+                await conn.rollback()
+                print("Клиента с таким id нет в базе данных. ")
+            except psycopg.errors.UniqueViolation:
+                await conn.rollback()
+                cur = await conn.execute("""
+                                         SELECT phone_id,
+                                                client_id
+                                           FROM phones
+                                          WHERE phone_key = %s;
+                                         """, (key,))
+                print(f"Номер {phone} уже зарегистрирован для клиента id {(await cur.fetchall())[0][1]}.")
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка при работе с PostgreSQL", error)
+
+    async def delete_phone(self, client_id, phone):
+
+        """
+        Deletes a phone number from the phones table for a given client.
+        :param client_id: ID of the client to delete the phone number from table of phones (integer).
+        :param phone: The phone number to delete (string).
+        :return: None.
+        """
+
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute("""
+                                         DELETE FROM phones
+                                          WHERE client_id = %s AND
+                                                phone_key = %s
+                                      RETURNING phone_id;
+                                         """, (client_id, phone_key(phone)))
+                phone_id = await cur.fetchone()
+                if phone_id is None:
+                    print(f"Не зарегистрирован номер {phone} для клиента {client_id}. Проверьте корректность ввода. ")
+                    return
+                print(f"Вы хотите удалить телефон c id {phone_id[0]}.")
+                await conn.commit()
+                print("Номер успешно удален.")
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Номер не удален. Ошибка при работе с PostgreSQL", error)
+
+    async def update_data(self, client_id, name=None, surname=None, email=None, phones=None):
+
+        """
+        Updates the data for a given client.
+        :param client_id: The ID of the client to update (integer).
+        :param name: The new name for the client (string, optional, default None).
+        :param surname: The new surname for the client (string, optional, default None).
+        :param email: The new email for the client (string, optional, default None).
+        :param phones: The new phone numbers for the client (list of strings, optional, default None).
+        :return: The numbers of changed rows (UpdateResult), or None on error or an invalid phone number.
+        """
+
+        try:
+            params = update_params([{'client_id': client_id, 'name': name, 'surname': surname, 'email': email,
+                                     'phones': phones}])
+        except ValueError as error:
+            print(error, "Данные не изменены.")
+            return
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute(UPDATE_CLIENTS_SQL, params)
+                result = UpdateResult(*await cur.fetchone())
+                await conn.commit()
+                print(f"Данные пользователя {client_id} заменены. ")
+                return result
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка при работе с PostgreSQL", error)
+
+    async def delete_client(self, client_id):
+
+        """
+        Deletes a client and all associated phone numbers (ON DELETE CASCADE).
+        :param client_id: The ID of the client to delete (integer).
+        :return: True if the client is deleted, False if there is no such client, None on error.
+        """
+
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute("DELETE FROM clients WHERE client_id=%s RETURNING client_id;", (client_id,))
+                deleted = await cur.fetchone() is not None
+                await conn.commit()
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка при работе с PostgreSQL", error)
+                print(f"Клиент не удален.")
+                return
+        print(f"Клиент с id {client_id} удален." if deleted else "Клиент с таким id не найден. ")
+        return deleted
+
+    async def find_client(self, data):
+
+        """
+        Searches for a client based on their name, surname, email, or phone number.
+        :param data: The data for search query (string).
+        :return: The list of found clients (list of Client), or None on error.
+        """
+
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute(*search_query(data))
+                clients = [Client.from_row(row) for row in await cur.fetchall()]
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка при работе с PostgreSQL", error)
+                return
+        if not clients:
+            print("Таких клиентов нет в базе данных.")
+        return clients
+
+    async def find_client_by_id(self, client_id):
+
+        """
+        Finds a client in the database by their ID.
+        :param client_id: The ID of the client to find (integer).
+        :return: The client data (Client), or None if no client has found.
+        """
+
+        async with self.pool.connection() as conn:
+            try:
+                cur = await conn.execute("""
+                                         SELECT c.client_id, name, surname, email,
+                                                (SELECT array_agg(phone ORDER BY phone_id) FROM phones
+                                                  WHERE client_id = c.client_id)
+                                           FROM clients c
+                                          WHERE c.client_id = %s;
+                                         """, (client_id,))
+                client = await cur.fetchone()
+            except psycopg.Error as error:
+                await conn.rollback()
+                print("Ошибка при работе с PostgreSQL", error)
+                return
+        if client is None:
+            print("Клиент с таким id не найден. ")
+            return
+        return Client.from_row(client)
@@ -0,0 +1,89 @@
+"""
+Hammers add_client with the same emails and phones from many threads and checks that every email is stored once,
+every call gets the id of that one client and no client is left without its phones. Exits with status 1 on
+a violation. Run from the repository root against a scratch database:
+
+    python -m benchmarks.add_client_race --emails 200 --threads 32 --rounds 8
+"""
+
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from repository import ClientRepository
+
+
+def phones_of(i):
+    return [f'+7 912 {i // 10000:03d}-{i // 100 % 100:02d}-{i % 100:02d}',
+            f'+7 913 {i // 10000:03d}-{i // 100 % 100:02d}-{i % 100:02d}']
+
+
+def check(repo, emails, results):
+
+    """
+    Compares the results of the concurrent calls with the stored data.
+    :param repo: The repository (ClientRepository).
+    :param emails: The emails added by the run (list of strings).
+    :param results: The pairs (email, AddClientResult or None) of every call.
+    :return: A list of violations (strings).
+    """
+
+    errors = []
+    with repo.cursor() as cur:
+        cur.execute("""
+                    SELECT c.email, c.client_id, count(p.phone_id)
+                      FROM clients c
+                      LEFT JOIN phones p ON p.client_id = c.client_id
+                     WHERE c.email = ANY(%s)
+                     GROUP BY c.email, c.client_id;
+                    """, (emails,))
+        stored = {email: (client_id, phones) for email, client_id, phones in cur.fetchall()}
+    for email in emails:
+        if email not in stored:
+            errors.append(f'{email}: клиент не сохранен')
+        elif stored[email][1] != 2:
+            errors.append(f'{email}: сохранено телефонов {stored[email][1]} вместо 2')
+    created = {}
+    for email, result in results:
+        if result is None:
+            errors.append(f'{email}: ошибка при добавлении')
+            continue
+        if result.status == 'conflict':
+            errors.append(f'{email}: конфликт, клиент не прочитан')
+            continue
+        if result.created:
+            created[email] = created.get(email, 0) + 1
+        if email in stored and result.client_id != stored[email][0]:
+            errors.append(f'{email}: возвращен id {result.client_id} вместо {stored[email][0]}')
+    errors.extend(f'{email}: создан {count} раз' for email, count in created.items() if count != 1)
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=8, help='how many times every email is added')
+    args = parser.parse_args()
+    run = int(time.time())
+    emails = [f'race{run}-{i}@example.com' for i in range(args.emails)]
+    calls = [(i, email) for _ in range(args.rounds) for i, email in enumerate(emails)]
+    with ClientRepository(maxconn=args.threads) as repo:
+        repo.create_tables()
+        with repo.cursor() as cur:
+            cur.execute("SELECT coalesce(max(client_id), 0) FROM clients;")
+            offset = cur.fetchone()[0]
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(lambda call: (call[1], repo.add_client('Race', 'Test', call[1],
+                                                                           phones_of(offset + call[0]))), calls))
+        elapsed = time.perf_counter() - started
+        errors = check(repo, emails, results)
+    print(f"{len(calls)} вызовов add_client за {elapsed:.2f} сек. ({len(calls) / elapsed:.0f} в сек.), "
+          f"нарушений: {len(errors)}")
+    for error in errors[:20]:
+        print(error)
+    raise SystemExit(1 if errors else 0)
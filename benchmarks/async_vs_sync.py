@@ -0,0 +1,62 @@
+"""
+Compares the throughput of concurrent find_client_by_id lookups through the threaded ClientRepository and
+the asyncio AsyncClientRepository. Run from the repository root against a scratch database:
+
+    python -m benchmarks.async_vs_sync --clients 10000 --lookups 20000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from async_client import AsyncClientRepository
+from repository import ClientRepository
+
+
+def seed(repo, clients):
+    with repo.connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+                    INSERT INTO clients(name, surname, email)
+                    SELECT 'Name', 'Surname', 'bench' || i || '@example.com'
+                      FROM generate_series(1, %s) AS i
+                        ON CONFLICT (email) DO NOTHING;
+                    """, (clients,))
+        cur.execute("SELECT client_id FROM clients WHERE email LIKE 'bench%%@example.com';")
+        ids = [client_id for client_id, in cur.fetchall()]
+        conn.commit()
+    return ids
+
+
+def run_sync(ids, concurrency):
+    with ClientRepository(maxconn=concurrency) as repo, ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        list(pool.map(repo.find_client_by_id, ids))
+        return time.perf_counter() - started
+
+
+async def run_async(ids, concurrency):
+    async with AsyncClientRepository(max_size=concurrency) as repo:
+        started = time.perf_counter()
+        await asyncio.gather(*(repo.find_client_by_id(client_id) for client_id in ids))
+        return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    with ClientRepository() as repo:
+        repo.create_tables()
+        ids = seed(repo, args.clients)
+    lookups = random.choices(ids, k=args.lookups)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        sync_time = run_sync(lookups, args.concurrency)
+        async_time = asyncio.run(run_async(lookups, args.concurrency))
+    for title, elapsed in (('sync (threads)', sync_time), ('async', async_time)):
+        print(f"{title:<15} {elapsed:8.2f} s {args.lookups / elapsed:10.0f} lookups/s")
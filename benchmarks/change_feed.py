@@ -0,0 +1,88 @@
+"""
+Writes clients and phones from many threads while a consumer follows the change log with changes_since,
+then checks that the consumer has seen every change of the run exactly once and in the order of the numbers.
+Exits with status 1 on a violation. Run from the repository root against a scratch database:
+
+    python -m benchmarks.change_feed --clients 2000 --threads 16
+"""
+
+import argparse
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.datagen import client
+from repository import ClientRepository
+
+FEED_CLIENTS = 6 * 10 ** 7
+
+
+def write(repo, i):
+    name, surname, email, phones = client(FEED_CLIENTS + i)
+    result = repo.add_client(name, surname, email, [phone for phone, _ in phones])
+    if result is not None and i % 2:
+        repo.update_data(result.client_id, surname=surname + 'a')
+    if result is not None and i % 3 == 0:
+        repo.delete_client(result.client_id)
+
+
+def follow(repo, start, done, seen):
+
+    """
+    Reads the change log until the writers are done and the log is drained.
+    :return: None, the changes are appended to seen.
+    """
+
+    seq = start
+    while True:
+        finished = done.is_set()
+        changes = repo.changes_since(seq, 500)
+        seen.extend(changes)
+        if changes:
+            seq = changes[-1].seq
+        elif finished:
+            return
+        else:
+            time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    with ClientRepository(maxconn=args.threads + 1) as repo:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            repo.create_tables()
+            emails = [client(FEED_CLIENTS + i)[2] for i in range(args.clients)]
+            if leftovers := [found.client_id for found in repo.find_clients_by_emails(emails).values() if found]:
+                repo.delete_clients(leftovers)
+            repo.changes_since(0, 0)
+            with repo.cursor() as cur:
+                cur.execute("SELECT coalesce(max(seq), 0), coalesce(max(change_id), 0) FROM client_changes;")
+                start, first_change = cur.fetchone()
+            done, seen = threading.Event(), []
+            consumer = threading.Thread(target=follow, args=(repo, start, done, seen))
+            consumer.start()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as pool:
+                list(pool.map(lambda i: write(repo, i), range(args.clients)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            consumer.join()
+        with repo.cursor() as cur:
+            cur.execute("SELECT seq FROM client_changes WHERE change_id > %s ORDER BY seq;", (first_change,))
+            stored = [seq for seq, in cur.fetchall()]
+    errors = []
+    numbers = [change.seq for change in seen]
+    if numbers != sorted(set(numbers)):
+        errors.append('изменения получены не по порядку или повторно')
+    if missed := set(stored) - set(numbers):
+        errors.append(f'пропущено изменений: {len(missed)}')
+    print(f"{args.clients} клиентов за {elapsed:.2f} сек., изменений: {len(stored)}, получено: {len(seen)}, "
+          f"нарушений: {len(errors)}")
+    for error in errors:
+        print(error)
+    raise SystemExit(1 if errors else 0)
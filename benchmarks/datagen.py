@@ -0,0 +1,140 @@
+"""
+Generates realistic synthetic clients: Russian first names and surnames (with the feminine form of the surname),
+unique valid emails on common mail domains and zero to three valid Russian mobile numbers per client.
+Client number i always gets the same data, so runs are reproducible. Load into a scratch database or write
+a CSV file for bulk_import.py:
+
+    python -m benchmarks.datagen --clients 1000000
+    python -m benchmarks.datagen --clients 10000 --csv clients.csv
+"""
+
+import argparse
+import csv
+import io
+import time
+
+import psycopg2
+
+from main import User, create_tables
+
+MALE_NAMES = ['Alexander', 'Dmitry', 'Maxim', 'Sergey', 'Andrey', 'Alexey', 'Artem', 'Ilya', 'Kirill', 'Mikhail',
+              'Nikita', 'Matvey', 'Roman', 'Egor', 'Arseny', 'Ivan', 'Denis', 'Evgeny', 'Daniil', 'Timofey',
+              'Vladislav', 'Igor', 'Vladimir', 'Pavel', 'Ruslan', 'Mark', 'Konstantin', 'Timur', 'Oleg', 'Yaroslav']
+FEMALE_NAMES = ['Anastasia', 'Maria', 'Anna', 'Victoria', 'Ekaterina', 'Natalia', 'Marina', 'Polina', 'Sofia',
+                'Daria', 'Alisa', 'Ksenia', 'Alexandra', 'Elena', 'Olga', 'Tatiana', 'Irina', 'Yulia', 'Svetlana',
+                'Valeria', 'Veronika', 'Arina', 'Elizaveta', 'Kristina', 'Vera', 'Milana', 'Ulyana', 'Eva', 'Alina',
+                'Diana']
+SURNAMES = ['Ivanov', 'Smirnov', 'Kuznetsov', 'Popov', 'Vasiliev', 'Petrov', 'Sokolov', 'Mikhailov', 'Novikov',
+            'Fedorov', 'Morozov', 'Volkov', 'Alekseev', 'Lebedev', 'Semenov', 'Egorov', 'Pavlov', 'Kozlov',
+            'Stepanov', 'Nikolaev', 'Orlov', 'Andreev', 'Makarov', 'Nikitin', 'Zakharov', 'Zaitsev', 'Soloviev',
+            'Borisov', 'Yakovlev', 'Grigoriev', 'Romanov', 'Vorobiev', 'Sergeev', 'Kuzmin', 'Frolov', 'Alexandrov',
+            'Dmitriev', 'Korolev', 'Gusev', 'Kiselev', 'Ilyin', 'Maksimov', 'Polyakov', 'Sorokin', 'Vinogradov',
+            'Kovalev', 'Belov', 'Medvedev', 'Antonov', 'Tarasov']
+DOMAINS = ['gmail.com', 'mail.ru', 'yandex.ru', 'outlook.com', 'rambler.ru', 'bk.ru', 'list.ru', 'inbox.ru']
+# Share of clients with 0, 1, 2 and 3 phones, in tenths.
+PHONE_COUNTS = [0, 1, 1, 1, 1, 1, 2, 2, 2, 3]
+PHONE_SLOTS = 3
+BATCH_SIZE = 100000
+
+
+def phone_number(j):
+
+    """
+    Makes the j-th synthetic mobile number. Different j (below 10**9) give different numbers.
+    :param j: The number of the phone (integer).
+    :return: A tuple (phone in international format, phone key).
+    """
+
+    number = str(9000000000 + j * 7919 % 10 ** 9)
+    return f'+7 {number[:3]} {number[3:6]}-{number[6:8]}-{number[8:]}', int('7' + number)
+
+
+def client(i):
+
+    """
+    Makes the i-th synthetic client. Client i uses the phone numbers PHONE_SLOTS * i and up.
+    :param i: The number of the client (integer).
+    :return: A tuple (name, surname, email, list of tuples (phone, phone key)).
+    """
+
+    h = i * 2654435761 % 2 ** 32
+    female = h & 1
+    name = (FEMALE_NAMES if female else MALE_NAMES)[(h >> 1) % 30]
+    surname = SURNAMES[(h >> 6) % len(SURNAMES)] + ('a' if female else '')
+    email = f'{name.lower()}.{surname.lower()}{i}@{DOMAINS[(h >> 12) % len(DOMAINS)]}'
+    phones = [phone_number(PHONE_SLOTS * i + k) for k in range(PHONE_COUNTS[(h >> 16) % 10])]
+    return name, surname, email, phones
+
+
+def load(conn, count, batch_size=BATCH_SIZE):
+
+    """
+    Fills the database up to count clients with COPY, one transaction per batch. The clients already in
+    the table are counted, so a smaller dataset is extended instead of being loaded again.
+    :param conn: A connection object representing the connection to the database.
+    :param count: The number of clients wanted (integer).
+    :param batch_size: The number of clients copied in one transaction (integer, optional, default 100000).
+    :return: The number of loaded clients.
+    """
+
+    with conn.cursor() as cur:
+        create_tables(cur)
+        cur.execute("SELECT count(*) FROM clients;")
+        existing = cur.fetchone()[0]
+        started = time.perf_counter()
+        for start in range(existing, count, batch_size):
+            stop = min(start + batch_size, count)
+            cur.execute("""
+                        SELECT nextval(pg_get_serial_sequence('clients', 'client_id'))
+                          FROM generate_series(1, %s);
+                        """, (stop - start,))
+            clients_buf, phones_buf = io.StringIO(), io.StringIO()
+            clients_writer, phones_writer = csv.writer(clients_buf), csv.writer(phones_buf)
+            for (client_id,), i in zip(cur.fetchall(), range(start, stop)):
+                name, surname, email, phones = client(i)
+                clients_writer.writerow((client_id, name, surname, email))
+                phones_writer.writerows((client_id, phone, key) for phone, key in phones)
+            clients_buf.seek(0)
+            phones_buf.seek(0)
+            cur.copy_expert("COPY clients(client_id, name, surname, email) FROM STDIN WITH (FORMAT csv)", clients_buf)
+            cur.copy_expert("COPY phones(client_id, phone, phone_key) FROM STDIN WITH (FORMAT csv)", phones_buf)
+            conn.commit()
+            print(f"Загружено клиентов: {stop} из {count} ({(stop - existing) / (time.perf_counter() - started):.0f} "
+                  f"строк/сек.)")
+        cur.execute("ANALYZE clients; ANALYZE phones;")
+        conn.commit()
+    return max(count - existing, 0)
+
+
+def write_csv(path, count):
+
+    """
+    Writes clients 0..count - 1 as a CSV file in the format of bulk_import.py.
+    :param path: The path to the CSV file (string).
+    :param count: The number of clients (integer).
+    :return: None.
+    """
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('name', 'surname', 'email', 'phones'))
+        for i in range(count):
+            name, surname, email, phones = client(i)
+            writer.writerow((name, surname, email, ';'.join(phone for phone, _ in phones)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--csv', help='write a CSV file instead of loading the database')
+    args = parser.parse_args()
+    if args.csv:
+        write_csv(args.csv, args.clients)
+    else:
+        user = User()
+        conn = psycopg2.connect(**user.connect_params())
+        try:
+            load(conn, args.clients, args.batch_size)
+        finally:
+            conn.close()
@@ -0,0 +1,75 @@
+"""
+Measures the throughput and the peak memory of export.py on a generated dataset.
+The clients table of the configured database is filled with synthetic clients, use a scratch database:
+
+    python -m benchmarks.export --clients 1000000 --fetch-size 10000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+from main import User, create_tables
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def generate(conn, clients):
+    with conn.cursor() as cur:
+        create_tables(cur)
+        cur.execute("SELECT count(*) FROM clients;")
+        existing = cur.fetchone()[0]
+        if existing >= clients:
+            return
+        cur.execute("""
+                    INSERT INTO clients(name, surname, email)
+                    SELECT 'Name', 'Surname', 'export' || i || '@example.com'
+                      FROM generate_series(%s, %s) AS i;
+                    """, (existing + 1, clients))
+        cur.execute("""
+                    INSERT INTO phones(client_id, phone, phone_key)
+                    SELECT client_id, '+7 9' || lpad((client_id * 2 + k)::text, 9, '0'),
+                           ('79' || lpad((client_id * 2 + k)::text, 9, '0'))::bigint
+                      FROM clients, generate_series(0, 1) AS k
+                     WHERE client_id > %s
+                        ON CONFLICT DO NOTHING;
+                    """, (existing,))
+        conn.commit()
+
+
+def run(fmt, fetch_size, directory):
+    path = os.path.join(directory, f'clients.{fmt}')
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'export.py', path, '--fetch-size', str(fetch_size)],
+                               stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    if status != 0:
+        return None
+    return elapsed, usage.ru_maxrss / 1024, os.path.getsize(path) / 1024 / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000000)
+    parser.add_argument('--fetch-size', type=int, default=10000)
+    args = parser.parse_args()
+    user = User()
+    with psycopg2.connect(**user.connect_params()) as conn:
+        generate(conn, args.clients)
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM clients;")
+            total = cur.fetchone()[0]
+    conn.close()
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in FORMATS:
+            if (result := run(fmt, args.fetch_size, directory)) is None:
+                print(f"{fmt:<8} failed (pyarrow is required for parquet)")
+                continue
+            elapsed, rss, size = result
+            print(f"{fmt:<8} {total / elapsed:10.0f} rows/s {rss:8.1f} MB peak RSS {size:8.1f} MB file")
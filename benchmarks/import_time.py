@@ -0,0 +1,43 @@
+"""
+Measures the import time and the peak RSS of main.py in a fresh interpreter, with and without pandas loaded
+(main.py imported pandas at module level before it became an optional export dependency):
+
+    python -m benchmarks.import_time --runs 10
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+CASES = {
+    'main': 'import main',
+    'main + pandas': 'import main\nimport pandas',
+}
+
+
+def measure(imports, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(imports=imports)], capture_output=True,
+                                text=True, check=True).stdout
+        results.append(json.loads(output))
+    return (statistics.median(result['seconds'] for result in results),
+            statistics.median(result['max_rss_mb'] for result in results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    for title, imports in CASES.items():
+        seconds, rss = measure(imports, args.runs)
+        print(f"{title:<15} {seconds * 1000:8.1f} ms {rss:8.1f} MB")
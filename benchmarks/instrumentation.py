@@ -0,0 +1,49 @@
+"""
+Measures the cost of the instrumentation per statement: a plain cursor, InstrumentedCursor with the
+instrumentation disabled and enabled, on a trivial statement so the overhead is not hidden by the query:
+
+    python -m benchmarks.instrumentation --statements 20000
+"""
+
+import argparse
+import statistics
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+import instrumentation
+from instrumentation import InstrumentedCursor, instrumented
+from main import User
+
+
+@instrumented
+def select_one(cur):
+    cur.execute("SELECT 1;")
+    return cur.fetchone()
+
+
+def per_statement(cur, statements, rounds=5):
+    results = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(statements):
+            select_one(cur)
+        results.append((time.perf_counter() - started) / statements * 1e6)
+    return statistics.median(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--statements', type=int, default=20000)
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    plain = per_statement(conn.cursor(cursor_factory=extensions.cursor), args.statements)
+    disabled = per_statement(conn.cursor(cursor_factory=InstrumentedCursor), args.statements)
+    instrumentation.enable()
+    enabled = per_statement(conn.cursor(cursor_factory=InstrumentedCursor), args.statements)
+    conn.close()
+    print(f"plain cursor            {plain:8.1f} us/statement")
+    print(f"instrumentation off     {disabled:8.1f} us/statement ({disabled - plain:+.1f})")
+    print(f"instrumentation on      {enabled:8.1f} us/statement ({enabled - plain:+.1f})")
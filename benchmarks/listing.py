@@ -0,0 +1,52 @@
+"""
+Shows that list_clients pages cost the same at any depth: page 1 and page 10,000 are timed for both orders.
+The clients table of the configured database is filled with synthetic clients, use a scratch database:
+
+    python -m benchmarks.listing --clients 1000000 --page 10000
+"""
+
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from benchmarks.search import generate
+from main import LIST_ORDERS, User, list_clients
+
+LIMIT = 50
+
+
+def cursor_before(cur, order, page):
+    # The cursor of a deep page is looked up once with OFFSET, only the keyset query itself is timed.
+    keys = LIST_ORDERS[order]
+    cur.execute(f"SELECT {', '.join(keys)} FROM clients ORDER BY {', '.join(keys)} OFFSET %s LIMIT 1;",
+                ((page - 1) * LIMIT - 1,))
+    return cur.fetchone()
+
+
+def timed(cur, order, cursor, runs):
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        list_clients(cur, LIMIT, cursor, order)
+        results.append((time.perf_counter() - started) * 1000)
+    return statistics.median(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000000)
+    parser.add_argument('--page', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    generate(conn, max(args.clients, args.page * LIMIT))
+    with conn.cursor() as cur:
+        print(f"median latency in ms, {LIMIT} clients per page")
+        for order in LIST_ORDERS:
+            deep_cursor = cursor_before(cur, order, args.page)
+            print(f"order by {order:<10} page 1 {timed(cur, order, None, args.runs):8.2f}   "
+                  f"page {args.page} {timed(cur, order, deep_cursor, args.runs):8.2f}")
+    conn.close()
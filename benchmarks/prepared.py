@@ -0,0 +1,93 @@
+"""
+Compares the hot-path statements sent as plain SQL with the same statements run as prepared statements:
+the median latency of find_client (by email and by phone), find_client_by_id and a pair of add_phone
+and delete_phone on one connection. Run from the repository root against a scratch database:
+
+    python -m benchmarks.prepared --clients 100000 --calls 2000
+
+As in benchmarks.suite, the name lookup is left out: it returns every namesake and measures the size
+of the result rather than the statement.
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+import main
+from benchmarks.datagen import client, load, phone_number
+from statements import statements
+
+EXTRA_PHONES = 5 * 10 ** 8
+
+
+def operations(cur, clients, calls):
+
+    """
+    :param cur: A cursor object used to execute SQL commands.
+    :param clients: The number of clients in the database (integer).
+    :param calls: The number of calls per operation (integer).
+    :return: A dict {operation: function of the call number}.
+    """
+
+    cur.execute("SELECT min(client_id) FROM clients;")
+    low = cur.fetchone()[0]
+    cur.connection.rollback()
+    picked = [client(i * 7 % clients) for i in range(calls)]
+    with_phone = [phones[0][0] for _, _, _, phones in picked if phones] or [None]
+
+    def phone_pair(i):
+        phone = phone_number(EXTRA_PHONES + i)[0]
+        main.add_phone(cur, low + i % clients, phone)
+        main.delete_phone(cur, low + i % clients, phone)
+
+    return {
+        'find_client email': lambda i: main.find_client(cur, picked[i][2]),
+        'find_client phone': lambda i: main.find_client(cur, with_phone[i % len(with_phone)]),
+        'find_client_by_id': lambda i: main.find_client_by_id(cur, low + i * 7 % clients),
+        'add_phone + delete_phone': phone_pair,
+    }
+
+
+def measure(conn, call, calls):
+
+    """
+    :return: The median latency of the calls in milliseconds.
+    """
+
+    latencies = []
+    for i in range(calls):
+        started = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - started)
+        conn.rollback()
+    return statistics.median(latencies) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=100000, help='size of the generated dataset')
+    parser.add_argument('--calls', type=int, default=2000, help='calls per operation and mode')
+    args = parser.parse_args()
+    user = main.User()
+    conn = psycopg2.connect(**user.connect_params())
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            load(conn, args.clients)
+        with conn.cursor() as cur, open(os.devnull, 'w') as devnull:
+            for operation, call in operations(cur, args.clients, args.calls).items():
+                results = {}
+                for enabled in (False, True):
+                    statements.enabled = enabled
+                    with contextlib.redirect_stdout(devnull):
+                        call(0)
+                        conn.rollback()
+                        results[enabled] = measure(conn, call, args.calls)
+                print(f"{operation:<26} обычный {results[False]:7.3f} мс   подготовленный {results[True]:7.3f} мс   "
+                      f"{results[True] / results[False] - 1:+6.1%}")
+    finally:
+        conn.close()
@@ -0,0 +1,74 @@
+"""
+Compares the read throughput of find_client_by_id on the primary alone with the same reads balanced over
+the replicas, then checks read-your-writes under load: every thread adds clients and reads each one back
+at once inside read_your_writes(), a read that does not see the client is a violation. The clients added
+by the run are deleted again. Run from the repository root with the replicas in replica_dsns (.env):
+
+    python -m benchmarks.replicas --reads 20000 --writes 500 --threads 16
+"""
+
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.datagen import client
+from main import User
+from repository import ClientRepository
+
+REPLICA_CLIENTS = 8 * 10 ** 7
+
+
+def read_throughput(repo, client_ids, reads, threads):
+
+    """
+    :return: The number of find_client_by_id calls per second.
+    """
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda i: repo.find_client_by_id(client_ids[i * 7 % len(client_ids)]), range(reads)))
+    return reads / (time.perf_counter() - started)
+
+
+def read_your_writes(repo, clients, threads):
+
+    """
+    :return: A tuple (number of reads that did not see the client added just before, list of added ids).
+    """
+
+    def add_and_read(new):
+        with repo.read_your_writes():
+            result = repo.add_client(new[0], new[1], new[2], [])
+            if result is None:
+                return None, 0
+            return result.client_id, int(repo.find_client_by_id(result.client_id) is None)
+
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(add_and_read, clients))
+    return sum(missed for _, missed in results), [client_id for client_id, _ in results if client_id]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, default=20000)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--balancing', default='least_busy')
+    args = parser.parse_args()
+    user = User()
+    if not user.replica_dsns:
+        parser.error('replica_dsns не задан в .env')
+    clients = [client(REPLICA_CLIENTS + i) for i in range(args.writes)]
+    with ClientRepository(user, maxconn=args.threads, replica_dsns=[]) as primary, \
+            ClientRepository(user, maxconn=args.threads, balancing=args.balancing) as balanced, \
+            open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        client_ids = [found.client_id for found in primary.list_clients(limit=1000).clients]
+        alone = read_throughput(primary, client_ids, args.reads, args.threads)
+        spread = read_throughput(balanced, client_ids, args.reads, args.threads)
+        missed, added = read_your_writes(balanced, clients, args.threads)
+        primary.delete_clients(added)
+    print(f"find_client_by_id только основной сервер: {alone:.0f} в сек., с репликами ({len(user.replica_dsns)}): "
+          f"{spread:.0f} в сек. ({spread / alone - 1:+.0%})")
+    print(f"read-your-writes: {len(added)} записей, не увиденных сразу после записи: {missed}")
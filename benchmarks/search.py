@@ -0,0 +1,77 @@
+"""
+Measures the latency of search_clients (first and a deep keyset page) on a generated dataset.
+The clients table of the configured database is filled with synthetic clients, use a scratch database:
+
+    python -m benchmarks.search --clients 1000000
+    python -m benchmarks.search --clients 10000000
+"""
+
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from main import User, create_tables, search_clients
+
+NAMES = ['Ivan', 'Petr', 'Anna', 'Olga', 'Sergey', 'Maria', 'Alexey', 'Elena', 'Dmitry', 'Natalia']
+SURNAMES = ['Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Kuznetsov', 'Popov', 'Vasiliev', 'Sokolov', 'Mikhailov',
+            'Novikov', 'Fedorov', 'Morozov', 'Volkov', 'Alekseev', 'Lebedev', 'Semenov', 'Egorov', 'Pavlov']
+QUERIES = ['petrov', 'smirnova', 'kuznets', 'olga', 'ivan12', '7916', '+7 926 000']
+
+
+def generate(conn, clients):
+    with conn.cursor() as cur:
+        create_tables(cur)
+        cur.execute("SELECT coalesce(max(client_id), 0) FROM clients;")
+        existing = cur.fetchone()[0]
+        for start in range(existing + 1, clients + 1, 1000000):
+            stop = min(start + 999999, clients)
+            cur.execute("""
+                        INSERT INTO clients(client_id, name, surname, email)
+                        SELECT i, (%(names)s::text[])[1 + i %% cardinality(%(names)s::text[])],
+                               (%(surnames)s::text[])[1 + (i / 7) %% cardinality(%(surnames)s::text[])]
+                                   || CASE WHEN i %% 2 = 0 THEN 'a' ELSE '' END,
+                               lower((%(names)s::text[])[1 + i %% cardinality(%(names)s::text[])]) || i
+                                   || '@example.com'
+                          FROM generate_series(%(start)s, %(stop)s) AS i;
+                        INSERT INTO phones(client_id, phone, phone_key)
+                        SELECT i, '+7 9' || lpad((i %% 100)::text, 2, '0') || ' ' || lpad((i / 100)::text, 7, '0'),
+                               ('79' || lpad((i %% 100)::text, 2, '0') || lpad((i / 100)::text, 7, '0'))::bigint
+                          FROM generate_series(%(start)s, %(stop)s) AS i;
+                        """, {'names': NAMES, 'surnames': SURNAMES, 'start': start, 'stop': stop})
+            conn.commit()
+        cur.execute("SELECT setval(pg_get_serial_sequence('clients', 'client_id'), max(client_id)) FROM clients;")
+        cur.execute("ANALYZE clients; ANALYZE phones;")
+        conn.commit()
+
+
+def latency(cur, query, pages, runs):
+    first, deep = [], []
+    for _ in range(runs):
+        cursor = None
+        for page in range(pages):
+            started = time.perf_counter()
+            result = search_clients(cur, query, limit=20, cursor=cursor)
+            (first if page == 0 else deep).append((time.perf_counter() - started) * 1000)
+            if result is None or (cursor := result.next_cursor) is None:
+                break
+        cur.connection.rollback()
+    return statistics.median(first), statistics.median(deep) if deep else float('nan')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000000)
+    parser.add_argument('--pages', type=int, default=10, help='pages walked with the keyset cursor')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    generate(conn, args.clients)
+    with conn.cursor() as cur:
+        print(f"{args.clients} clients, median latency in ms")
+        for query in QUERIES:
+            first, deep = latency(cur, query, args.pages, args.runs)
+            print(f"{query!r:<14} page 1 {first:8.2f}   pages 2-{args.pages} {deep:8.2f}")
+    conn.close()
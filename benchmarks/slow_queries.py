@@ -0,0 +1,80 @@
+"""
+Checks that the slow query log carries the EXPLAIN plan of the hot-path operations, which run as prepared
+statements (EXECUTE): with a threshold of 0 ms every statement is logged, and every logged statement of
+find_client, find_client_by_id, add_phone and delete_phone must have a plan. Exits with 1 if one has none.
+Run from the repository root against a scratch database:
+
+    python -m benchmarks.slow_queries
+"""
+
+import contextlib
+import logging
+import os
+import sys
+
+import psycopg2
+
+import instrumentation
+import main
+from statements import statements
+
+PHONE = '+7 999 000-11-22'
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def logged_statements(cur):
+
+    """
+    Runs the hot-path operations with every statement logged as slow.
+    :param cur: A cursor object (InstrumentedCursor).
+    :return: A list of tuples (operation, statement, plan or None).
+    """
+
+    handler = Records()
+    instrumentation.slow_log.addHandler(handler)
+    instrumentation.enable(slow_query_ms=0)
+    try:
+        client = main.add_client(cur, 'Slow', 'Check', 'slow.check@example.com')
+        main.find_client(cur, 'slow.check@example.com')
+        main.find_client_by_id(cur, client.client_id)
+        main.add_phone(cur, client.client_id, PHONE)
+        main.find_client(cur, PHONE)
+        main.delete_phone(cur, client.client_id, PHONE)
+        main.delete_client(cur, client.client_id)
+    finally:
+        instrumentation.disable()
+        instrumentation.slow_log.removeHandler(handler)
+    results = []
+    for record in handler.records:
+        _, operation, statement, plan = record.args[0], record.args[1], record.args[2], record.args[3]
+        results.append((operation, statement, plan.strip() or None))
+    return results
+
+
+if __name__ == '__main__':
+    statements.enabled = True
+    user = main.User()
+    conn = psycopg2.connect(**user.connect_params(), cursor_factory=instrumentation.InstrumentedCursor)
+    try:
+        with conn.cursor() as cur, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            main.create_tables(cur)
+            results = logged_statements(cur)
+    finally:
+        conn.close()
+    hot = ('find_client', 'find_client_by_id', 'add_phone', 'delete_phone')
+    executed = [(operation, statement, plan) for operation, statement, plan in results
+                if operation in hot and statement.lower().startswith('execute')]
+    missing = [(operation, statement) for operation, statement, plan in executed if plan is None]
+    for operation, statement in missing:
+        print(f"нет плана: {operation}: {statement}")
+    print(f"EXECUTE в горячих операциях: {len(executed)}, без плана: {len(missing)}")
+    sys.exit(1 if missing or not executed else 0)
@@ -0,0 +1,120 @@
+"""
+Builds a snapshot of the clients (snapshot.py) and compares the lookups in it with the same lookups
+in the database: the median latency of find_client by email and by phone and of find_client_by_id,
+then the lookup rate of several processes sharing the mapped file. Also reports the time of a full build
+and of an incremental one after --changes updates. Run from the repository root against a scratch database:
+
+    python -m benchmarks.snapshot --clients 200000 --calls 5000 --processes 4
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import psycopg2
+
+import main
+from benchmarks.datagen import client, load
+from snapshot import Snapshot, build_snapshot
+
+
+def queries(clients, calls):
+
+    """
+    :return: A dict {operation: list of arguments}, the same arguments for the database and the snapshot.
+    """
+
+    picked = [client(i * 7 % clients) for i in range(calls)]
+    return {
+        'find_client email': [email for _, _, email, _ in picked],
+        'find_client phone': [phones[0][0] for _, _, _, phones in picked if phones],
+    }
+
+
+def median_latency(call, arguments):
+
+    """
+    :return: The median latency of the calls in microseconds.
+    """
+
+    latencies = []
+    for argument in arguments:
+        started = time.perf_counter()
+        call(argument)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 10 ** 6
+
+
+def lookups(task):
+
+    """
+    Runs lookups in a worker process on its own mapping of the snapshot.
+    :param task: A tuple (path, list of emails).
+    :return: The number of lookups.
+    """
+
+    path, emails = task
+    with Snapshot(path) as snapshot:
+        for email in emails:
+            snapshot.find_client(email)
+    return len(emails)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200000, help='size of the generated dataset')
+    parser.add_argument('--calls', type=int, default=5000, help='lookups per operation')
+    parser.add_argument('--processes', type=int, default=4, help='processes sharing the snapshot')
+    parser.add_argument('--changes', type=int, default=1000, help='updates before the incremental build')
+    args = parser.parse_args()
+    user = main.User()
+    conn = psycopg2.connect(**user.connect_params())
+    path = os.path.join(tempfile.mkdtemp(), 'clients.snap')
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            load(conn, args.clients)
+            started = time.perf_counter()
+            build_snapshot(conn, path, incremental=False)
+            full = time.perf_counter() - started
+        results = {}
+        with conn.cursor() as cur, open(os.devnull, 'w') as devnull, Snapshot(path) as snapshot:
+            cur.execute("SELECT client_id, name FROM clients ORDER BY client_id LIMIT %s;", (args.calls,))
+            named = cur.fetchall()
+            conn.rollback()
+            operations = queries(args.clients, args.calls)
+            operations['find_client_by_id'] = [client_id for client_id, _ in named]
+            with contextlib.redirect_stdout(devnull):
+                for operation, arguments in operations.items():
+                    search = main.find_client_by_id if operation == 'find_client_by_id' else main.find_client
+                    results[operation] = (
+                        median_latency(lambda argument: (search(cur, argument), conn.rollback()), arguments),
+                        median_latency(getattr(snapshot, search.__name__), arguments))
+                # Every client is renamed and renamed back, two changes each.
+                for client_id, name in named[:args.changes // 2]:
+                    main.update_data(cur, client_id, name='Snapshot')
+                    main.update_data(cur, client_id, name=name)
+                    conn.commit()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stderr):
+                result = build_snapshot(conn, path)
+            incremental = time.perf_counter() - started
+        for operation, (database, mapped) in results.items():
+            print(f"{operation:<18} база {database:8.1f} мкс   снимок {mapped:6.1f} мкс")
+        emails = operations['find_client email']
+        started = time.perf_counter()
+        with Pool(args.processes) as pool:
+            count = sum(pool.map(lookups, [(path, emails * 10)] * args.processes))
+        rate = count / (time.perf_counter() - started)
+        print(f"снимок {os.path.getsize(path) / 2 ** 20:.1f} МБ: полная сборка {full:.2f} сек., "
+              f"дополнение {result.changes} изменениями {incremental:.2f} сек.")
+        print(f"процессов на одном файле: {args.processes}, поисков по email: {rate:.0f} в сек.")
+    finally:
+        conn.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        os.rmdir(os.path.dirname(path))
@@ -0,0 +1,212 @@
+"""
+Runs every client operation of main.py against a generated dataset under concurrency and reports the p50, p95
+and p99 latency and the throughput of each operation as JSON. The database is filled by benchmarks.datagen
+up to --clients; the clients added by the run are deleted again by the delete_client step, so runs can be
+repeated on the same database. Run from the repository root against a scratch database:
+
+    python -m benchmarks.suite --clients 1000000 --operations 5000 --concurrency 16 --output run.json
+    python -m benchmarks.suite --clients 1000000 --baseline run.json
+
+find_client is measured with email and phone lookups: a name lookup returns every namesake, thousands
+of rows at this scale, and would measure the size of the result rather than the lookup.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from benchmarks.datagen import client, load, phone_number
+from repository import ClientRepository
+from validation import phone_key
+
+OPERATIONS = ('add_client', 'add_phone', 'delete_phone', 'find_client', 'find_client_by_id', 'update_data',
+              'delete_client')
+# The clients added by the run and their extra phones use their own ranges of datagen numbers.
+NEW_CLIENTS = 5 * 10 ** 7
+ADDED_PHONES = 3 * 10 ** 8
+UPDATED_PHONES = 4 * 10 ** 8
+
+
+def sample(repo, count, rng):
+
+    """
+    Picks random stored clients for the read operations.
+    :param repo: The repository (ClientRepository).
+    :param count: The number of clients wanted (integer).
+    :param rng: The random generator (random.Random).
+    :return: A list of tuples (client_id, email, one of the phones or None).
+    """
+
+    with repo.cursor() as cur:
+        cur.execute("SELECT min(client_id), max(client_id) FROM clients;")
+        low, high = cur.fetchone()
+        cur.execute("""
+                    SELECT c.client_id, c.email, p.phone
+                      FROM clients c
+                      LEFT JOIN LATERAL (SELECT phone FROM phones WHERE client_id = c.client_id LIMIT 1) p ON true
+                     WHERE c.client_id = ANY(%s);
+                    """, ([rng.randint(low, high) for _ in range(count * 2)],))
+        rows = cur.fetchall()
+        cur.connection.rollback()
+    return (rows * (count // len(rows) + 1))[:count]
+
+
+def phone_stored(repo, client_id, phone):
+    with repo.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM phones WHERE client_id = %s AND phone_key = %s);",
+                    (client_id, phone_key(phone)))
+        return cur.fetchone()[0]
+
+
+# Whether a call did its work. The repository methods print their errors and return None instead of raising,
+# add_phone and delete_phone return nothing, so their outcome is read back after the measured run.
+SUCCEEDED = {
+    'add_client': lambda repo, args, result: result is not None and result.created,
+    'add_phone': lambda repo, args, result: phone_stored(repo, *args),
+    'delete_phone': lambda repo, args, result: not phone_stored(repo, *args),
+    'find_client': lambda repo, args, result: bool(result),
+    'find_client_by_id': lambda repo, args, result: result is not None,
+    'update_data': lambda repo, args, result: result is not None,
+    'delete_client': lambda repo, args, result: result is True,
+}
+
+
+def timed(repo, operation, calls, concurrency):
+
+    """
+    Runs the calls of one operation on a thread pool and measures every call. A call that raises or does not
+    succeed (see SUCCEEDED) is counted in errors, the throughput counts only the successful calls.
+    :param repo: The repository (ClientRepository).
+    :param operation: The name of the repository method (string).
+    :param calls: The arguments of the calls (list of tuples).
+    :param concurrency: The number of threads (integer).
+    :return: A dict with the statistics of the operation.
+    """
+
+    method = getattr(repo, operation)
+
+    def call(args):
+        started = time.perf_counter()
+        try:
+            result, raised = method(*args), False
+        except Exception:
+            result, raised = None, True
+        return time.perf_counter() - started, result, raised
+
+    def failed(args, result, raised):
+        try:
+            return raised or not SUCCEEDED[operation](repo, args, result)
+        except Exception:
+            return True
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, calls))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency * 1000 for latency, _, _ in results)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    errors = sum(failed(args, result, raised) for args, (_, result, raised) in zip(calls, results))
+    return {'count': len(calls), 'errors': errors, 'seconds': round(elapsed, 3),
+            'throughput': round((len(calls) - errors) / elapsed, 1), 'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3), 'p99_ms': round(percentiles[98], 3)}
+
+
+def run(repo, operations, concurrency, selected, seed):
+
+    """
+    Runs the selected operations one after another. The writes work on clients added by the run itself.
+    :param repo: The repository (ClientRepository).
+    :param operations: The number of calls per operation (integer).
+    :param concurrency: The number of threads (integer).
+    :param selected: The names of the operations to run (iterable of strings).
+    :param seed: The seed of the random choices (integer).
+    :return: A dict {operation: statistics}.
+    """
+
+    rng = random.Random(seed)
+    new = [client(i) for i in range(NEW_CLIENTS, NEW_CLIENTS + operations)]
+    emails = [email for _, _, email, _ in new]
+    # A previous run that stopped early may have left its clients behind.
+    leftovers = [found.client_id for found in (repo.find_clients_by_emails(emails) or {}).values() if found]
+    if leftovers:
+        repo.delete_clients(leftovers)
+    stored = sample(repo, operations, rng)
+    calls = {
+        'add_client': [(name, surname, email, [phone for phone, _ in phones])
+                       for name, surname, email, phones in new],
+        'find_client': [(email if phone is None or rng.random() < 0.5 else phone,) for _, email, phone in stored],
+        'find_client_by_id': [(client_id,) for client_id, _, _ in stored],
+    }
+    results = {}
+    ids = []
+    for operation in OPERATIONS:
+        if operation not in selected:
+            continue
+        if operation in ('add_phone', 'update_data', 'delete_phone', 'delete_client') and not ids:
+            found = repo.find_clients_by_emails(emails) or {}
+            ids = [(i, found[email].client_id) for i, email in enumerate(emails) if found.get(email)]
+        if operation in ('add_phone', 'delete_phone'):
+            calls[operation] = [(client_id, phone_number(ADDED_PHONES + i)[0]) for i, client_id in ids]
+        elif operation == 'update_data':
+            calls[operation] = [(client_id, None, new[i][1] + 'a', None,
+                                 [phone for phone, _ in new[i][3][:1]] + [phone_number(UPDATED_PHONES + i)[0]])
+                                for i, client_id in ids]
+        elif operation == 'delete_client':
+            calls[operation] = [(client_id,) for _, client_id in ids]
+        if calls.get(operation):
+            results[operation] = timed(repo, operation, calls[operation], concurrency)
+    return results
+
+
+def compare(results, baseline):
+
+    """
+    Prints the change of throughput and p95 latency against a previous run.
+    :param results: The report of this run (dict).
+    :param baseline: The report of the previous run (dict).
+    :return: None.
+    """
+
+    for operation, stats in results['operations'].items():
+        if (old := baseline.get('operations', {}).get(operation)) is None:
+            continue
+        print(f"{operation:<18} throughput {stats['throughput'] / old['throughput'] - 1:+7.1%}   "
+              f"p95 {stats['p95_ms'] / old['p95_ms'] - 1:+7.1%}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10000, help='size of the generated dataset')
+    parser.add_argument('--operations', type=int, default=1000, help='calls per operation')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', nargs='+', choices=OPERATIONS, default=OPERATIONS, help='operations to run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to a file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    args = parser.parse_args()
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    with ClientRepository(maxconn=args.concurrency) as repo:
+        with repo.connection() as conn, contextlib.redirect_stdout(sys.stderr):
+            load(conn, args.clients)
+            server_version = conn.server_version
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            operations = run(repo, args.operations, args.concurrency, args.only, args.seed)
+    report = {'clients': args.clients, 'operations_per_step': args.operations, 'concurrency': args.concurrency,
+              'seed': args.seed, 'server_version': server_version, 'psycopg2': psycopg2.__version__,
+              'started_at': started_at, 'operations': operations}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
@@ -0,0 +1,51 @@
+"""
+Compares the per-item cost of phone and email validation: the plain check for every value, the memoizing
+Validator, the Validator with a process pool and a repeated pass over the same values. No database is needed:
+
+    python -m benchmarks.validation --items 200000 --unique 20000 --processes 4
+"""
+
+import argparse
+import random
+import time
+
+from validation import Validator, check_mail, check_phone
+
+
+def sample(items, unique):
+    phones = [f'+7 9{random.randint(10, 99)} {random.randint(100, 999)}-{random.randint(10, 99)}-'
+              f'{random.randint(10, 99)}' for _ in range(unique)]
+    emails = [f'user{i}@{random.choice(("mail.ru", "gmail.com", "yandex.ru"))}' for i in range(unique)]
+    return random.choices(phones, k=items), random.choices(emails, k=items)
+
+
+def timed(function, values):
+    started = time.perf_counter()
+    function(values)
+    return (time.perf_counter() - started) / len(values) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--unique', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+    phones, emails = sample(args.items, args.unique)
+    # Every case has its own validator (the phone and email memos are separate), closed with its process pool.
+    with Validator() as memoized, Validator() as pooled, Validator() as repeated:
+        cases = {
+            'plain': (lambda values: [check_phone(value) for value in values],
+                      lambda values: [check_mail(value) for value in values]),
+            'memoized': (memoized.phones, memoized.mails),
+            f'{args.processes} processes': (lambda values: pooled.phones(values, args.processes),
+                                            lambda values: pooled.mails(values, args.processes)),
+        }
+        # A second pass over the same values with one validator is answered from the memo.
+        repeated.phones(phones, args.processes), repeated.mails(emails, args.processes)
+        cases['repeat pass'] = (lambda values: repeated.phones(values, args.processes),
+                                lambda values: repeated.mails(values, args.processes))
+        print(f"{args.items} items, {args.unique} unique values, microseconds per item")
+        for title, (validate_phones, validate_mails) in cases.items():
+            print(f"{title:<12} phones {timed(validate_phones, phones):8.2f}  "
+                  f"emails {timed(validate_mails, emails):8.2f}")
@@ -0,0 +1,61 @@
+"""
+Compares add_client called directly (one transaction and commit per call) with the same calls through
+WriteQueue (group commit) from the same number of threads, and reports the throughput of both.
+The clients added by the run are deleted again. Run from the repository root against a scratch database:
+
+    python -m benchmarks.write_queue --clients 5000 --threads 16
+"""
+
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.datagen import client
+from repository import ClientRepository
+from write_queue import WriteQueue
+
+QUEUE_CLIENTS = 7 * 10 ** 7
+
+
+def run(add, clients, threads):
+
+    """
+    :param add: The function adding one client (name, surname, email, phones).
+    :param clients: The clients (list of tuples from datagen.client).
+    :param threads: The number of threads (integer).
+    :return: The number of added clients per second.
+    """
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda new: add(new[0], new[1], new[2], [phone for phone, _ in new[3]]), clients))
+    return len(clients) / (time.perf_counter() - started)
+
+
+def cleanup(repo, clients):
+    found = repo.find_clients_by_emails([email for _, _, email, _ in clients]) or {}
+    if ids := [found_client.client_id for found_client in found.values() if found_client]:
+        repo.delete_clients(ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--max-items', type=int, default=500)
+    parser.add_argument('--max-delay-ms', type=float, default=10)
+    args = parser.parse_args()
+    clients = [client(QUEUE_CLIENTS + i) for i in range(args.clients)]
+    with ClientRepository(maxconn=args.threads) as repo, open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            repo.create_tables()
+            cleanup(repo, clients)
+            direct = run(repo.add_client, clients, args.threads)
+            cleanup(repo, clients)
+            with WriteQueue(max_items=args.max_items, max_delay_ms=args.max_delay_ms) as write_queue:
+                queued = run(lambda *new: write_queue.add_client(*new).result(), clients, args.threads)
+            cleanup(repo, clients)
+    print(f"add_client напрямую: {direct:.0f} клиентов/сек., через WriteQueue: {queued:.0f} клиентов/сек. "
+          f"(x{queued / direct:.1f})")
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import time
+from itertools import islice
+
+import psycopg2
+from psycopg2 import Error
+
+from main import User, validate_name
+from validation import phone_key, validator
+
+BATCH_SIZE = 5000
+
+
+def read_rows(path):
+
+    """
+    Reads clients from a CSV or JSONL file as a stream.
+    CSV files must have the header "name,surname,email,phones", phones are separated by ";" or ",".
+    JSONL files contain one object per line with the keys "name", "surname", "email" and "phones" (list).
+    :param path: The path to the file (string).
+    :return: A generator of tuples (line number, row dict or None, error message or None).
+    """
+
+    with open(path, encoding='utf-8', newline='') as f:
+        if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson'):
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_no, {'raw': line.rstrip('\n')}, f'Некорректный JSON: {e}'
+                    continue
+                if not isinstance(row, dict):
+                    yield line_no, {'raw': line.rstrip('\n')}, 'Строка не является объектом JSON.'
+                    continue
+                yield line_no, row, None
+        else:
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                phones = row.get('phones') or ''
+                row['phones'] = [phone for phone in re.split(r'[;,]', phones) if phone.strip()]
+                yield line_no, row, None
+
+
+def _phones_of(row):
+
+    """
+    :param row: The row dict.
+    :return: The phones of the row (list of strings), or None if the "phones" value is not a string or a list.
+    """
+
+    phones = row.get('phones') or []
+    if isinstance(phones, str):
+        phones = [phones]
+    if not isinstance(phones, list):
+        return None
+    return [str(phone).strip() for phone in phones]
+
+
+def validate_batch(batch, seen_emails, seen_phones, processes=None):
+
+    """
+    Validates a batch of rows and deduplicates emails and phones within the batch and against the rows already
+    imported. Emails and phones of the whole batch are validated at once by the memoizing validator.
+    :param batch: A list of tuples (line number, row dict, error message or None).
+    :param seen_emails: A set of emails of the committed batches (not changed, the caller adds the emails
+    of a batch after its commit, so a batch that fails to load does not reject its rows elsewhere).
+    :param seen_phones: A set of phones of the committed batches (not changed, see seen_emails).
+    :param processes: The number of processes for validation (integer, optional, default None - no processes).
+    :return: A tuple (accepted rows, rejected rows). Accepted rows are tuples (line number, name, surname, email,
+    phones), rejected rows are tuples (line number, row dict, reason).
+    """
+
+    rows = [row for _, row, error in batch if error is None]
+    emails = [str(row.get('email') or '') for row in rows]
+    phones = [phone for row in rows for phone in _phones_of(row) or []]
+    mails = {result.value: result for result in validator.mails(emails, processes)}
+    numbers = {result.value: result for result in validator.phones(phones, processes)}
+    accepted, rejected = [], []
+    batch_emails, batch_phones = set(), set()
+    for line_no, row, error in batch:
+        if error is not None:
+            rejected.append((line_no, row, error))
+            continue
+        name, surname = str(row.get('name') or ''), str(row.get('surname') or '')
+        if not validate_name(name):
+            rejected.append((line_no, row, f'Некорректное имя: {name!r}'))
+            continue
+        if not validate_name(surname):
+            rejected.append((line_no, row, f'Некорректная фамилия: {surname!r}'))
+            continue
+        if (row_phones := _phones_of(row)) is None:
+            rejected.append((line_no, row, f'Некорректное поле phones: ожидается строка или список, '
+                                           f'получено {type(row["phones"]).__name__}.'))
+            continue
+        if not (mail := mails[str(row.get('email') or '')]).ok:
+            rejected.append((line_no, row, f'Некорректный email: {mail.error}'))
+            continue
+        email = mail.normalized
+        if email in seen_emails or email in batch_emails:
+            rejected.append((line_no, row, f'Email {email} повторяется в файле.'))
+            continue
+        if errors := [numbers[phone].error for phone in row_phones if not numbers[phone].ok]:
+            rejected.append((line_no, row, errors[0]))
+            continue
+        row_phones = list(dict.fromkeys(numbers[phone].normalized for phone in row_phones))
+        if duplicates := [phone for phone in row_phones if phone in seen_phones or phone in batch_phones]:
+            rejected.append((line_no, row, f'Номер {duplicates[0]} повторяется в файле.'))
+            continue
+        batch_emails.add(email)
+        batch_phones.update(row_phones)
+        accepted.append((line_no, name.capitalize(), surname.capitalize(), email, row_phones))
+    return accepted, rejected
+
+
+def _row_dict(row):
+    return {'name': row[1], 'surname': row[2], 'email': row[3], 'phones': row[4]}
+
+
+def reject_existing(cur, accepted):
+
+    """
+    Removes the rows whose email or phones are already stored in the database.
+    :param cur: A cursor object used to execute SQL commands.
+    :param accepted: A list of accepted rows as returned by validate_batch.
+    :return: A tuple (accepted rows, rejected rows).
+    """
+
+    cur.execute("""
+                SELECT email
+                  FROM clients
+                 WHERE email = ANY(%s);
+                """, ([row[3] for row in accepted],))
+    existing_emails = {email for email, in cur.fetchall()}
+    cur.execute("""
+                SELECT phone_key
+                  FROM phones
+                 WHERE phone_key = ANY(%s::bigint[]);
+                """, ([phone_key(phone) for row in accepted for phone in row[4]],))
+    existing_phones = {key for key, in cur.fetchall()}
+    if not existing_emails and not existing_phones:
+        return accepted, []
+    kept, rejected = [], []
+    for row in accepted:
+        if row[3] in existing_emails:
+            rejected.append((row[0], _row_dict(row), f'Клиент с email {row[3]} уже есть в базе данных.'))
+        elif duplicates := [phone for phone in row[4] if phone_key(phone) in existing_phones]:
+            rejected.append((row[0], _row_dict(row), f'Номер {duplicates[0]} уже зарегистрирован.'))
+        else:
+            kept.append(row)
+    return kept, rejected
+
+
+def copy_batch(cur, accepted):
+
+    """
+    Loads a batch of validated clients and their phones with COPY ... FROM STDIN.
+    Client ids are reserved from the clients sequence beforehand, so phones can be copied without a round trip per client.
+    :param cur: A cursor object used to execute SQL commands.
+    :param accepted: A list of accepted rows as returned by validate_batch.
+    :return: The number of copied phones.
+    """
+
+    cur.execute("""
+                SELECT nextval(pg_get_serial_sequence('clients', 'client_id'))
+                  FROM generate_series(1, %s);
+                """, (len(accepted),))
+    client_ids = [client_id for client_id, in cur.fetchall()]
+    clients_buf, phones_buf = io.StringIO(), io.StringIO()
+    clients_writer, phones_writer = csv.writer(clients_buf), csv.writer(phones_buf)
+    phones_count = 0
+    for client_id, (_, name, surname, email, phones) in zip(client_ids, accepted):
+        clients_writer.writerow((client_id, name, surname, email))
+        for phone in phones:
+            phones_writer.writerow((client_id, phone, phone_key(phone)))
+            phones_count += 1
+    clients_buf.seek(0)
+    phones_buf.seek(0)
+    cur.copy_expert("COPY clients(client_id, name, surname, email) FROM STDIN WITH (FORMAT csv)", clients_buf)
+    cur.copy_expert("COPY phones(client_id, phone, phone_key) FROM STDIN WITH (FORMAT csv)", phones_buf)
+    return phones_count
+
+
+def import_clients(conn, path, reject_path=None, batch_size=BATCH_SIZE, processes=None):
+
+    """
+    Imports clients with their phones from a CSV or JSONL file in batches, one transaction per batch.
+    Invalid and duplicate rows are written to the reject file together with the reason.
+    :param conn: A connection object representing the connection to the database.
+    :param path: The path to the CSV or JSONL file (string).
+    :param reject_path: The path to the CSV file for rejected rows (string, optional, default "<path>.rejects.csv").
+    :param batch_size: The number of rows in one batch (integer, optional, default 5000).
+    :param processes: The number of processes for validation (integer, optional, default None - no processes).
+    :return: A dict with the numbers of imported clients, phones and rejected rows.
+    """
+
+    reject_path = reject_path or f'{path}.rejects.csv'
+    stats = {'clients': 0, 'phones': 0, 'rejected': 0}
+    seen_emails, seen_phones = set(), set()
+    started = time.perf_counter()
+    rows = read_rows(path)
+    with open(reject_path, 'w', encoding='utf-8', newline='') as reject_file, conn.cursor() as cur:
+        rejects = csv.writer(reject_file)
+        rejects.writerow(('line', 'reason', 'row'))
+        while batch := list(islice(rows, batch_size)):
+            accepted, rejected = validate_batch(batch, seen_emails, seen_phones, processes)
+            if accepted:
+                try:
+                    accepted, existing = reject_existing(cur, accepted)
+                    rejected.extend(existing)
+                    if accepted:
+                        stats['phones'] += copy_batch(cur, accepted)
+                    conn.commit()
+                    stats['clients'] += len(accepted)
+                    seen_emails.update(row[3] for row in accepted)
+                    seen_phones.update(phone for row in accepted for phone in row[4])
+                except (Exception, Error) as error:
+                    conn.rollback()
+                    print("Ошибка при работе с PostgreSQL, пакет не загружен:", error)
+                    rejected.extend((row[0], _row_dict(row), f'Пакет не загружен: {error}') for row in accepted)
+            for line_no, row, reason in rejected:
+                rejects.writerow((line_no, reason, json.dumps(row, ensure_ascii=False, default=str)))
+            stats['rejected'] += len(rejected)
+            elapsed = time.perf_counter() - started
+            print(f"Загружено клиентов: {stats['clients']}, отклонено строк: {stats['rejected']}, "
+                  f"{(stats['clients'] + stats['rejected']) / elapsed:.0f} строк/сек.")
+    elapsed = time.perf_counter() - started
+    stats['rows_per_sec'] = (stats['clients'] + stats['rejected']) / elapsed if elapsed else 0.0
+    print(f"Импорт завершен за {elapsed:.1f} сек. Клиентов: {stats['clients']}, телефонов: {stats['phones']}, "
+          f"отклонено строк: {stats['rejected']} (см. {reject_path}).")
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Массовый импорт клиентов из CSV или JSONL.')
+    parser.add_argument('path', help='файл CSV (name,surname,email,phones) или JSONL')
+    parser.add_argument('--rejects', help='файл для отклоненных строк (по умолчанию <path>.rejects.csv)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='размер пакета')
+    parser.add_argument('--processes', type=int, help='число процессов для проверки email и телефонов')
+    args = parser.parse_args()
+    user = User()
+    with psycopg2.connect(**user.connect_params()) as conn:
+        import_clients(conn, args.path, args.rejects, args.batch_size, args.processes)
+    conn.close()
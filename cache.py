@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import OrderedDict
+
+from main import search_kind
+from validation import phone_key
+
+MISSING = object()
+
+
+class TTLCache:
+
+    """
+    Thread-safe LRU cache with a bounded size, a time to live for entries and hit/miss counters.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, on_evict=None):
+
+        """
+        :param maxsize: The maximum number of entries (integer, optional, default 10000).
+        :param ttl: The time to live of an entry in seconds (float, optional, default 60).
+        :param on_evict: A function called with the key and the value of every entry dropped from the cache
+        (optional, default None).
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+
+        """
+        Returns the cached value and marks it as recently used.
+        :param key: The key of the entry.
+        :param default: The value returned for a missing or expired entry (optional, default MISSING).
+        :return: The cached value or default.
+        """
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+
+        """
+        Stores a value, the least recently used entries are evicted when the cache is full.
+        :param key: The key of the entry.
+        :param value: The value to store.
+        :return: None.
+        """
+
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def pop(self, key):
+
+        """
+        Removes an entry if it is cached.
+        :param key: The key of the entry.
+        :return: None.
+        """
+
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key)
+
+    def stats(self):
+
+        """
+        :return: A dict with the number of entries, hits and misses.
+        """
+
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def _drop(self, key):
+        _, value = self._data.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
+class ClientCache:
+
+    """
+    Read-through cache for find_client_by_id and find_client.
+    Client records are keyed by client_id, search results by the normalized search data. Every cached search
+    remembers which clients it returned, so a write to a client drops exactly the searches that contain it.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+
+        """
+        :param maxsize: The maximum number of clients and, separately, of search results (integer, optional,
+        default 10000).
+        :param ttl: The time to live of an entry in seconds (float, optional, default 60).
+        """
+
+        self.generation = 0
+        self._searches_by_client = {}
+        self.clients = TTLCache(maxsize, ttl)
+        self.searches = TTLCache(maxsize, ttl, on_evict=self._forget_search)
+        # Evictions call back into the reverse index, one lock for both avoids lock-order inversion.
+        self._lock = self.searches._lock
+
+    @staticmethod
+    def search_key(data):
+
+        """
+        Normalizes the search data the same way find_client interprets it.
+        :param data: The data for search query (string).
+        :return: A tuple (kind of data, normalized data).
+        """
+
+        kind = search_kind(data)
+        if kind == 'phone':
+            return kind, phone_key(data)
+        return kind, data.lower() if kind == 'name' else data
+
+    def get_client(self, client_id):
+        return self.clients.get(client_id)
+
+    def put_client(self, client_id, info, generation):
+
+        """
+        Stores a client record read from the database.
+        :param client_id: The ID of the client (integer).
+        :param info: The client data as returned by find_client_by_id.
+        :param generation: The value of self.generation taken before the read. If anything was invalidated since,
+        the record may be stale and is not stored.
+        :return: None.
+        """
+
+        with self._lock:
+            if generation == self.generation:
+                self.clients.set(client_id, info)
+
+    def get_search(self, data):
+        return self.searches.get(self.search_key(data))
+
+    def put_search(self, data, clients, generation):
+
+        """
+        Stores search results read from the database.
+        :param data: The data for search query (string).
+        :param clients: The clients found (list of rows).
+        :param generation: The value of self.generation taken before the read, see put_client.
+        :return: None.
+        """
+
+        key = self.search_key(data)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.searches.set(key, clients)
+            for client in clients:
+                self._searches_by_client.setdefault(client[0], set()).add(key)
+
+    def invalidate_client(self, client_id):
+
+        """
+        Drops the client record and every cached search that returned the client.
+        :param client_id: The ID of the client (integer).
+        :return: None.
+        """
+
+        with self._lock:
+            self.generation += 1
+            self.clients.pop(client_id)
+            for key in self._searches_by_client.pop(client_id, ()):
+                self.searches.pop(key)
+
+    def invalidate_search(self, *values):
+
+        """
+        Drops the cached searches whose results may change because of the new values.
+        :param values: Names, surnames, emails or phones written to the database (strings, None is skipped).
+        :return: None.
+        """
+
+        with self._lock:
+            self.generation += 1
+            for value in values:
+                if value:
+                    self.searches.pop(self.search_key(value))
+
+    def clear(self):
+
+        """
+        Drops all cached clients and searches, e.g. after a bulk delete.
+        :return: None.
+        """
+
+        with self._lock:
+            self.generation += 1
+            self.clients.clear()
+            self.searches.clear()
+
+    def stats(self):
+        return {'clients': self.clients.stats(), 'searches': self.searches.stats()}
+
+    def _forget_search(self, key, clients):
+        with self._lock:
+            for client in clients:
+                keys = self._searches_by_client.get(client[0])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._searches_by_client[client[0]]
@@ -0,0 +1,399 @@
+"""
+Command line interface to the client database. Every command prints its result as JSON to stdout, the messages
+of the operations go to stderr. Examples:
+
+    python cli.py add Anna Mass anna@mail.ru +79840293847
+    python cli.py find anna@mail.ru
+    python cli.py update 5 --surname Ivanova --phones +79872049384
+    python cli.py list --order surname --limit 100
+    python cli.py batch --batch-size 500 < commands.jsonl
+
+The batch command reads one JSON object per line, e.g. {"command": "get", "client_id": 5}, with the same keys
+as the options of the command, and runs batch-size commands in one transaction on one connection.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+from itertools import islice
+
+import psycopg2
+from psycopg2 import Error, extensions
+
+BATCH_SIZE = 1000
+# Commands that run inside the transaction of a batch; import and export manage their own transactions.
+BATCH_COMMANDS = ('init', 'add', 'find', 'get', 'update', 'delete', 'list', 'search')
+
+
+class CommandError(Exception):
+
+    """
+    Invalid arguments of a command, nothing has been sent to the database.
+    """
+
+
+class BatchConnection(extensions.connection):
+
+    """
+    A connection that runs many operations of main.py in one transaction. Inside batch() the commits
+    of the operations do nothing and their rollbacks undo only the current command, which runs after a savepoint.
+    Outside batch() the connection behaves as usual.
+    """
+
+    in_batch = False
+
+    def commit(self):
+        if not self.in_batch:
+            super().commit()
+
+    def rollback(self):
+        if not self.in_batch:
+            super().rollback()
+            return
+        with self.cursor() as cur:
+            cur.execute("ROLLBACK TO SAVEPOINT batch_command;")
+
+    @contextlib.contextmanager
+    def batch(self):
+
+        """
+        Runs the block in one transaction, committed at the end or rolled back on an exception.
+        :return: None.
+        """
+
+        self.in_batch = True
+        try:
+            yield
+        except BaseException:
+            self.in_batch = False
+            self.rollback()
+            raise
+        self.in_batch = False
+        self.commit()
+
+    @contextlib.contextmanager
+    def command(self):
+
+        """
+        Runs one command of a batch after a savepoint. A failed command, or one that left the transaction aborted,
+        is rolled back to the savepoint, so the other commands of the batch are kept.
+        :return: None.
+        """
+
+        with self.cursor() as cur:
+            cur.execute("SAVEPOINT batch_command;")
+            try:
+                yield
+            except BaseException:
+                self.rollback()
+                raise
+            finally:
+                if self.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+                    self.rollback()
+                cur.execute("RELEASE SAVEPOINT batch_command;")
+
+
+def client_json(client):
+    return None if client is None else dict(client._asdict(), phones=list(client.phones))
+
+
+def checked_name(value, what):
+    from main import validate_name
+
+    if value is not None and not validate_name(value):
+        raise CommandError(f'Некорректное значение: {what} {value}.')
+    return value
+
+
+def checked_mail(email):
+    from validation import validator
+
+    if email is None:
+        return None
+    if not (result := validator.mail(email)).ok:
+        raise CommandError(result.error)
+    return result.normalized
+
+
+def cmd_init(conn, cur, params):
+    from main import create_tables
+
+    create_tables(cur)
+    return {'created': True}
+
+
+def cmd_add(conn, cur, params):
+    from main import add_client
+    from validation import validator
+
+    if not all(params.get(key) for key in ('name', 'surname', 'email')):
+        raise CommandError('Нужно указать имя, фамилию и email.')
+    name, surname = checked_name(params['name'], 'имя'), checked_name(params['surname'], 'фамилия')
+    email = checked_mail(params['email'])
+    checked = [validator.phone(phone) for phone in params.get('phones') or []]
+    result = add_client(cur, name, surname, email, [phone.normalized for phone in checked if phone.ok])
+    if result is None:
+        return None
+    phones = {phone: outcome._asdict() for phone, outcome in result.phones.items()}
+    phones.update({phone.value: {'status': 'invalid', 'error': phone.error} for phone in checked if not phone.ok})
+    return {'client_id': result.client_id, 'created': result.created, 'status': result.status, 'phones': phones}
+
+
+def cmd_find(conn, cur, params):
+    from main import find_client
+
+    clients = find_client(cur, params['data'])
+    return None if clients is None else [client_json(client) for client in clients]
+
+
+def cmd_get(conn, cur, params):
+    from main import find_client_by_id
+
+    return client_json(find_client_by_id(cur, int(params['client_id'])))
+
+
+def cmd_update(conn, cur, params):
+    from main import update_data
+    from validation import validator
+
+    phones = params.get('phones')
+    if phones is not None:
+        checked = [validator.phone(phone) for phone in phones]
+        if errors := [phone.error for phone in checked if not phone.ok]:
+            raise CommandError(' '.join(errors))
+        phones = [phone.normalized for phone in checked]
+    result = update_data(cur, int(params['client_id']), checked_name(params.get('name'), 'имя'),
+                         checked_name(params.get('surname'), 'фамилия'), checked_mail(params.get('email')), phones)
+    return None if result is None else result._asdict()
+
+
+def cmd_delete(conn, cur, params):
+    from main import delete_client
+
+    deleted = delete_client(cur, int(params['client_id']))
+    return None if deleted is None else {'deleted': deleted}
+
+
+def cmd_list(conn, cur, params):
+    from main import LIST_ORDERS, list_clients
+
+    order = params.get('order') or 'client_id'
+    if order not in LIST_ORDERS:
+        raise CommandError(f'Неизвестный порядок: {order}. Доступны: {", ".join(LIST_ORDERS)}.')
+    after = params.get('after')
+    page = list_clients(cur, int(params.get('limit') or 50), tuple(after) if after is not None else None, order,
+                        params.get('name'), params.get('surname'), params.get('email'))
+    if page is None:
+        return None
+    return {'clients': [client_json(client) for client in page.clients], 'next_cursor': page.next_cursor}
+
+
+def cmd_search(conn, cur, params):
+    from main import search_clients
+
+    after = params.get('after')
+    page = search_clients(cur, params['query'], int(params.get('limit') or 20),
+                          tuple(after) if after is not None else None)
+    if page is None:
+        return None
+    return {'clients': [client_json(client) for client in page.clients], 'scores': page.scores,
+            'next_cursor': page.next_cursor}
+
+
+def cmd_import(conn, cur, params):
+    from bulk_import import BATCH_SIZE as IMPORT_BATCH_SIZE, import_clients
+
+    return import_clients(conn, params['path'], params.get('rejects'),
+                          params.get('batch_size') or IMPORT_BATCH_SIZE, params.get('processes'))
+
+
+def cmd_export(conn, cur, params):
+    from export import FETCH_SIZE, export_clients
+
+    try:
+        count = export_clients(conn, params['path'], params.get('format'), params.get('fetch_size') or FETCH_SIZE)
+    except ValueError as error:
+        raise CommandError(str(error))
+    return {'clients': count}
+
+
+COMMANDS = {
+    'init': cmd_init,
+    'add': cmd_add,
+    'find': cmd_find,
+    'get': cmd_get,
+    'update': cmd_update,
+    'delete': cmd_delete,
+    'list': cmd_list,
+    'search': cmd_search,
+    'import': cmd_import,
+    'export': cmd_export,
+}
+
+
+def execute(conn, cur, command, params):
+
+    """
+    Runs one command.
+    :param conn: A connection object (BatchConnection).
+    :param cur: A cursor object used to execute SQL commands.
+    :param command: The name of the command (string).
+    :param params: The arguments of the command (dict).
+    :return: A dict {"command", "ok", "result"}, with "error" if the command has raised an exception.
+    """
+
+    try:
+        result = COMMANDS[command](conn, cur, params)
+    except CommandError as error:
+        return {'command': command, 'ok': False, 'result': None, 'error': str(error)}
+    except Error as error:
+        return {'command': command, 'ok': False, 'result': None, 'error': f'Ошибка при работе с PostgreSQL: {error}'}
+    except (KeyError, TypeError, ValueError) as error:
+        return {'command': command, 'ok': False, 'result': None, 'error': f'Некорректные аргументы: {error!r}'}
+    return {'command': command, 'ok': result is not None, 'result': result}
+
+
+def parse_line(line):
+
+    """
+    :param line: A line of batch input (string).
+    :return: A tuple (command name, dict of arguments), the command is None if the line is not a valid command.
+    """
+
+    try:
+        params = json.loads(line)
+    except ValueError as error:
+        return None, {'error': f'Некорректный JSON: {error}'}
+    if not isinstance(params, dict):
+        return None, {'error': 'Команда должна быть объектом JSON.'}
+    if (command := params.pop('command', None)) not in BATCH_COMMANDS:
+        return None, {'error': f'Неизвестная команда: {command}. Доступны: {", ".join(BATCH_COMMANDS)}.'}
+    return command, params
+
+
+def run_batch(conn, lines, out, batch_size=BATCH_SIZE):
+
+    """
+    Runs commands read from lines, batch_size commands per transaction. The results are written as JSON lines
+    after the transaction of their batch is committed; if the commit fails, every command of the batch fails.
+    :param conn: A connection object (BatchConnection).
+    :param lines: The commands, one JSON object per line (iterable of strings).
+    :param out: The file for the results.
+    :param batch_size: The number of commands in one transaction (integer, optional, default 1000).
+    :return: True if every command has succeeded.
+    """
+
+    commands = (line for line in lines if line.strip())
+    all_ok = True
+    with conn.cursor() as cur:
+        while batch := list(islice(commands, batch_size)):
+            results = []
+            try:
+                with conn.batch():
+                    for line in batch:
+                        command, params = parse_line(line)
+                        if command is None:
+                            results.append({'command': None, 'ok': False, 'result': None, **params})
+                            continue
+                        with conn.command():
+                            results.append(execute(conn, cur, command, params))
+            except Error as error:
+                results = [{'command': result['command'], 'ok': False, 'result': None,
+                            'error': f'Пакет не выполнен: {error}'} for result in results]
+                results.extend({'command': None, 'ok': False, 'result': None, 'error': f'Пакет не выполнен: {error}'}
+                               for _ in range(len(batch) - len(results)))
+            for result in results:
+                all_ok = all_ok and result['ok']
+                out.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+            out.flush()
+    return all_ok
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='clients', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-q', '--quiet', action='store_true', help='не выводить сообщения операций в stderr')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('init', help='создать таблицы и индексы')
+    add = commands.add_parser('add', help='добавить клиента')
+    add.add_argument('name')
+    add.add_argument('surname')
+    add.add_argument('email')
+    add.add_argument('phones', nargs='*', help='номера телефонов c +7...')
+    find = commands.add_parser('find', help='найти клиентов по имени, фамилии, email или телефону')
+    find.add_argument('data')
+    get = commands.add_parser('get', help='найти клиента по id')
+    get.add_argument('client_id', type=int)
+    update = commands.add_parser('update', help='изменить данные клиента')
+    update.add_argument('client_id', type=int)
+    update.add_argument('--name')
+    update.add_argument('--surname')
+    update.add_argument('--email')
+    update.add_argument('--phones', nargs='*', help='новый список телефонов, без значений - удалить все телефоны')
+    delete = commands.add_parser('delete', help='удалить клиента с телефонами')
+    delete.add_argument('client_id', type=int)
+    listing = commands.add_parser('list', help='постраничный список клиентов')
+    listing.add_argument('--limit', type=int, default=50)
+    listing.add_argument('--after', type=json.loads, help='next_cursor предыдущей страницы (JSON)')
+    listing.add_argument('--order', choices=('client_id', 'surname'), default='client_id')
+    listing.add_argument('--name')
+    listing.add_argument('--surname')
+    listing.add_argument('--email')
+    search = commands.add_parser('search', help='нечеткий поиск')
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--after', type=json.loads, help='next_cursor предыдущей страницы (JSON)')
+    import_ = commands.add_parser('import', help='массовый импорт из CSV или JSONL')
+    import_.add_argument('path')
+    import_.add_argument('--rejects', help='файл для отклоненных строк (по умолчанию <path>.rejects.csv)')
+    import_.add_argument('--batch-size', type=int)
+    import_.add_argument('--processes', type=int, help='число процессов для проверки email и телефонов')
+    export = commands.add_parser('export', help='выгрузка в CSV, JSONL или Parquet')
+    export.add_argument('path')
+    export.add_argument('--format', choices=('csv', 'jsonl', 'parquet'))
+    export.add_argument('--fetch-size', type=int)
+    batch = commands.add_parser('batch', help='выполнить команды из stdin (JSON по одной на строку)')
+    batch.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='команд в одной транзакции')
+    return parser
+
+
+def run(argv=None):
+
+    """
+    Runs the command line interface.
+    :param argv: The arguments (list of strings, optional, default sys.argv[1:]).
+    :return: The exit status: 0 on success, 1 if a command has failed.
+    """
+
+    args = build_parser().parse_args(argv)
+    params = vars(args)
+    command, quiet = params.pop('command'), params.pop('quiet')
+
+    from instrumentation import InstrumentedCursor
+    from main import User
+
+    out = sys.stdout
+    user = User()
+    with open(os.devnull, 'w') if quiet else contextlib.nullcontext(sys.stderr) as messages, \
+            contextlib.redirect_stdout(messages):
+        conn = psycopg2.connect(**user.connect_params(),
+                                connection_factory=BatchConnection, cursor_factory=InstrumentedCursor)
+        try:
+            if command == 'batch':
+                return 0 if run_batch(conn, sys.stdin, out, params['batch_size']) else 1
+            with conn.cursor() as cur:
+                result = execute(conn, cur, command, params)
+            conn.commit()
+        finally:
+            conn.close()
+    if 'error' in result:
+        print(result['error'], file=sys.stderr)
+    if result['ok']:
+        out.write(json.dumps(result['result'], ensure_ascii=False, default=str) + '\n')
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,66 @@
+import json
+
+import psycopg2
+
+from main import User, search_query
+
+INDEX_NODES = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+SAMPLES = {
+    'email': 'lotus4@gmail.com',
+    'phone': '+7 984 029-38-47',
+    'name': 'Anna',
+}
+
+
+def scanned_relations(plan):
+
+    """
+    Walks an EXPLAIN (FORMAT JSON) plan and collects the scan nodes of every table.
+    :param plan: A plan node (dict).
+    :return: A list of tuples (table name, node type).
+    """
+
+    nodes = []
+    if 'Relation Name' in plan:
+        nodes.append((plan['Relation Name'], plan['Node Type']))
+    for child in plan.get('Plans', []):
+        nodes.extend(scanned_relations(child))
+    return nodes
+
+
+def check_search_plans(cur):
+
+    """
+    Checks that every lookup path of find_client reads the tables through indexes.
+    Sequential scans are disabled for the check, so a path without a usable index still shows up as Seq Scan
+    even on a small table.
+    :param cur: A cursor object used to execute SQL commands.
+    :return: A dict {lookup path: list of tuples (table name, node type, uses an index)}.
+    """
+
+    result = {}
+    cur.execute("SET LOCAL enable_seqscan = off;")
+    for path, data in SAMPLES.items():
+        query, params = search_query(data)
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        result[path] = [(table, node, node in INDEX_NODES) for table, node in scanned_relations(plan[0]['Plan'])]
+    cur.connection.rollback()
+    return result
+
+
+if __name__ == '__main__':
+    user = User()
+    with psycopg2.connect(**user.connect_params()) as conn:
+        with conn.cursor() as cur:
+            plans = check_search_plans(cur)
+    conn.close()
+    ok = True
+    for path, nodes in plans.items():
+        for table, node, indexed in nodes:
+            ok = ok and indexed
+            print(f"{path:>6}: {table:<8} {node:<18} {'OK' if indexed else 'НЕТ ИНДЕКСА'}")
+    print('Все пути поиска используют индексы.' if ok else 'Есть пути поиска без индекса!')
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from main import User
+
+FETCH_SIZE = 10000
+FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_SQL = """
+    SELECT c.client_id, c.name, c.surname, c.email,
+           (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id)
+      FROM clients c
+     ORDER BY c.client_id
+"""
+COPY_CSV_SQL = """
+    COPY (SELECT c.client_id, c.name, c.surname, c.email,
+                 (SELECT string_agg(phone, ';' ORDER BY phone_id) FROM phones WHERE client_id = c.client_id) AS phones
+            FROM clients c
+           ORDER BY c.client_id)
+      TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+
+def fetch_batches(conn, fetch_size=FETCH_SIZE):
+
+    """
+    Streams all clients with their phones through a server-side cursor.
+    :param conn: A connection object representing the connection to the database.
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: A generator of lists of rows (client_id, name, surname, email, list of phones or None).
+    """
+
+    with conn.cursor(name='export_clients') as cur:
+        cur.execute(EXPORT_SQL)
+        while rows := cur.fetchmany(fetch_size):
+            yield rows
+
+
+def write_csv(conn, f, fetch_size=FETCH_SIZE):
+
+    """
+    Writes clients as CSV in the format accepted by bulk_import.py (phones are separated by ";").
+    The rows are formatted by the server with COPY ... TO STDOUT and streamed to the file.
+    :param conn: A connection object representing the connection to the database.
+    :param f: A text file opened for writing.
+    :param fetch_size: Not used, COPY streams the data in its own chunks.
+    :return: The number of exported clients.
+    """
+
+    with conn.cursor() as cur:
+        cur.copy_expert(COPY_CSV_SQL, f)
+        return cur.rowcount
+
+
+def write_jsonl(conn, f, fetch_size=FETCH_SIZE):
+
+    """
+    Writes clients as JSON lines.
+    :param conn: A connection object representing the connection to the database.
+    :param f: A text file opened for writing.
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: The number of exported clients.
+    """
+
+    count = 0
+    for rows in fetch_batches(conn, fetch_size):
+        f.writelines(json.dumps({'client_id': client_id, 'name': name, 'surname': surname, 'email': email,
+                                 'phones': phones or []}, ensure_ascii=False) + '\n'
+                     for client_id, name, surname, email, phones in rows)
+        count += len(rows)
+    return count
+
+
+def write_parquet(conn, path, fetch_size=FETCH_SIZE):
+
+    """
+    Writes clients as a Parquet file, one row group per fetched batch. Requires pyarrow.
+    :param conn: A connection object representing the connection to the database.
+    :param path: The path to the Parquet file (string).
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: The number of exported clients.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('client_id', pa.int32()), ('name', pa.string()), ('surname', pa.string()),
+                        ('email', pa.string()), ('phones', pa.list_(pa.string()))])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in fetch_batches(conn, fetch_size):
+            columns = list(zip(*rows))
+            columns[4] = [phones or [] for phones in columns[4]]
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type)
+                                                     for column, field in zip(columns, schema)], schema=schema))
+            count += len(rows)
+    return count
+
+
+def export_clients(conn, path, fmt=None, fetch_size=FETCH_SIZE):
+
+    """
+    Exports all clients with their phones to a file. Memory use does not depend on the number of clients.
+    :param conn: A connection object representing the connection to the database.
+    :param path: The path to the output file (string).
+    :param fmt: "csv", "jsonl" or "parquet" (string, optional, default is taken from the file extension).
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: The number of exported clients.
+    """
+
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'Неизвестный формат выгрузки: {fmt}. Доступны: {", ".join(FORMATS)}.')
+    started = time.perf_counter()
+    if fmt == 'parquet':
+        count = write_parquet(conn, path, fetch_size)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            count = (write_csv if fmt == 'csv' else write_jsonl)(conn, f, fetch_size)
+    conn.rollback()
+    elapsed = time.perf_counter() - started
+    print(f"Выгружено клиентов: {count} за {elapsed:.1f} сек. ({count / elapsed if elapsed else 0:.0f} строк/сек.)")
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Выгрузка всех клиентов с телефонами в CSV, JSONL или Parquet.')
+    parser.add_argument('path', help='файл для выгрузки')
+    parser.add_argument('--format', choices=FORMATS, help='формат (по умолчанию по расширению файла)')
+    parser.add_argument('--fetch-size', type=int, default=FETCH_SIZE, help='строк за одно обращение к серверу')
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    try:
+        export_clients(conn, args.path, args.format, args.fetch_size)
+    finally:
+        conn.close()
@@ -0,0 +1,330 @@
+import functools
+import json
+import logging
+import threading
+import time
+
+from psycopg2 import extensions
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_LABEL_SIZE = 120
+# EXECUTE runs the prepared hot-path statements (statements.py), EXPLAIN EXECUTE name(...) plans them.
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete', 'execute')
+HELP = {
+    'clients_db_operation_seconds': 'Duration of the client operations.',
+    'clients_db_operation_statements_total': 'Statements (round trips) sent by the client operations.',
+    'clients_db_operation_rows_total': 'Rows returned or changed by the statements of the client operations.',
+    'clients_db_operation_errors_total': 'Client operations that raised an exception.',
+    'clients_db_statement_seconds': 'Duration of the statements.',
+    'clients_db_statement_rows_total': 'Rows returned or changed by the statements.',
+    'clients_db_statement_errors_total': 'Statements that failed.',
+    'clients_db_slow_statements_total': 'Statements slower than the slow query threshold.',
+}
+
+slow_log = logging.getLogger('clients_db.slow_queries')
+
+
+class Histogram:
+
+    """
+    Cumulative histogram of observed values with fixed bucket bounds, as in Prometheus.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+
+    """
+    In-process registry of counters and histograms keyed by metric name and labels.
+    The metrics can be dumped as a dict (snapshot) or in the Prometheus text format (prometheus).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+
+        """
+        Increases a counter.
+        :param name: The metric name (string).
+        :param labels: The labels (tuple of pairs (label, value)).
+        :param amount: The increment (number, optional, default 1).
+        :return: None.
+        """
+
+        with self._lock:
+            self._counters[name, labels] = self._counters.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, value):
+
+        """
+        Adds a value to a histogram.
+        :param name: The metric name (string).
+        :param labels: The labels (tuple of pairs (label, value)).
+        :param value: The observed value (number).
+        :return: None.
+        """
+
+        with self._lock:
+            if (histogram := self._histograms.get((name, labels))) is None:
+                histogram = self._histograms[name, labels] = Histogram()
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+
+        """
+        :return: A dict {"counters": list of dicts, "histograms": list of dicts} with the current values.
+        """
+
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                                'buckets': dict(zip(h.buckets, h.counts))}
+                               for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0])],
+            }
+
+    def prometheus(self):
+
+        """
+        :return: The metrics in the Prometheus text exposition format (string).
+        """
+
+        lines, described = [], set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.extend((f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} {kind}'))
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name, 'counter')
+                lines.append(f'{name}{_labels(labels)} {value}')
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0]):
+                describe(name, 'histogram')
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {h.count}')
+                lines.append(f'{name}_sum{_labels(labels)} {h.sum}')
+                lines.append(f'{name}_count{_labels(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+
+
+class _State(threading.local):
+    operations = ()
+
+
+class _Settings:
+    enabled = False
+    slow_query_seconds = None
+    explain = True
+
+
+settings = _Settings()
+_local = _State()
+
+
+def enable(slow_query_ms=None, explain=True):
+
+    """
+    Turns the instrumentation on for all threads.
+    :param slow_query_ms: Statements slower than this are logged to the "clients_db.slow_queries" logger
+    (number, optional, default None - no logging).
+    :param explain: Whether the slow statements are logged with their EXPLAIN plan (boolean, optional, default True).
+    :return: None.
+    """
+
+    settings.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+    settings.explain = explain
+    settings.enabled = True
+
+
+def disable():
+    settings.enabled = False
+
+
+def instrumented(func):
+
+    """
+    Records the duration, the statements and the rows of an operation. While the instrumentation is disabled
+    the wrapper only checks one flag.
+    :param func: The operation (function).
+    :return: The wrapped function.
+    """
+
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not settings.enabled:
+            return func(*args, **kwargs)
+        labels = (('operation', name),)
+        stats = [0, 0]
+        _local.operations = _local.operations + ((name, stats),)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            registry.inc('clients_db_operation_errors_total', labels)
+            raise
+        finally:
+            registry.observe('clients_db_operation_seconds', labels, time.perf_counter() - started)
+            registry.inc('clients_db_operation_statements_total', labels, stats[0])
+            registry.inc('clients_db_operation_rows_total', labels, stats[1])
+            _local.operations = _local.operations[:-1]
+
+    return wrapper
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(query):
+
+    """
+    Shortens a statement to a metric label: whitespace is collapsed and the text is cut to STATEMENT_LABEL_SIZE.
+    :param query: The statement (string).
+    :return: The label (string).
+    """
+
+    return ' '.join(query.split())[:STATEMENT_LABEL_SIZE]
+
+
+class InstrumentedCursor(extensions.cursor):
+
+    """
+    A cursor that times every statement while the instrumentation is enabled. Pass it as cursor_factory
+    to psycopg2.connect or to a connection pool.
+    """
+
+    def execute(self, query, vars=None):
+        if not settings.enabled:
+            return super().execute(query, vars)
+        return self._timed(super().execute, query, vars, query, vars)
+
+    def executemany(self, query, vars_list):
+        if not settings.enabled:
+            return super().executemany(query, vars_list)
+        return self._timed(super().executemany, query, None, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not settings.enabled:
+            return super().copy_expert(sql, file, size)
+        return self._timed(super().copy_expert, sql, None, sql, file, size)
+
+    def _timed(self, method, query, vars, *args):
+        if not isinstance(query, str):
+            query = query.as_string(self) if hasattr(query, 'as_string') else query.decode()
+        operation, stats = _local.operations[-1] if _local.operations else (None, None)
+        labels = (('operation', operation or ''), ('statement', statement_label(query)))
+        started = time.perf_counter()
+        try:
+            result = method(*args)
+        except BaseException:
+            registry.inc('clients_db_statement_errors_total', labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.observe('clients_db_statement_seconds', labels, elapsed)
+            rows = max(self.rowcount, 0)
+            registry.inc('clients_db_statement_rows_total', labels, rows)
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += rows
+        if settings.slow_query_seconds is not None and elapsed >= settings.slow_query_seconds:
+            registry.inc('clients_db_slow_statements_total', labels)
+            plan = self._explain(query, vars) if settings.explain else None
+            slow_log.warning("Медленный запрос %.1f мс, операция %s: %s%s", elapsed * 1000, operation or '-',
+                             ' '.join(query.split()), f'\n{plan}' if plan else '')
+        return result
+
+    def _explain(self, query, vars):
+
+        """
+        Gets the plan of a statement without running it. A savepoint keeps a failed EXPLAIN from aborting
+        the transaction of the operation.
+        :return: The plan (string), or None if the statement cannot be explained.
+        """
+
+        if not query.lstrip().lower().startswith(EXPLAINABLE):
+            return None
+        conn = self.connection
+        in_transaction = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS
+        cur = extensions.cursor(conn)
+        try:
+            if in_transaction:
+                cur.execute("SAVEPOINT instrumentation_explain;")
+            try:
+                cur.execute("EXPLAIN " + query, vars)
+                plan = '\n'.join(line for line, in cur.fetchall())
+            except Exception:
+                plan = None
+                if in_transaction:
+                    cur.execute("ROLLBACK TO SAVEPOINT instrumentation_explain;")
+            if in_transaction:
+                cur.execute("RELEASE SAVEPOINT instrumentation_explain;")
+            return plan
+        finally:
+            cur.close()
+
+
+def serve_metrics(port=9108, host='127.0.0.1'):
+
+    """
+    Serves the registry for scraping in a background thread: /metrics in the Prometheus format,
+    /metrics.json as a snapshot.
+    :param port: The port (integer, optional, default 9108).
+    :param host: The address to listen on (string, optional, default "127.0.0.1").
+    :return: The server (ThreadingHTTPServer), call shutdown() to stop it.
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                body, content_type = json.dumps(registry.snapshot()).encode(), 'application/json'
+            else:
+                body, content_type = registry.prometheus().encode(), 'text/plain; version=0.0.4'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
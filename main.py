@@ -1,11 +1,41 @@
+import itertools
 import os
 import re
-import pandas as pd
-import phonenumbers
+import sys
+import time
 import psycopg2
 from dotenv import load_dotenv, find_dotenv
-from email_validator import validate_email
 from psycopg2 import Error
+from typing import NamedTuple
+
+from instrumentation import InstrumentedCursor, instrumented
+from presentation import print_clients
+from statements import statements
+from validation import phone_key, validator
+
+
+class Client(NamedTuple):
+
+    """
+    A client record returned by the search functions.
+    """
+
+    client_id: int
+    name: str
+    surname: str
+    email: str
+    phones: tuple = ()
+
+    @classmethod
+    def from_row(cls, row):
+
+        """
+        Builds a record from a row (client_id, name, surname, email, array of phones).
+        :param row: The row fetched from the database (tuple).
+        :return: A Client.
+        """
+
+        return cls(row[0], row[1], row[2], row[3], tuple(row[4] or ()))
 
 
 class User:
@@ -15,6 +45,33 @@ class User:
         self.db_name = os.getenv('db_name')
         self.user = os.getenv('user')
         self.password = os.getenv('password')
+        self.primary_dsn = os.getenv('primary_dsn')
+        self.replica_dsns = [dsn.strip() for dsn in os.getenv('replica_dsns', '').split(';') if dsn.strip()]
+
+    def connect_params(self):
+
+        """
+        :return: The keyword arguments of psycopg2.connect for the primary: primary_dsn if it is set,
+        otherwise db_name, user and password.
+        """
+
+        if self.primary_dsn:
+            return {'dsn': self.primary_dsn}
+        return {'database': self.db_name, 'user': self.user, 'password': self.password}
+
+
+def normalize_mail(email):
+
+    """
+    Normalizes an email address without printing anything, for use in batch processing.
+    :param email: The email address to normalize (string).
+    :return: The normalized version of the email address.
+    :raises ValueError: If the email address is not valid.
+    """
+
+    if (result := validator.mail(email)).ok:
+        return result.normalized
+    raise ValueError(result.error)
 
 
 def validate_mail(email):
@@ -26,13 +83,25 @@ def validate_mail(email):
     Else prints an error message and returns None.
     """
 
-    try:
-        email_info = validate_email(email, check_deliverability=False)
-        return email_info.normalized
-    except ValueError as e:
-        print(str(e))
-        print('Вы ввели некорректный адрес эл. почты.')
-        return None
+    if (result := validator.mail(email)).ok:
+        return result.normalized
+    print(result.error)
+    print('Вы ввели некорректный адрес эл. почты.')
+    return None
+
+
+def normalize_phone(phone):
+
+    """
+    Normalizes a phone number without printing anything, for use in batch processing.
+    :param phone: The phone number to normalize (string).
+    :return: The formatted international version of the phone number.
+    :raises ValueError: If the phone number does not exist or is not valid.
+    """
+
+    if (result := validator.phone(phone)).ok:
+        return result.normalized
+    raise ValueError(result.error)
 
 
 def validate_phone(phone):
@@ -44,18 +113,10 @@ def validate_phone(phone):
     Else prints an error message and returns None.
     """
 
-    try:
-        p = phonenumbers.parse(phone)
-        valid_number = phonenumbers.is_valid_number(p)
-        if valid_number:
-            phone = phonenumbers.format_number(p, phonenumbers.PhoneNumberFormat.INTERNATIONAL)
-            return phone
-        else:
-            print(f'Номер {phone} не валиден. ')
-            return None
-    except Exception:
-        print(f'Номер {phone} не существует. Попытайтесь ввести номер заново с помощью команды "3".')
-        return None
+    if (result := validator.phone(phone)).ok:
+        return result.normalized
+    print(f'{result.error} Попытайтесь ввести номер заново.')
+    return None
 
 
 def validate_name(name):
@@ -70,10 +131,73 @@ def validate_name(name):
     return bool(re.match(pattern, name))
 
 
+PHONE_KEY_INDEX = "CREATE UNIQUE INDEX {concurrently} IF NOT EXISTS phones_phone_key_idx ON phones(phone_key);"
+PHONE_PREFIX_INDEX = ("CREATE INDEX {concurrently} IF NOT EXISTS phones_key_prefix_idx "
+                      "ON phones((phone_key::text) text_pattern_ops);")
+TRIGRAM_INDEXES = (
+    "CREATE INDEX {concurrently} IF NOT EXISTS clients_name_trgm_idx ON clients USING gin (lower(name) gin_trgm_ops);",
+    "CREATE INDEX {concurrently} IF NOT EXISTS clients_surname_trgm_idx "
+    "ON clients USING gin (lower(surname) gin_trgm_ops);",
+    "CREATE INDEX {concurrently} IF NOT EXISTS clients_email_trgm_idx ON clients USING gin (lower(email) gin_trgm_ops);",
+)
+CHANGE_LOG_SQL = """
+    CREATE TABLE IF NOT EXISTS client_changes(
+     change_id BIGSERIAL PRIMARY KEY,
+           seq BIGINT UNIQUE,
+        entity TEXT NOT NULL,
+     operation TEXT NOT NULL,
+     client_id INTEGER,
+     entity_id BIGINT NOT NULL,
+          data JSONB NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS client_changes_unassigned_idx ON client_changes(change_id) WHERE seq IS NULL;
+
+    CREATE OR REPLACE FUNCTION log_client_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO client_changes(entity, operation, client_id, entity_id, data)
+            SELECT TG_ARGV[0], 'insert', (r ->> 'client_id')::integer, (r ->> TG_ARGV[1])::bigint, r
+              FROM (SELECT to_jsonb(n) AS r FROM new_rows n) AS rows
+             ORDER BY (r ->> TG_ARGV[1])::bigint;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO client_changes(entity, operation, client_id, entity_id, data)
+            SELECT TG_ARGV[0], 'update', (n.r ->> 'client_id')::integer, (n.r ->> TG_ARGV[1])::bigint, n.r
+              FROM (SELECT to_jsonb(n) AS r FROM new_rows n) AS n
+              JOIN (SELECT to_jsonb(o) AS r FROM old_rows o) AS o ON o.r -> TG_ARGV[1] = n.r -> TG_ARGV[1]
+             WHERE n.r <> o.r
+             ORDER BY (n.r ->> TG_ARGV[1])::bigint;
+        ELSE
+            INSERT INTO client_changes(entity, operation, client_id, entity_id, data)
+            SELECT TG_ARGV[0], 'delete', (r ->> 'client_id')::integer, (r ->> TG_ARGV[1])::bigint, r
+              FROM (SELECT to_jsonb(o) AS r FROM old_rows o) AS rows
+             ORDER BY (r ->> TG_ARGV[1])::bigint;
+        END IF;
+        RETURN NULL;
+    END;
+    $$;
+"""
+# Statement-level triggers with transition tables: a multi-row statement or a COPY writes its changes
+# with one INSERT instead of a call per row.
+CHANGE_TRIGGERS = {
+    f'{table}_log_{event.lower()}': f"""
+        CREATE TRIGGER {table}_log_{event.lower()} AFTER {event} ON {table}
+        REFERENCING {transition}
+        FOR EACH STATEMENT EXECUTE FUNCTION log_client_changes('{entity}', '{key}');
+        """
+    for table, entity, key in (('clients', 'client', 'client_id'), ('phones', 'phone', 'phone_id'))
+    for event, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                              ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows'))
+}
+
+
+@instrumented
 def create_tables(cur):
 
     """
-    Creates two tables in a PostgreSQL database if they do not already exist.
+    Creates two tables and their search indexes in a PostgreSQL database if they do not already exist,
+    and the change log (client_changes) filled by triggers on both tables.
     :param cur: A cursor object used to execute SQL commands.
     :return: None.
     """
@@ -89,12 +213,38 @@ def create_tables(cur):
     cur.execute("""
                     CREATE TABLE IF NOT EXISTS phones(
                      phone_id SERIAL PRIMARY KEY,
-                    client_id INTEGER REFERENCES clients(client_id),
-                        phone TEXT UNIQUE
+                    client_id INTEGER REFERENCES clients(client_id) ON DELETE CASCADE,
+                        phone TEXT,
+                    phone_key BIGINT
                     );
     """)
+    cur.execute("ALTER TABLE phones ADD COLUMN IF NOT EXISTS phone_key BIGINT;")
+    cur.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS clients_email_idx ON clients(email);
+                    CREATE INDEX IF NOT EXISTS clients_name_idx ON clients(lower(name));
+                    CREATE INDEX IF NOT EXISTS clients_surname_idx ON clients(lower(surname));
+                    CREATE INDEX IF NOT EXISTS clients_surname_name_idx
+                        ON clients(lower(surname), lower(name), client_id);
+                    CREATE INDEX IF NOT EXISTS phones_client_id_idx ON phones(client_id);
+    """)
+    cur.execute(PHONE_KEY_INDEX.format(concurrently=''))
+    cur.execute(PHONE_PREFIX_INDEX.format(concurrently=''))
+    cur.execute(CHANGE_LOG_SQL)
+    cur.execute("SELECT tgname FROM pg_trigger WHERE tgname = ANY(%s);", (list(CHANGE_TRIGGERS),))
+    existing = {name for name, in cur.fetchall()}
+    for name, statement in CHANGE_TRIGGERS.items():
+        if name not in existing:
+            cur.execute(statement)
+    cur.execute("SAVEPOINT before_trigram_indexes;")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        for statement in TRIGRAM_INDEXES:
+            cur.execute(statement.format(concurrently=''))
+    except (Exception, Error) as error:
+        cur.execute("ROLLBACK TO SAVEPOINT before_trigram_indexes;")
+        print("Нечеткий поиск недоступен: не удалось создать расширение pg_trgm.", error)
     try:
-        conn.commit()
+        cur.connection.commit()
         print('Таблицы успешно созданы.')
     except (Exception, Error) as error:
         print("Ошибка при работе с PostgreSQL", error)
@@ -102,57 +252,180 @@ def create_tables(cur):
     return
 
 
+ADD_CLIENT_SQL = """
+    WITH new_client AS (
+        INSERT INTO clients(name, surname, email)
+             VALUES (%(name)s, %(surname)s, %(email)s)
+        ON CONFLICT (email) DO NOTHING
+          RETURNING client_id
+    ),
+    wanted AS (
+        SELECT DISTINCT ON (phone_key) *
+          FROM unnest(%(phones)s::text[], %(phone_keys)s::bigint[]) WITH ORDINALITY AS w(phone, phone_key, ord)
+         ORDER BY phone_key, ord
+    ),
+    inserted AS (
+        INSERT INTO phones(client_id, phone, phone_key)
+        SELECT n.client_id, w.phone, w.phone_key
+          FROM new_client n, wanted w
+         ORDER BY w.ord
+        ON CONFLICT (phone_key) DO NOTHING
+          RETURNING phone_id, phone_key
+    )
+    SELECT n.client_id, e.client_id, w.phone_key, i.phone_id, p.client_id
+      FROM (SELECT 1) AS one
+      LEFT JOIN new_client n ON true
+      LEFT JOIN clients e ON e.email = %(email)s
+      LEFT JOIN wanted w ON true
+      LEFT JOIN inserted i ON i.phone_key = w.phone_key
+      LEFT JOIN phones p ON p.phone_key = w.phone_key
+     ORDER BY w.ord;
+"""
+ADD_CLIENT_ATTEMPTS = 3
+
+
+class PhoneOutcome(NamedTuple):
+
+    """
+    What add_client did with one phone number: "added", "taken" (registered for another client), "invalid"
+    (the number cannot be parsed) or "skipped" (the client already existed, nothing was added).
+    """
+
+    status: str
+    phone_id: int = None
+    client_id: int = None
+
+
+class AddClientResult(NamedTuple):
+
+    """
+    The result of add_client: the id of the new or of the already existing client, the outcome of every phone
+    and the status: "created", "existing" (a client with the email was already stored, nothing was added)
+    or "conflict" (a concurrent transaction holds the email and its client could not be read in
+    ADD_CLIENT_ATTEMPTS attempts, client_id is None and nothing was added).
+    """
+
+    client_id: int
+    created: bool
+    phones: dict
+    status: str = 'created'
+
+
+def add_client_params(name, surname, email, phones):
+
+    """
+    Packs a new client into the parameters of ADD_CLIENT_SQL.
+    :param name: The client's first name (string).
+    :param surname: The client's last name (string).
+    :param email: The client's email address (string).
+    :param phones: The client's phone numbers (list of strings).
+    :return: A dict of parameters.
+    """
+
+    keys = [(phone, key) for phone in phones if (key := phone_key(phone)) is not None]
+    return {'name': name.capitalize(), 'surname': surname.capitalize(), 'email': email,
+            'phones': [phone for phone, _ in keys], 'phone_keys': [key for _, key in keys]}
+
+
+def add_client_result(phones, rows):
+
+    """
+    Builds the result of add_client from the rows returned by ADD_CLIENT_SQL.
+    :param phones: The client's phone numbers (list of strings).
+    :param rows: The rows (new client id, existing client id, phone key, new phone id, owner of the phone).
+    :return: An AddClientResult.
+    """
+
+    created_id, existing_id = rows[0][:2]
+    found = {key: PhoneOutcome('added', phone_id, created_id) if phone_id is not None
+             else PhoneOutcome('taken', None, owner_id)
+             for _, _, key, phone_id, owner_id in rows if key is not None}
+    outcomes = {}
+    for phone in phones:
+        if (key := phone_key(phone)) is None:
+            outcomes[phone] = PhoneOutcome('invalid')
+        elif created_id is None:
+            outcomes[phone] = PhoneOutcome('skipped')
+        else:
+            outcomes[phone] = found[key]
+    if created_id is not None:
+        return AddClientResult(created_id, True, outcomes, 'created')
+    return AddClientResult(existing_id, False, outcomes, 'existing' if existing_id is not None else 'conflict')
+
+
+def report_added_client(email, result):
+
+    """
+    Prints the outcome of add_client.
+    :param email: The client's email address (string).
+    :param result: The result of add_client (AddClientResult).
+    :return: None.
+    """
+
+    if result.status == 'conflict':
+        print(f"Клиент не добавлен: email {email} одновременно добавляется в другой транзакции. Повторите попытку.")
+        return
+    if result.status == 'existing':
+        print(f"Клиент с email {email} уже есть в базе данных. Id клиента: {result.client_id}. ")
+        return
+    print("Готово! Id клиента: ", result.client_id)
+    for phone, outcome in result.phones.items():
+        if outcome.status == 'added':
+            print(f"Телефон {phone} добавлен для клиента {result.client_id}, id: {outcome.phone_id}")
+        elif outcome.status == 'taken':
+            print(f"Номер {phone} уже зарегистрирован для клиента id {outcome.client_id}.")
+        else:
+            print(f'Номер {phone} не валиден.')
+
+
+@instrumented
 def add_client(cur, name, surname, email, phones=None):
 
     """
     Adds a new client to the clients table in a PostgreSQL database, along with any associated phone numbers.
+    The client and the phones are inserted by one statement in one transaction: a duplicate email leaves
+    the database unchanged, a phone registered for another client is skipped. The statement is repeated
+    if a concurrent transaction has added the same email but is not visible yet; if it is still not visible after
+    ADD_CLIENT_ATTEMPTS attempts, the result has the status "conflict".
     :param cur: A cursor object used to execute SQL commands.
     :param name: The client's first name (string).
     :param surname: The client's last name (string).
     :param email: The client's email address (string).
     :param phones: The client's phone numbers (list of strings, optional, default None).
-    :return: None.
+    :return: The client id, the status and the outcome of every phone (AddClientResult), or None on error.
     """
 
+    phones = [phone for phone in phones or [] if phone is not None]
+    params = add_client_params(name, surname, email, phones)
     try:
-        cur.execute("""
-                            SELECT client_id
-                            FROM clients
-                            WHERE email = %s;
-                            """, (email,))
-        if (existing_mail := cur.fetchone()) is not None:
-            print(f"Клиент с email {email} уже есть в базе данных. Id клиента: {existing_mail[0]}. ")
-            return
-        cur.execute("""
-                    INSERT INTO clients(name, surname, email) 
-                         VALUES (%s, %s, %s) 
-                      RETURNING client_id;
-        """, (name.capitalize(), surname.capitalize(), email))
-        print("Готово! Id клиента: ", (client_id := cur.fetchone())[0])
-        conn.commit()
+        for _ in range(ADD_CLIENT_ATTEMPTS):
+            cur.execute(ADD_CLIENT_SQL, params)
+            rows = cur.fetchall()
+            if rows[0][0] is not None or rows[0][1] is not None:
+                break
+        cur.connection.commit()
     except (Exception, Error) as error:
+        cur.connection.rollback()
         print("Ошибка добавления клиента в Базу данных: ошибка при работе с PostgreSQL", error)
         return
-    if phones is not None:
-        for phone in phones:
-            if phone is not None:
-                try:
-                    cur.execute("""
-                    INSERT INTO phones(client_id, phone)
-                         VALUES (%s, %s)
-                      RETURNING phone_id;
-                    """, (client_id, phone))
-                    print(f"Телефон {phone} добавлен для клиента {client_id[0]}, id: {cur.fetchone()[0]}")
-                    conn.commit()
-                except psycopg2.errors.ForeignKeyViolation:
-                    print(f"Ошибка добавления телефона {phone} в Базу данных: нет пользователя с id {client_id}.")
-                    return
-                except (Exception, Error) as error:
-                    print("Ошибка добавления телефона: ошибка при работе с PostgreSQL", error)
-                    return
-    return
+    result = add_client_result(phones, rows)
+    report_added_client(email, result)
+    return result
+
+
+ADD_PHONE = statements.register('add_phone', """
+    INSERT INTO phones(client_id, phone, phone_key)
+         VALUES (%s, %s, %s)
+      RETURNING phone_id;
+""")
+PHONE_OWNER = statements.register('phone_owner', """
+    SELECT phone_id, client_id
+      FROM phones
+     WHERE phone_key = %s;
+""")
 
 
+@instrumented
 def add_phone(cur, client_id, phone):
 
     """
@@ -163,39 +436,49 @@ def add_phone(cur, client_id, phone):
     :return: None.
     """
 
+    if (key := phone_key(phone)) is None:
+        print(f'Номер {phone} не валиден.')
+        return
     cur.execute("""
                 SAVEPOINT before_add_phone;
     """)
     try:
-        cur.execute("""
-                    INSERT INTO phones(client_id, phone)
-                         VALUES (%s, %s)
-                      RETURNING phone_id;
-                    """, (client_id, phone))
+        statements.execute(cur, ADD_PHONE, (client_id, phone, key))
         print(f"Номер {phone} c id {cur.fetchone()[0]} успешно добавлен для клиента {client_id}")
-        conn.commit()
+        cur.connection.commit()
     except psycopg2.errors.ForeignKeyViolation:
+        cur.connection.rollback()
         print("Клиента с таким id нет в базе данных. ")
         return
     except psycopg2.errors.UniqueViolation:
         cur.execute("""
                     ROLLBACK TO SAVEPOINT before_add_phone;
         """)
-        conn.commit()
-        cur.execute("""
-                    SELECT phone_id, 
-                           client_id 
-                      FROM phones
-                     WHERE phone = %s;
-                    """, (phone,))
+        cur.connection.commit()
+        statements.execute(cur, PHONE_OWNER, (key,))
         print(f"Номер {phone} уже зарегистрирован для клиента id {cur.fetchall()[0][1]}.")
         return
     except (Exception, Error) as error:
+        cur.connection.rollback()
         print("Ошибка при работе с PostgreSQL", error)
         return
     return
 
 
+CLIENT_PHONE = statements.register('client_phone', """
+    SELECT phone_id
+      FROM phones
+     WHERE client_id = %s AND
+           phone_key = %s;
+""")
+DELETE_PHONE = statements.register('delete_phone', """
+    DELETE FROM phones
+     WHERE client_id = %s AND
+           phone_key = %s;
+""")
+
+
+@instrumented
 def delete_phone(cur, client_id, phone):
 
     """
@@ -207,12 +490,7 @@ def delete_phone(cur, client_id, phone):
     """
 
     try:
-        cur.execute("""
-                    SELECT phone_id 
-                      FROM phones
-                     WHERE client_id = %s AND
-                           phone = %s;
-                    """, (client_id, phone))
+        statements.execute(cur, CLIENT_PHONE, (client_id, phone_key(phone)))
         phone_id = cur.fetchone()
         if phone_id is None:
             print(f"Не зарегистрирован номер {phone} для клиента {client_id}. Проверьте корректность ввода. ")
@@ -222,13 +500,9 @@ def delete_phone(cur, client_id, phone):
         cur.execute("""
                     SAVEPOINT delete_phone_savepoint;
                     """)
-        cur.execute("""
-                    DELETE FROM phones
-                     WHERE client_id = %s AND
-                           phone = %s;
-                    """, (client_id, phone))
+        statements.execute(cur, DELETE_PHONE, (client_id, phone_key(phone)))
         try:
-            conn.commit()
+            cur.connection.commit()
             print("Номер успешно удален.")
         except psycopg2.errors.TransactionRollbackError:
             cur.execute("""
@@ -245,168 +519,763 @@ def delete_phone(cur, client_id, phone):
     return
 
 
+UPDATE_CLIENTS_SQL = """
+    WITH changes AS (
+        SELECT *
+          FROM unnest(%(client_ids)s::integer[], %(names)s::varchar[], %(surnames)s::varchar[],
+                      %(emails)s::varchar[]) AS ch(client_id, name, surname, email)
+         WHERE ch.name IS NOT NULL OR ch.surname IS NOT NULL OR ch.email IS NOT NULL
+    ),
+    updated AS (
+        UPDATE clients c
+           SET name = COALESCE(ch.name, c.name),
+               surname = COALESCE(ch.surname, c.surname),
+               email = COALESCE(ch.email, c.email)
+          FROM changes ch
+         WHERE c.client_id = ch.client_id
+     RETURNING c.client_id
+    ),
+    wanted AS (
+        SELECT DISTINCT ON (client_id, phone_key) *
+          FROM unnest(%(phone_client_ids)s::integer[], %(phones)s::text[], %(phone_keys)s::bigint[])
+               AS w(client_id, phone, phone_key)
+    ),
+    deleted AS (
+        DELETE FROM phones p
+         WHERE p.client_id = ANY(%(replace_phones)s::integer[])
+           AND NOT EXISTS (SELECT 1 FROM wanted w WHERE w.client_id = p.client_id AND w.phone_key = p.phone_key)
+     RETURNING p.phone_id
+    ),
+    inserted AS (
+        INSERT INTO phones(client_id, phone, phone_key)
+        SELECT w.client_id, w.phone, w.phone_key
+          FROM wanted w
+         WHERE NOT EXISTS (SELECT 1 FROM phones p WHERE p.client_id = w.client_id AND p.phone_key = w.phone_key)
+     RETURNING phone_id
+    )
+    SELECT (SELECT count(*) FROM updated), (SELECT count(*) FROM deleted), (SELECT count(*) FROM inserted);
+"""
+
+
+class UpdateResult(NamedTuple):
+
+    """
+    The numbers of rows changed by update_data or update_clients.
+    """
+
+    clients: int
+    phones_deleted: int
+    phones_inserted: int
+
+
+def merge_updates(updates):
+
+    """
+    Merges several updates of one client into one, later values win.
+    :param updates: The updates (iterable of dicts with the key "client_id" and the optional keys "name",
+    "surname", "email", "phones"; a missing or None value leaves the data unchanged).
+    :return: The list of merged updates, one per client.
+    """
+
+    merged = {}
+    for update in updates:
+        merged.setdefault(update['client_id'], {}).update({key: value for key, value in update.items()
+                                                           if value is not None})
+    return list(merged.values())
+
+
+def update_params(updates):
+
+    """
+    Packs client updates into the array parameters of UPDATE_CLIENTS_SQL.
+    :param updates: The updates (iterable of dicts, see merge_updates).
+    :return: A dict of parameters.
+    :raises ValueError: If a phone number is not valid (it has no key), since the new phones replace the old ones.
+    """
+
+    params = {'client_ids': [], 'names': [], 'surnames': [], 'emails': [],
+              'replace_phones': [], 'phone_client_ids': [], 'phones': [], 'phone_keys': []}
+    for update in merge_updates(updates):
+        client_id = update['client_id']
+        params['client_ids'].append(client_id)
+        params['names'].append(update.get('name'))
+        params['surnames'].append(update.get('surname'))
+        params['emails'].append(update.get('email'))
+        if update.get('phones') is not None:
+            params['replace_phones'].append(client_id)
+            for phone in update['phones']:
+                if (key := phone_key(phone)) is None:
+                    raise ValueError(f'Номер {phone} не валиден.')
+                params['phone_client_ids'].append(client_id)
+                params['phones'].append(phone)
+                params['phone_keys'].append(key)
+    return params
+
+
+@instrumented
 def update_data(cur, client_id, name=None, surname=None, email=None, phones=None):
 
     """
-    Updates the data for a given client in a PostgreSQL database.
+    Updates the data for a given client in a PostgreSQL database in one statement.
+    Only the difference between the current and the new phone numbers is deleted and inserted.
     :param cur: A cursor object used to execute SQL commands.
     :param client_id: The ID of the client to update (integer).
     :param name: The new name for the client (string, optional, default None).
     :param surname: The new surname for the client (string, optional, default None).
     :param email: The new email for the client (string, optional, default None).
     :param phones: The new phone numbers for the client (list of strings, optional, default None).
-    :return: None.
+    :return: The numbers of changed rows (UpdateResult), or None on error or an invalid phone number.
     """
 
     try:
-        if name is not None:
-            cur.execute("""
-            UPDATE clients SET name=%s
-            WHERE client_id=%s;
-            """, (name, client_id))
-        else:
-            pass
-        if surname is not None:
-            cur.execute("""
-            UPDATE clients SET surname=%s
-            WHERE client_id=%s;
-            """, (surname, client_id))
-        else:
-            pass
-        if email is not None:
-            cur.execute("""
-            UPDATE clients SET email=%s
-            WHERE client_id=%s;
-            """, (email, client_id))
-        else:
-            pass
-        if phones is not None:
-            cur.execute("""
-            DELETE FROM phones 
-            WHERE client_id=%s;
-            """, (client_id,))
-            phones_values = [(client_id, phone) for phone in phones]
-            cur.executemany("""
-            INSERT INTO phones (client_id, phone) 
-            VALUES (%s, %s);
-            """, phones_values)
-        print(f"Данные пользователя {client_id} заменены. ")
-        conn.commit()
+        params = update_params([{'client_id': client_id, 'name': name, 'surname': surname, 'email': email,
+                                 'phones': phones}])
+    except ValueError as error:
+        print(error, "Данные не изменены.")
         return
+    try:
+        cur.execute(UPDATE_CLIENTS_SQL, params)
+        result = UpdateResult(*cur.fetchone())
+        cur.connection.commit()
+        print(f"Данные пользователя {client_id} заменены. ")
+        return result
     except (Exception, Error) as error:
+        cur.connection.rollback()
         print("Ошибка при работе с PostgreSQL", error)
         return
 
 
+@instrumented
+def update_clients(cur, updates, batch_size=10000):
+
+    """
+    Applies many client updates in one transaction, batch_size clients per statement.
+    :param cur: A cursor object used to execute SQL commands.
+    :param updates: The updates (iterable of dicts, see merge_updates).
+    :param batch_size: The number of clients updated by one statement (integer, optional, default 10000).
+    :return: The total numbers of changed rows (UpdateResult), or None on error or an invalid phone number
+    (nothing is changed then).
+    """
+
+    updates = merge_updates(updates)
+    try:
+        batches = [update_params(updates[start:start + batch_size]) for start in range(0, len(updates), batch_size)]
+    except ValueError as error:
+        print(error, "Данные не изменены.")
+        return
+    total = [0, 0, 0]
+    try:
+        for params in batches:
+            cur.execute(UPDATE_CLIENTS_SQL, params)
+            total = [a + b for a, b in zip(total, cur.fetchone())]
+        cur.connection.commit()
+        print(f"Обновлено клиентов: {total[0]}, удалено телефонов: {total[1]}, добавлено телефонов: {total[2]}.")
+        return UpdateResult(*total)
+    except (Exception, Error) as error:
+        cur.connection.rollback()
+        print("Ошибка при работе с PostgreSQL, данные не изменены:", error)
+        return
+
+
+@instrumented
 def delete_client(cur, client_id):
 
     """
     Deletes a client and all associated phone numbers from a PostgreSQL database.
+    The phones are deleted by the ON DELETE CASCADE of their foreign key.
     :param cur: A cursor object used to execute SQL commands.
     :param client_id: The ID of the client to delete (integer).
-    :return: None.
+    :return: True if the client is deleted, False if there is no such client, None on error.
     """
 
-    cur.execute("""
-    DELETE FROM phones 
-     WHERE client_id=%s;
-    """, (client_id,))
-    cur.execute("""
-    DELETE FROM clients 
-     WHERE client_id=%s;
-    """, (client_id,))
     try:
-        conn.commit()
-        print(f"Клиент с id {client_id} удален.")
+        cur.execute("""
+        DELETE FROM clients
+         WHERE client_id=%s
+     RETURNING client_id;
+        """, (client_id,))
+        deleted = cur.fetchone() is not None
+        cur.connection.commit()
+    except psycopg2.errors.ForeignKeyViolation:
+        cur.connection.rollback()
+        print("Клиент не удален: внешний ключ телефонов без ON DELETE CASCADE, выполните "
+              "python migrations.py cascade_phones")
+        return
     except (Exception, Error) as error:
+        cur.connection.rollback()
         print("Ошибка при работе с PostgreSQL", error)
         print(f"Клиент не удален.")
         return
-    return
+    print(f"Клиент с id {client_id} удален." if deleted else "Клиент с таким id не найден. ")
+    return deleted
+
+
+def search_kind(data):
+
+    """
+    Tells what kind of data a search query contains.
+    :param data: The data for search query (string).
+    :return: "email", "phone" or "name".
+    """
+
+    if '@' in data:
+        return 'email'
+    if re.fullmatch(r'[+\d\s()-]+', data):
+        return 'phone'
+    return 'name'
+
+
+SEARCH_LOOKUPS = {
+    'email': "SELECT client_id FROM clients WHERE email = %s",
+    'phone': "SELECT client_id FROM phones WHERE phone_key = %s",
+    'name': """SELECT client_id FROM clients WHERE lower(name) = lower(%s)
+                UNION
+               SELECT client_id FROM clients WHERE lower(surname) = lower(%s)""",
+}
+SEARCH_SQL = {kind: f"""
+        SELECT c.client_id, c.name, c.surname, c.email,
+               (SELECT array_agg(phone ORDER BY phone_id) FROM phones p WHERE p.client_id = c.client_id)
+        FROM clients c
+        WHERE c.client_id IN ({lookup})
+        ORDER BY c.client_id;
+        """ for kind, lookup in SEARCH_LOOKUPS.items()}
+SEARCH_STATEMENTS = {kind: statements.register(f'find_client_{kind}', sql) for kind, sql in SEARCH_SQL.items()}
+
+
+def search_params(data):
+
+    """
+    Picks the search query for find_client. The column is picked from the kind of the data, so every lookup
+    is answered by one index: email for addresses, phone for numbers, name and surname for everything else.
+    :param data: The data for search query (string).
+    :return: A tuple (kind of data, parameters).
+    """
+
+    kind = search_kind(data)
+    if kind == 'email':
+        return kind, (data,)
+    if kind == 'phone':
+        return kind, (phone_key(data),)
+    return kind, (data, data)
 
 
+def search_query(data):
+
+    """
+    Builds the search query for find_client, see search_params.
+    :param data: The data for search query (string).
+    :return: A tuple (SQL query, parameters).
+    """
+
+    kind, params = search_params(data)
+    return SEARCH_SQL[kind], params
+
+
+@instrumented
 def find_client(cur, data):
 
     """
     Searches for a client in a PostgreSQL database based on their name, surname, email, or phone number.
-    Print data in a table.
+    Names are compared case-insensitively.
     :param cur: A cursor object used to execute SQL commands.
     :param data: The data for search query (string).
-    :return: None.
+    :return: The list of found clients (list of Client), or None on error.
     """
 
     try:
-        cur.execute("""
-        SELECT c.client_id, name, surname, email, string_agg(phone, ', ') AS phones 
-        FROM clients c
-        LEFT JOIN phones p ON c.client_id = p.client_id
-        WHERE name = %s OR surname = %s OR email = %s OR phone = %s
-        GROUP BY c.client_id;
-        """, (data.capitalize(), data.capitalize(), data, data))
-        clients = cur.fetchall()
+        kind, params = search_params(data)
+        statements.execute(cur, SEARCH_STATEMENTS[kind], params)
+        clients = [Client.from_row(row) for row in cur.fetchall()]
         if not clients:
             print("Таких клиентов нет в базе данных.")
-            return
-        else:
-            result = []
-            for client in clients:
-                client = [client[0], client[1], client[2], client[3], client[4]]
-                result.append(client)
-            df = pd.DataFrame(result, columns=['id', 'name', 'surname', 'email', 'phones'])
-            df = df.sort_values(by=['id'])
-            print(df.to_string(index=False))
+        return clients
     except (Exception, Error) as error:
         print("Ошибка при работе с PostgreSQL", error)
         return
-    return
 
 
+FUZZY_SEARCH_SQL = {
+    'name': """
+        WITH found AS (
+            SELECT score, client_id
+              FROM (SELECT greatest(similarity(lower(name), %(query)s), similarity(lower(surname), %(query)s),
+                                    similarity(lower(email), %(query)s)) AS score,
+                           client_id
+                      FROM clients
+                     WHERE lower(name) %% %(query)s OR lower(surname) %% %(query)s OR lower(email) %% %(query)s
+                        OR lower(name) LIKE %(prefix)s OR lower(surname) LIKE %(prefix)s
+                        OR lower(email) LIKE %(prefix)s) AS candidates
+             WHERE %(after_id)s::integer IS NULL OR score < %(after_score)s::real
+                OR (score = %(after_score)s::real AND client_id > %(after_id)s::integer)
+             ORDER BY score DESC, client_id
+             LIMIT %(limit)s
+        )
+        """,
+    'phone': """
+        WITH found AS (
+            SELECT DISTINCT 1::real AS score, client_id
+              FROM phones
+             WHERE phone_key::text LIKE %(prefix)s
+               AND (%(after_id)s::integer IS NULL OR client_id > %(after_id)s::integer)
+             ORDER BY client_id
+             LIMIT %(limit)s
+        )
+        """,
+}
+FUZZY_SEARCH_RESULT_SQL = """
+        SELECT f.score, c.client_id, c.name, c.surname, c.email,
+               (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id)
+          FROM found f
+          JOIN clients c ON c.client_id = f.client_id
+         ORDER BY f.score DESC, c.client_id;
+"""
+
+
+class SearchPage(NamedTuple):
+
+    """
+    One page of search_clients results.
+    """
+
+    clients: list
+    scores: list
+    next_cursor: tuple = None
+
+
+@instrumented
+def search_clients(cur, query, limit=20, cursor=None):
+
+    """
+    Ranked fuzzy search: trigram similarity on name, surname and email, or a prefix search on the digits
+    of phone numbers if the query has no letters. Pages continue from a keyset cursor (score, client_id), so they
+    do not repeat or skip clients and no skipped rows are sent, but the score is computed per query: every page,
+    the first one too, finds and ranks the whole candidate set of the query, and its cost grows with the number
+    of matches. Needs the pg_trgm extension and the indexes created by create_tables.
+    :param cur: A cursor object used to execute SQL commands.
+    :param query: The search query, e.g. "petrov", "ivan@" or "7916" (string).
+    :param limit: The page size (integer, optional, default 20).
+    :param cursor: The next_cursor of the previous page (tuple, optional, default None - the first page).
+    :return: A SearchPage with the clients ordered by relevance, or None on error.
+    """
+
+    if re.fullmatch(r'[+\d\s()-]+', query) and (digits := re.sub(r'\D', '', query)):
+        kind, prefix = 'phone', digits
+    else:
+        kind, prefix = 'name', query.strip().lower()
+    after_score, after_id = cursor if cursor is not None else (None, None)
+    params = {'query': prefix, 'prefix': re.sub(r'([\\%_])', r'\\\1', prefix) + '%', 'limit': limit + 1,
+              'after_score': after_score, 'after_id': after_id}
+    try:
+        cur.execute(FUZZY_SEARCH_SQL[kind] + FUZZY_SEARCH_RESULT_SQL, params)
+        rows = cur.fetchall()
+    except (Exception, Error) as error:
+        cur.connection.rollback()
+        print("Ошибка при работе с PostgreSQL", error)
+        return
+    next_cursor = (rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    return SearchPage([Client.from_row(row[1:]) for row in rows], [row[0] for row in rows], next_cursor)
+
+
+LIST_ORDERS = {
+    'client_id': ('client_id',),
+    'surname': ('lower(surname)', 'lower(name)', 'client_id'),
+}
+
+
+class ListPage(NamedTuple):
+
+    """
+    One page of list_clients results.
+    """
+
+    clients: list
+    next_cursor: tuple = None
+
+
+def filter_clause(name=None, surname=None, email=None):
+
+    """
+    Builds the WHERE conditions for the client filters, names are compared case-insensitively.
+    :param name: Only clients with this name (string, optional, default None).
+    :param surname: Only clients with this surname (string, optional, default None).
+    :param email: Only the client with this email (string, optional, default None).
+    :return: A tuple (list of SQL conditions, dict of parameters).
+    """
+
+    conditions, params = [], {}
+    if name is not None:
+        conditions.append("lower(name) = lower(%(name)s)")
+        params['name'] = name
+    if surname is not None:
+        conditions.append("lower(surname) = lower(%(surname)s)")
+        params['surname'] = surname
+    if email is not None:
+        conditions.append("email = %(email)s")
+        params['email'] = email
+    return conditions, params
+
+
+@instrumented
+def list_clients(cur, limit=50, cursor=None, order='client_id', name=None, surname=None, email=None):
+
+    """
+    Lists clients page by page. Pages continue from a keyset cursor instead of OFFSET, so any page costs
+    the same as the first one. Phones of the whole page are fetched with one aggregated subquery.
+    :param cur: A cursor object used to execute SQL commands.
+    :param limit: The page size (integer, optional, default 50).
+    :param cursor: The next_cursor of the previous page (tuple, optional, default None - the first page).
+    :param order: "client_id" or "surname" - by surname, then name (string, optional, default "client_id").
+    :param name: Only clients with this name (string, optional, default None).
+    :param surname: Only clients with this surname (string, optional, default None).
+    :param email: Only the client with this email (string, optional, default None).
+    :return: A ListPage, or None on error or an unknown order.
+    """
+
+    if (keys := LIST_ORDERS.get(order)) is None:
+        print(f'Неизвестный порядок: {order}. Доступны: {", ".join(LIST_ORDERS)}.')
+        return
+    conditions, params = filter_clause(name, surname, email)
+    if cursor is not None:
+        conditions.append(f"({', '.join(keys)}) > ({', '.join(f'%(after_{i})s' for i in range(len(keys)))})")
+        params.update({f'after_{i}': value for i, value in enumerate(cursor)})
+    # One row more than the page tells whether a next page exists.
+    params['limit'] = limit + 1
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sort_keys = ', '.join(f'p.sort_{i}' for i in range(len(keys)))
+    try:
+        cur.execute(f"""
+            WITH page AS (
+                SELECT client_id, name, surname, email, {', '.join(f'{key} AS sort_{i}' for i, key in enumerate(keys))}
+                  FROM clients
+                 {where}
+                 ORDER BY {', '.join(keys)}
+                 LIMIT %(limit)s
+            )
+            SELECT p.client_id, p.name, p.surname, p.email, ph.phones, {sort_keys}
+              FROM page p
+              LEFT JOIN (SELECT client_id, array_agg(phone ORDER BY phone_id) AS phones
+                           FROM phones
+                          WHERE client_id IN (SELECT client_id FROM page)
+                          GROUP BY client_id) ph ON ph.client_id = p.client_id
+             ORDER BY {sort_keys};
+            """, params)
+        rows = cur.fetchall()
+    except (Exception, Error) as error:
+        cur.connection.rollback()
+        print("Ошибка при работе с PostgreSQL", error)
+        return
+    next_cursor = tuple(rows[limit - 1][5:]) if len(rows) > limit else None
+    rows = rows[:limit]
+    return ListPage([Client.from_row(row) for row in rows], next_cursor)
+
+
+FIND_CLIENT_BY_ID = statements.register('find_client_by_id', """
+    SELECT c.client_id, name, surname, email,
+           (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id) AS phones
+      FROM clients c
+     WHERE c.client_id = %s;
+""")
+
+
+@instrumented
 def find_client_by_id(cur, client_id):
 
     """
     Finds a client in the database by their ID.
     :param cur: A cursor object for the database connection.
     :param client_id: The ID of the client to find (integer).
-    :return: The list with the client data, or None if no client has found.
+    :return: The client data (Client), or None if no client has found.
     """
 
-    cur.execute("""
-        SELECT c.client_id, name, surname, email, 
-               (SELECT array_agg(phone) FROM phones WHERE client_id = c.client_id) AS phones 
-        FROM clients c
-        LEFT JOIN phones p ON c.client_id = p.client_id
-        WHERE c.client_id = %s;
-        """, (client_id,))
+    statements.execute(cur, FIND_CLIENT_BY_ID, (client_id,))
     try:
         client = cur.fetchone()
         if client is None:
             print("Клиент с таким id не найден. ")
             return
         else:
+            return Client.from_row(client)
+    except (Exception, Error) as error:
+        print("Ошибка при работе с PostgreSQL", error)
+        return
+
+
+@instrumented
+def delete_clients(cur, client_ids=None, batch_size=1000, pause=0.0, name=None, surname=None, email=None):
+
+    """
+    Deletes many clients with their phones in batches of batch_size clients, one transaction per batch,
+    so a large purge holds its locks only for a short time and writes WAL evenly. Prints the progress.
+    The clients are given by ids, by filters or by both; without any of them nothing is deleted.
+    :param cur: A cursor object used to execute SQL commands.
+    :param client_ids: The IDs of the clients to delete (iterable of integers, optional, default None).
+    :param batch_size: The number of clients deleted in one transaction (integer, optional, default 1000).
+    :param pause: Seconds to wait between the batches, e.g. to let replicas catch up (float, optional, default 0).
+    :param name: Only clients with this name (string, optional, default None).
+    :param surname: Only clients with this surname (string, optional, default None).
+    :param email: Only the client with this email (string, optional, default None).
+    :return: The number of deleted clients, or None on error (the batches committed before the error stay deleted).
+    """
 
-            info = [client[0],
-                    client[1],
-                    client[2],
-                    client[3],
-                    client[4]]
-            df = pd.DataFrame.from_dict({'id': [info[0]],
-                                         'name': [info[1]],
-                                         'surname': [info[2]],
-                                         'email': [info[3]],
-                                         'phones': [', '.join(info[4])]}, )
-            df = df[['id', 'name', 'surname', 'email', 'phones']]
-            df = df.sort_values(by=['id'])
-            print(df.to_string(index=False))
-            return info
+    conditions, params = filter_clause(name, surname, email)
+    if client_ids is None and not conditions:
+        raise ValueError('Не заданы клиенты для удаления: передайте client_ids или фильтр.')
+    if client_ids is not None:
+        # Every statement gets only its slice of the sorted ids instead of the whole list.
+        client_ids = sorted(set(client_ids))
+        batches = (client_ids[i:i + batch_size] for i in range(0, len(client_ids), batch_size))
+        filters = ''.join(f' AND {condition}' for condition in conditions)
+        sql = f"""
+              DELETE FROM clients
+               WHERE client_id = ANY(%(batch)s::integer[]){filters}
+           RETURNING client_id;
+              """
+    else:
+        # Without ids the next batch continues after the last deleted client (keyset).
+        batches = None
+        params.update(limit=batch_size, after_id=0)
+        sql = f"""
+              DELETE FROM clients
+               WHERE client_id IN (SELECT client_id
+                                     FROM clients
+                                    WHERE {' AND '.join(conditions)} AND client_id > %(after_id)s
+                                    ORDER BY client_id
+                                    LIMIT %(limit)s)
+           RETURNING client_id;
+              """
+    deleted, started = 0, time.perf_counter()
+    try:
+        while True:
+            if batches is not None:
+                if (batch := next(batches, None)) is None:
+                    break
+                params['batch'] = batch
+            cur.execute(sql, params)
+            ids = [client_id for client_id, in cur.fetchall()]
+            if batches is None:
+                if not ids:
+                    break
+                params['after_id'] = max(ids)
+            cur.connection.commit()
+            deleted += len(ids)
+            elapsed = time.perf_counter() - started
+            print(f"Удалено клиентов: {deleted} ({deleted / elapsed if elapsed else 0:.0f} строк/сек.)")
+            if pause:
+                time.sleep(pause)
+        cur.connection.rollback()
     except (Exception, Error) as error:
+        cur.connection.rollback()
         print("Ошибка при работе с PostgreSQL", error)
         return
+    return deleted
+
+
+BATCH_LOOKUP_SQL = {
+    'client_id': """
+        SELECT c.client_id, c.client_id, c.name, c.surname, c.email,
+               (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id)
+          FROM clients c
+         WHERE c.client_id = ANY(%s);
+        """,
+    'email': """
+        SELECT c.email, c.client_id, c.name, c.surname, c.email,
+               (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id)
+          FROM clients c
+         WHERE c.email = ANY(%s);
+        """,
+    'phone': """
+        SELECT p.phone_key, c.client_id, c.name, c.surname, c.email,
+               (SELECT array_agg(phone ORDER BY phone_id) FROM phones WHERE client_id = c.client_id)
+          FROM phones p
+          JOIN clients c ON c.client_id = p.client_id
+         WHERE p.phone_key = ANY(%s::bigint[]);
+        """,
+}
+
+
+# Numbers the server-side cursors of the batch lookups: a cursor name must be unique on its connection.
+_lookup_cursors = itertools.count(1)
+
+
+def iter_clients_by(cur, column, values, itersize=2000):
+
+    """
+    Looks up many clients with one query and streams the result through a server-side cursor,
+    so only itersize rows are held in memory at once. The cursor lives in the caller's transaction, which the caller
+    ends after reading: committing earlier would close the cursors of the other lookups on the connection.
+    :param cur: A cursor object used to execute SQL commands.
+    :param column: The column to look up by: "client_id", "email" or "phone" (string).
+    :param values: The values to look up, phone keys for "phone" (iterable).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A generator of tuples (value, Client) for the values found.
+    """
+
+    with cur.connection.cursor(name=f'batch_lookup_{column}_{next(_lookup_cursors)}') as server_cur:
+        server_cur.itersize = itersize
+        server_cur.execute(BATCH_LOOKUP_SQL[column], (list(values),))
+        for row in server_cur:
+            yield row[0], Client.from_row(row[1:])
+
+
+def find_clients_by(cur, column, values, itersize=2000):
+
+    """
+    Resolves many client ids, emails or phones at once.
+    :param cur: A cursor object used to execute SQL commands.
+    :param column: The column to look up by: "client_id", "email" or "phone" (string).
+    :param values: The values to look up, phone keys for "phone" (iterable).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A dict {value: Client or None if nothing is found}, or None on error.
+    """
+
+    result = dict.fromkeys(values)
+    try:
+        result.update(iter_clients_by(cur, column, result, itersize))
+        cur.connection.commit()
+    except (Exception, Error) as error:
+        cur.connection.rollback()
+        print("Ошибка при работе с PostgreSQL", error)
+        return
+    return result
+
+
+@instrumented
+def find_clients_by_ids(cur, client_ids, itersize=2000):
+
+    """
+    Resolves many client ids at once, see find_clients_by.
+    :param cur: A cursor object used to execute SQL commands.
+    :param client_ids: The client ids to look up (iterable).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A dict {client_id: Client or None}, or None on error.
+    """
+
+    return find_clients_by(cur, 'client_id', client_ids, itersize)
+
 
+@instrumented
+def find_clients_by_emails(cur, emails, itersize=2000):
 
+    """
+    Resolves many emails at once, see find_clients_by.
+    :param cur: A cursor object used to execute SQL commands.
+    :param emails: The emails to look up (iterable).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A dict {email: Client or None}, or None on error.
+    """
+
+    return find_clients_by(cur, 'email', emails, itersize)
+
+
+@instrumented
+def find_clients_by_phones(cur, phones, itersize=2000):
+
+    """
+    Resolves many phone numbers at once, see find_clients_by.
+    :param cur: A cursor object used to execute SQL commands.
+    :param phones: The phone numbers to look up (iterable).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A dict {phone: Client or None}, or None on error.
+    """
+
+    keys = {phone: phone_key(phone) for phone in phones}
+    if (found := find_clients_by(cur, 'phone', {key for key in keys.values() if key is not None}, itersize)) is None:
+        return
+    return {phone: found.get(key) for phone, key in keys.items()}
+
+
+CHANGE_SEQ_LOCK = 7340101
+CHANGE_SEQ_BATCH = 10000
+ASSIGN_CHANGE_SEQ_SQL = """
+    WITH next AS (
+        SELECT change_id, row_number() OVER (ORDER BY change_id) AS n
+          FROM client_changes
+         WHERE seq IS NULL
+         ORDER BY change_id
+         LIMIT %s
+    )
+    UPDATE client_changes c
+       SET seq = (SELECT coalesce(max(seq), 0) FROM client_changes) + next.n
+      FROM next
+     WHERE c.change_id = next.change_id;
+"""
+CHANGES_SINCE_SQL = """
+    SELECT seq, entity, operation, client_id, entity_id, data, changed_at
+      FROM client_changes
+     WHERE seq > %s
+     ORDER BY seq
+     LIMIT %s;
+"""
+
+
+class Change(NamedTuple):
+
+    """
+    One entry of the change log: an inserted, updated or deleted client ("client") or phone ("phone").
+    data is the row after an insert or update and the removed row after a delete.
+    """
+
+    seq: int
+    entity: str
+    operation: str
+    client_id: int
+    entity_id: int
+    data: dict
+    changed_at: object
+
+
+@instrumented
+def assign_change_seqs(cur, batch_size=CHANGE_SEQ_BATCH):
+
+    """
+    Numbers the committed changes that have no sequence number yet, in the order of change_id, batch_size
+    changes per transaction. The numbers are given under an advisory lock after the changes are committed,
+    so every new number is greater than the numbers a consumer has already seen. A number taken from
+    a sequence at insert time could become visible after greater ones and the consumer would skip it.
+    :param cur: A cursor object used to execute SQL commands.
+    :param batch_size: The number of changes numbered in one transaction (integer, optional, default 10000).
+    :return: The number of numbered changes.
+    """
+
+    total = 0
+    while True:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (CHANGE_SEQ_LOCK,))
+        cur.execute(ASSIGN_CHANGE_SEQ_SQL, (batch_size,))
+        count = cur.rowcount
+        cur.connection.commit()
+        total += count
+        if count < batch_size:
+            return total
+
+
+def changes_since(cur, seq=0, limit=1000, itersize=2000):
+
+    """
+    Streams the changes made after the change number seq in the order of their numbers. A consumer stores
+    the seq of the last change it has applied and asks for the next ones, so a sync reads only the new changes.
+    Commits the caller's transaction: when the first change is requested, the new changes are numbered
+    by assign_change_seqs, which commits on the connection of cur, together with any writes left uncommitted there.
+    :param cur: A cursor object used to execute SQL commands.
+    :param seq: The number of the last change already seen (integer, optional, default 0 - from the start).
+    :param limit: The maximum number of changes (integer, optional, default 1000, None - all of them).
+    :param itersize: The number of rows fetched from the server at once (integer, optional, default 2000).
+    :return: A generator of Change.
+    """
+
+    assign_change_seqs(cur)
+    with cur.connection.cursor(name='changes_since') as server_cur:
+        server_cur.itersize = itersize
+        server_cur.execute(CHANGES_SINCE_SQL, (seq, limit))
+        for row in server_cur:
+            yield Change(*row)
+
+
+@instrumented
 def delete_tables(cur):
 
     """
-    Deletes the 'phones' and 'clients' tables from a PostgreSQL database.
+    Deletes the 'phones' and 'clients' tables and the change log from a PostgreSQL database.
     :param cur: A cursor object used to execute SQL commands.
     :return: None.
     """
@@ -415,8 +1284,10 @@ def delete_tables(cur):
         cur.execute("""
         DROP TABLE phones;
         DROP TABLE clients;
+        DROP TABLE IF EXISTS client_changes;
+        DROP FUNCTION IF EXISTS log_client_changes();
         """)
-        conn.commit()
+        cur.connection.commit()
         print('Таблицы удалены.')
     except psycopg2.errors.UndefinedTable:
         print("Таблицы не были созданы или уже удалены.")
@@ -446,7 +1317,8 @@ def exit_db(conn):
 def test_functions(cur):
 
     """
-    Tests the functions in a PostgreSQL database.
+    Runs every function once on demo clients. It drops the tables at the end, so run it only against
+    an empty scratch database.
     :param cur: A cursor object used to execute SQL commands.
     :return: None.
     """
@@ -474,21 +1346,22 @@ def test_functions(cur):
                 client_id=1,
                 surname="Ivanova",
                 phones=[validate_phone(phone) for phone in ["+7-958-394-85-72", "+79872049384"]])
-    find_client(cur, data="Anna")
-    find_client_by_id(cur, client_id=1)
+    if clients := find_client(cur, data="Anna"):
+        print_clients(clients)
+    if (client := find_client_by_id(cur, client_id=1)) is not None:
+        print_clients([client])
     delete_client(cur, client_id=1)
     delete_tables(cur)
     return
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        from cli import run
+        sys.exit(run())
     user = User()
 
-    with psycopg2.connect(database=user.db_name, user=user.user, password=user.password) as conn:
-        with conn.cursor() as cur:
-            test_functions(cur)
-
-    with psycopg2.connect(database=user.db_name, user=user.user, password=user.password) as conn:
+    with psycopg2.connect(**user.connect_params(), cursor_factory=InstrumentedCursor) as conn:
         with conn.cursor() as cur:
             print("""
                     Доступные команды:
@@ -533,7 +1406,8 @@ if __name__ == '__main__':
                 elif command == '4':
                     client_id = int(input('Введите id клиента: '))
                     print("Текущие данные клиента: ")
-                    old_data = find_client_by_id(cur, client_id)
+                    if (old_data := find_client_by_id(cur, client_id)) is not None:
+                        print_clients([old_data])
                     print("Поочередно введите данные, которые хотите изменить. Если данные менять не нужно, "
                           "нажмите Enter.")
                     name = input("Введите новое имя: ")
@@ -565,10 +1439,12 @@ if __name__ == '__main__':
                             data = validate_mail(data)
                         except Exception:
                             pass
-                    find_client(cur, data)
+                    if clients := find_client(cur, data):
+                        print_clients(clients)
                 elif command == '8':
                     client_id = int(input('Введите id клиента: '))
-                    data = find_client_by_id(cur, client_id)
+                    if (data := find_client_by_id(cur, client_id)) is not None:
+                        print_clients([data])
                 elif command == '9':
                     exit_db(conn)
                 elif command == '10':
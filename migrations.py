@@ -0,0 +1,183 @@
+import argparse
+
+import psycopg2
+
+from main import PHONE_KEY_INDEX, PHONE_PREFIX_INDEX, TRIGRAM_INDEXES, User
+from validation import phone_key
+
+BATCH_SIZE = 5000
+
+
+def create_search_indexes(conn):
+
+    """
+    Creates the indexes of search_clients on existing tables without blocking writes (CREATE INDEX CONCURRENTLY).
+    create_tables builds the same indexes, but locks the tables while doing it.
+    :param conn: A connection object representing the connection to the database.
+    :return: None.
+    """
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PHONE_PREFIX_INDEX.format(concurrently='CONCURRENTLY'))
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            for statement in TRIGRAM_INDEXES:
+                cur.execute(statement.format(concurrently='CONCURRENTLY'))
+        print('Индексы для нечеткого поиска созданы.')
+    finally:
+        conn.autocommit = False
+
+
+def build_unique_index(conn, name, statement):
+
+    """
+    Builds a unique index concurrently. A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+    which IF NOT EXISTS would keep, so such an index is dropped and built again.
+    :param conn: A connection object in autocommit mode.
+    :param name: The name of the index (string).
+    :param statement: The CREATE UNIQUE INDEX statement with the {concurrently} placeholder (string).
+    :return: None.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (name,))
+        if (row := cur.fetchone()) is not None and not row[0]:
+            print(f'Индекс {name} не достроен, строится заново.')
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+        cur.execute(statement.format(concurrently='CONCURRENTLY'))
+
+
+def backfill_phone_keys(conn, batch_size=BATCH_SIZE):
+
+    """
+    Moves phones stored before the phone_key column existed to the normalized key without locking the table.
+    The unique index on the key is built concurrently first, while the keys are still empty, so it guards every
+    key filled afterwards, also against phones added by other sessions meanwhile. Until the index is built,
+    add_client and the other writes using ON CONFLICT (phone_key) fail. Then the keys are filled in short
+    transactions of batch_size rows (only these rows are locked); a batch that meets a key added concurrently
+    is filled again without it. At the end the old unique constraint on the formatted string is dropped.
+    Rows whose phone cannot be parsed or repeats another phone after normalization keep an empty key
+    and are printed. The migration can be run again, it continues with the rows left.
+    :param conn: A connection object representing the connection to the database.
+    :param batch_size: The number of rows updated in one transaction (integer, optional, default 5000).
+    :return: The number of filled keys.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute("SET lock_timeout = '5s';")
+        cur.execute("ALTER TABLE phones ADD COLUMN IF NOT EXISTS phone_key BIGINT;")
+        cur.execute("RESET lock_timeout;")
+        conn.commit()
+    conn.autocommit = True
+    try:
+        build_unique_index(conn, 'phones_phone_key_idx', PHONE_KEY_INDEX)
+    finally:
+        conn.autocommit = False
+    with conn.cursor() as cur:
+        last_id, filled = 0, 0
+        while True:
+            cur.execute("""
+                        SELECT phone_id, phone
+                          FROM phones
+                         WHERE phone_id > %s AND phone_key IS NULL
+                         ORDER BY phone_id
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED;
+                        """, (last_id, batch_size))
+            if not (rows := cur.fetchall()):
+                break
+            keys = {}
+            for phone_id, phone in rows:
+                if (key := phone_key(phone)) is not None:
+                    keys.setdefault(key, phone_id)
+            try:
+                cur.execute("""
+                            UPDATE phones p
+                               SET phone_key = b.phone_key
+                              FROM unnest(%s::integer[], %s::bigint[]) AS b(phone_id, phone_key)
+                             WHERE p.phone_id = b.phone_id
+                               AND NOT EXISTS (SELECT 1 FROM phones d WHERE d.phone_key = b.phone_key);
+                            """, (list(keys.values()), list(keys)))
+            except psycopg2.errors.UniqueViolation:
+                # A key was added by another session after the statement started, the batch is read again.
+                conn.rollback()
+                continue
+            filled += cur.rowcount
+            last_id = rows[-1][0]
+            conn.commit()
+            print(f"Заполнено ключей телефонов: {filled}")
+        cur.execute("SELECT phone_id, client_id, phone FROM phones WHERE phone_key IS NULL ORDER BY phone_id;")
+        for phone_id, client_id, phone in cur.fetchall():
+            print(f"Телефон id {phone_id} клиента {client_id} остался без ключа (ошибка в номере или дубликат): {phone}")
+        conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PHONE_PREFIX_INDEX.format(concurrently='CONCURRENTLY'))
+            cur.execute("ALTER TABLE phones DROP CONSTRAINT IF EXISTS phones_phone_key;")
+            cur.execute("DROP INDEX CONCURRENTLY IF EXISTS phones_digits_idx;")
+        print('Телефоны переведены на нормализованный ключ.')
+    finally:
+        conn.autocommit = False
+    return filled
+
+
+def cascade_phones(conn):
+
+    """
+    Makes the foreign key of phones delete the phones together with their client (ON DELETE CASCADE) on a database
+    created before, and builds the index on phones.client_id that the cascade needs. The key is replaced
+    as NOT VALID under a short lock and validated afterwards without blocking writes.
+    :param conn: A connection object representing the connection to the database.
+    :return: None.
+    """
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS phones_client_id_idx ON phones(client_id);")
+    finally:
+        conn.autocommit = False
+    with conn.cursor() as cur:
+        cur.execute("""
+                    SELECT confdeltype
+                      FROM pg_constraint
+                     WHERE conrelid = 'phones'::regclass AND conname = 'phones_client_id_fkey';
+                    """)
+        if (row := cur.fetchone()) is not None and row[0] == 'c':
+            conn.rollback()
+            print('Каскадное удаление телефонов уже включено.')
+            return
+        cur.execute("SET LOCAL lock_timeout = '5s';")
+        cur.execute("""
+                    ALTER TABLE phones
+                          DROP CONSTRAINT IF EXISTS phones_client_id_fkey,
+                          ADD CONSTRAINT phones_client_id_fkey FOREIGN KEY (client_id)
+                              REFERENCES clients(client_id) ON DELETE CASCADE NOT VALID;
+                    """)
+        conn.commit()
+        cur.execute("ALTER TABLE phones VALIDATE CONSTRAINT phones_client_id_fkey;")
+        conn.commit()
+    print('Каскадное удаление телефонов включено.')
+
+
+MIGRATIONS = {
+    'search_indexes': create_search_indexes,
+    'phone_keys': backfill_phone_keys,
+    'cascade_phones': cascade_phones,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Миграции базы данных клиентов.')
+    parser.add_argument('migration', choices=MIGRATIONS)
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    try:
+        MIGRATIONS[args.migration](conn)
+    except (Exception, psycopg2.Error) as error:
+        print("Ошибка при работе с PostgreSQL", error)
+    finally:
+        conn.close()
@@ -0,0 +1,50 @@
+COLUMNS = ('id', 'name', 'surname', 'email', 'phones')
+
+
+def client_row(client):
+
+    """
+    Converts a client record into the cells of a table row.
+    :param client: The client record (Client).
+    :return: A tuple of strings.
+    """
+
+    return (str(client.client_id), client.name, client.surname, client.email, ', '.join(client.phones))
+
+
+def render_table(clients):
+
+    """
+    Renders clients as a plain-text table.
+    :param clients: The client records (iterable of Client).
+    :return: The table (string).
+    """
+
+    rows = [COLUMNS] + [client_row(client) for client in clients]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def print_clients(clients):
+
+    """
+    Prints clients in a table.
+    :param clients: The client records (iterable of Client).
+    :return: None.
+    """
+
+    print(render_table(clients))
+
+
+def to_dataframe(clients):
+
+    """
+    Exports clients to a pandas DataFrame. pandas is imported only here, it is not needed for anything else.
+    :param clients: The client records (iterable of Client).
+    :return: A pandas.DataFrame with the columns id, name, surname, email, phones (list of strings).
+    """
+
+    import pandas as pd
+
+    return pd.DataFrame([(client.client_id, client.name, client.surname, client.email, list(client.phones))
+                         for client in clients], columns=list(COLUMNS))
@@ -0,0 +1,437 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+import main
+from cache import MISSING
+from instrumentation import InstrumentedCursor
+from main import User
+
+BALANCING = ('least_busy', 'round_robin')
+# Replication lag in seconds (0 on a server that is not a standby or has replayed everything it has received,
+# after a restart the received position starts at the beginning of a WAL segment, behind the replayed one)
+# and whether the replica has replayed the WAL position of the session's last write.
+REPLICA_STATE_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+                ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END,
+           %(lsn)s::pg_lsn IS NULL OR pg_last_wal_replay_lsn() >= %(lsn)s::pg_lsn;
+"""
+
+
+def lsn_value(lsn):
+
+    """
+    :param lsn: A WAL position as returned by PostgreSQL, e.g. "0/3000148" (string).
+    :return: The position as an integer, for comparisons.
+    """
+
+    high, low = lsn.split('/')
+    return int(high, 16) << 32 | int(low, 16)
+
+
+class Session:
+
+    """
+    Read-your-writes state of a caller: the WAL position of its last write on the primary.
+    """
+
+    def __init__(self):
+        self.lsn = None
+
+
+class Replica:
+
+    """
+    A read replica: its connection pool, the number of operations running on it and its last known state.
+    """
+
+    def __init__(self, dsn, maxconn):
+        self.dsn = dsn
+        # The pool is built with minconn 0 so that it opens no connections in advance: a replica that is down
+        # must not keep the repository from starting. But minconn is also the number of returned connections
+        # the pool keeps: putconn closes a connection once minconn are idle (psycopg2.pool.AbstractConnectionPool
+        # ._putconn), so with 0 every read would open a new connection. ThreadedConnectionPool has no separate
+        # setting for this; minconn is read only in the constructor and in _putconn, so it is raised afterwards
+        # to keep up to maxconn connections open once they are made.
+        self.pool = ThreadedConnectionPool(0, maxconn, dsn=dsn, cursor_factory=InstrumentedCursor)
+        self.pool.minconn = maxconn
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.busy = 0
+        self.down_until = 0.0
+        self.lag = 0.0
+        self.lag_checked_at = None
+
+
+class ClientRepository:
+
+    """
+    Thread-safe access to the client operations backed by a pool of PostgreSQL connections.
+    Every operation checks out a connection, runs in its own transaction and returns the connection to the pool.
+    With replicas, the reads (find_client, find_client_by_id, list_clients, find_clients_by_*) are balanced
+    over the replicas and everything else goes to the primary. A replica that fails or lags more than max_lag
+    is skipped and the read goes to the primary; inside read_your_writes() a replica is used only once it has
+    replayed the caller's last write. The cache is filled from a replica only once it has replayed the last
+    write that invalidated the cache, so a lagging replica cannot put an old row back into it.
+    """
+
+    def __init__(self, user=None, minconn=1, maxconn=10, cache=None, replica_dsns=None, balancing='least_busy',
+                 max_lag=5.0, lag_check_interval=1.0, retry_after=5.0):
+
+        """
+        Opens the connection pools.
+        :param user: The connection settings (User, optional, default is read from .env).
+        :param minconn: The number of connections opened in advance (integer, optional, default 1).
+        :param maxconn: The maximum number of simultaneously open connections, per server (integer, optional,
+        default 10).
+        :param cache: The cache for find_client and find_client_by_id (ClientCache, optional, default None).
+        :param replica_dsns: The connection strings of the read replicas (list of strings, optional, default
+        user.replica_dsns).
+        :param balancing: "least_busy" - the replica with the fewest running operations, or "round_robin"
+        (string, optional, default "least_busy").
+        :param max_lag: The replication lag in seconds above which a replica is not used (number, optional,
+        default 5.0).
+        :param lag_check_interval: How often the lag of a replica is checked, in seconds (number, optional,
+        default 1.0).
+        :param retry_after: How long a failed replica is not used, in seconds (number, optional, default 5.0).
+        """
+
+        if balancing not in BALANCING:
+            raise ValueError(f'Неизвестная балансировка: {balancing}. Доступны: {", ".join(BALANCING)}.')
+        self.user = user or User()
+        self.cache = cache
+        self.maxconn = maxconn
+        self.pool = ThreadedConnectionPool(minconn, maxconn, cursor_factory=InstrumentedCursor,
+                                           **self.user.connect_params())
+        # ThreadedConnectionPool raises PoolError when exhausted, the semaphore makes callers wait instead.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        dsns = self.user.replica_dsns if replica_dsns is None else replica_dsns
+        self.replicas = [Replica(dsn, maxconn) for dsn in dsns]
+        self.balancing = balancing
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+        # The WAL position of the last write that invalidated the cache.
+        self._written_lsn = None
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+
+        """
+        Closes all connections of the pool.
+        :return: None.
+        """
+
+        self.pool.closeall()
+        for replica in self.replicas:
+            replica.pool.closeall()
+
+    def _checkout(self, pool):
+
+        """
+        Takes a connection from a pool and checks that it is alive, broken connections are replaced.
+        :param pool: The pool (ThreadedConnectionPool).
+        :return: A connection object.
+        """
+
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if not conn.closed:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1;")
+                    conn.rollback()
+                    return conn
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    pass
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Не удалось получить рабочее соединение с базой данных.")
+
+    @contextmanager
+    def connection(self):
+
+        """
+        Checks out a healthy connection for one operation. Whatever the operation leaves uncommitted is rolled back,
+        so the next caller always gets a connection outside of a transaction.
+        :return: A context manager yielding a connection object.
+        """
+
+        with self._pooled(self.pool, self._slots) as conn:
+            yield conn
+
+    @contextmanager
+    def _pooled(self, pool, slots):
+        with slots:
+            conn = self._checkout(pool)
+            try:
+                yield conn
+            finally:
+                broken = conn.closed
+                if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        broken = True
+                pool.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self):
+
+        """
+        Checks out a connection and opens a cursor on it.
+        :return: A context manager yielding a cursor object.
+        """
+
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+    @contextmanager
+    def write_cursor(self):
+
+        """
+        A cursor on the primary for a write. With replicas the WAL position reached after the write is remembered
+        for the cache (it is remembered before the caller invalidates the cache) and, inside read_your_writes(),
+        in the session.
+        :return: A context manager yielding a cursor object.
+        """
+
+        with self.cursor() as cur:
+            yield cur
+            session = getattr(self._local, 'session', None)
+            if self.replicas and (session is not None or self.cache is not None):
+                cur.execute("SELECT pg_current_wal_lsn();")
+                lsn = cur.fetchone()[0]
+                cur.connection.rollback()
+                if session is not None:
+                    session.lsn = lsn
+                if self.cache is not None:
+                    with self._lock:
+                        if self._written_lsn is None or lsn_value(lsn) > lsn_value(self._written_lsn):
+                            self._written_lsn = lsn
+
+    @contextmanager
+    def read_your_writes(self, session=None):
+
+        """
+        Within the block the reads of this thread see the writes made in the session: they go to a replica only
+        after it has replayed the last write of the session, otherwise to the primary.
+        :param session: A Session kept between blocks, e.g. per user session (optional, default a new Session).
+        :return: A context manager yielding the Session.
+        """
+
+        session = session or Session()
+        previous = getattr(self._local, 'session', None)
+        self._local.session = session
+        try:
+            yield session
+        finally:
+            self._local.session = previous
+
+    def _pick_replica(self):
+
+        """
+        Picks a replica for a read and counts the read as running on it.
+        :return: A Replica, or None if no replica can be used.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            candidates = [replica for replica in self.replicas if replica.down_until <= now and (
+                replica.lag <= self.max_lag or now - replica.lag_checked_at >= self.lag_check_interval)]
+            if not candidates:
+                return None
+            self._next += 1
+            start = self._next % len(candidates)
+            candidates = candidates[start:] + candidates[:start]
+            replica = min(candidates, key=lambda r: r.busy) if self.balancing == 'least_busy' else candidates[0]
+            replica.busy += 1
+            return replica
+
+    def _replica_ready(self, replica, conn, lsn):
+
+        """
+        Checks the lag of a replica (at most once per lag_check_interval) and, for read-your-writes,
+        whether it has replayed the position lsn.
+        :return: True if the read can run on the replica.
+        """
+
+        now = time.monotonic()
+        check_lag = replica.lag_checked_at is None or now - replica.lag_checked_at >= self.lag_check_interval
+        if not check_lag and lsn is None:
+            return replica.lag <= self.max_lag
+        with conn.cursor() as cur:
+            cur.execute(REPLICA_STATE_SQL, {'lsn': lsn})
+            lag, caught_up = cur.fetchone()
+        if check_lag:
+            replica.lag, replica.lag_checked_at = float(lag), now
+        return replica.lag <= self.max_lag and bool(caught_up)
+
+    def _read(self, operation, *args, lsn=None):
+
+        """
+        Runs a read operation on a replica, or on the primary if there is no usable replica. A replica whose
+        connection fails is not used for retry_after seconds and the read is repeated on the primary. A read that
+        fails on a replica otherwise (e.g. cancelled by a recovery conflict) is repeated on the primary as well.
+        :param operation: The operation of main.py (function taking a cursor first).
+        :param lsn: A WAL position the replica must have replayed (string, optional, default None), in addition
+        to the last write of the read_your_writes() session.
+        :return: The result of the operation.
+        """
+
+        if (replica := self._pick_replica()) is not None:
+            session = getattr(self._local, 'session', None)
+            positions = [position for position in (lsn, session.lsn if session is not None else None) if position]
+            try:
+                with self._pooled(replica.pool, replica.slots) as conn:
+                    if self._replica_ready(replica, conn, max(positions, key=lsn_value, default=None)):
+                        conn.rollback()
+                        with conn.cursor() as cur:
+                            result = operation(cur, *args)
+                        # The operations print and swallow their errors and return None, a lost connection shows
+                        # as closed. A successful read returning None (a client not found) leaves its transaction
+                        # open, a failed one leaves it aborted or rolled back.
+                        if conn.closed:
+                            replica.down_until = time.monotonic() + self.retry_after
+                        elif result is not None or (
+                                conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS):
+                            return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                replica.down_until = time.monotonic() + self.retry_after
+            except psycopg2.Error:
+                pass
+            finally:
+                with self._lock:
+                    replica.busy -= 1
+        with self.cursor() as cur:
+            return operation(cur, *args)
+
+    def create_tables(self):
+        with self.write_cursor() as cur:
+            return main.create_tables(cur)
+
+    def add_client(self, name, surname, email, phones=None):
+        with self.write_cursor() as cur:
+            result = main.add_client(cur, name, surname, email, phones)
+        if self.cache is not None:
+            self.cache.invalidate_search(name, surname, email, *(phones or []))
+        return result
+
+    def add_phone(self, client_id, phone):
+        with self.write_cursor() as cur:
+            result = main.add_phone(cur, client_id, phone)
+        if self.cache is not None:
+            self.cache.invalidate_client(client_id)
+            self.cache.invalidate_search(phone)
+        return result
+
+    def delete_phone(self, client_id, phone):
+        with self.write_cursor() as cur:
+            result = main.delete_phone(cur, client_id, phone)
+        if self.cache is not None:
+            self.cache.invalidate_client(client_id)
+            self.cache.invalidate_search(phone)
+        return result
+
+    def update_data(self, client_id, name=None, surname=None, email=None, phones=None):
+        with self.write_cursor() as cur:
+            result = main.update_data(cur, client_id, name, surname, email, phones)
+        if self.cache is not None:
+            self.cache.invalidate_client(client_id)
+            self.cache.invalidate_search(name, surname, email, *(phones or []))
+        return result
+
+    def update_clients(self, updates, batch_size=10000):
+        updates = main.merge_updates(updates)
+        with self.write_cursor() as cur:
+            result = main.update_clients(cur, updates, batch_size)
+        if self.cache is not None:
+            for update in updates:
+                self.cache.invalidate_client(update['client_id'])
+                self.cache.invalidate_search(update.get('name'), update.get('surname'), update.get('email'),
+                                             *(update.get('phones') or []))
+        return result
+
+    def delete_client(self, client_id):
+        with self.write_cursor() as cur:
+            result = main.delete_client(cur, client_id)
+        if self.cache is not None:
+            self.cache.invalidate_client(client_id)
+        return result
+
+    def delete_clients(self, client_ids=None, batch_size=1000, pause=0.0, name=None, surname=None, email=None):
+        with self.write_cursor() as cur:
+            result = main.delete_clients(cur, client_ids, batch_size, pause, name, surname, email)
+        if self.cache is not None:
+            self.cache.clear()
+        return result
+
+    def find_client(self, data):
+        if self.cache is None:
+            return self._read(main.find_client, data)
+        if (clients := self.cache.get_search(data)) is not MISSING:
+            if not clients:
+                print("Таких клиентов нет в базе данных.")
+            return list(clients)
+        # The generation before the position: a write that invalidates after this point also drops the result.
+        generation = self.cache.generation
+        clients = self._read(main.find_client, data, lsn=self._written_lsn)
+        if clients is not None:
+            self.cache.put_search(data, tuple(clients), generation)
+        return clients
+
+    def find_client_by_id(self, client_id):
+        if self.cache is None:
+            return self._read(main.find_client_by_id, client_id)
+        if (client := self.cache.get_client(client_id)) is not MISSING:
+            return client
+        generation = self.cache.generation
+        client = self._read(main.find_client_by_id, client_id, lsn=self._written_lsn)
+        if client is not None:
+            self.cache.put_client(client_id, client, generation)
+        return client
+
+    def list_clients(self, limit=50, cursor=None, order='client_id', name=None, surname=None, email=None):
+        return self._read(main.list_clients, limit, cursor, order, name, surname, email)
+
+    def find_clients_by_ids(self, client_ids, itersize=2000):
+        return self._read(main.find_clients_by_ids, client_ids, itersize)
+
+    def find_clients_by_emails(self, emails, itersize=2000):
+        return self._read(main.find_clients_by_emails, emails, itersize)
+
+    def find_clients_by_phones(self, phones, itersize=2000):
+        return self._read(main.find_clients_by_phones, phones, itersize)
+
+    def changes_since(self, seq=0, limit=1000):
+
+        """
+        Reads one page of the change log, see main.changes_since. The page is returned as a list, so its
+        connection goes back to the pool at once; the whole log (limit None) is streamed with main.changes_since
+        on a connection of the caller instead.
+        :param seq: The number of the last change already seen (integer, optional, default 0).
+        :param limit: The maximum number of changes (integer, optional, default 1000).
+        :return: A list of Change.
+        :raises ValueError: If limit is None.
+        """
+
+        if limit is None:
+            raise ValueError('Журнал изменений читается страницами: задайте limit или используйте main.changes_since.')
+        with self.cursor() as cur:
+            return list(main.changes_since(cur, seq, limit))
+
+    def delete_tables(self):
+        with self.write_cursor() as cur:
+            return main.delete_tables(cur)
@@ -0,0 +1,430 @@
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from typing import NamedTuple
+
+import psycopg2
+
+from main import Client, User, assign_change_seqs, changes_since, search_kind
+from validation import phone_key
+
+MAGIC = b'CLSNAP01'
+FORMAT_VERSION = 1
+FETCH_SIZE = 10000
+# Fixed-width sections of 64-bit integers, in the order they are stored after the header.
+SECTIONS = ('ids', 'string_offsets', 'phone_offsets', 'phone_ids', 'phone_clients', 'phone_keys',
+            'name_offsets', 'name_clients', 'email_index', 'name_index', 'phone_index')
+# magic, format version, reserved, change log seq, build time, clients, phones, strings size,
+# then an (offset, length) pair per section.
+HEADER = struct.Struct('<8sIIqdqqq' + 'qq' * len(SECTIONS))
+NO_PHONE_KEY = -1
+SNAPSHOT_CLIENTS_SQL = "SELECT client_id, name, surname, email FROM clients ORDER BY client_id;"
+SNAPSHOT_PHONES_SQL = "SELECT phone_id, client_id, phone, phone_key FROM phones ORDER BY phone_id;"
+
+
+class BuildResult(NamedTuple):
+
+    """
+    The outcome of build_snapshot: the change log seq the snapshot is current to, its size and the number
+    of changes applied to the previous snapshot (None for a full build).
+    """
+
+    seq: int
+    clients: int
+    phones: int
+    changes: int = None
+
+
+def key_hash(key):
+
+    """
+    A 64-bit hash of an index key that does not change between processes, unlike hash().
+    :param key: The key (bytes).
+    :return: A signed 64-bit integer.
+    """
+
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little', signed=True)
+
+
+def phone_hash(key):
+    return key_hash(key.to_bytes(8, 'little', signed=True))
+
+
+def hash_index(entries, count):
+
+    """
+    Builds an open-addressing hash table with linear probing. A slot is a pair (hash, reference + 1),
+    0 in the second place marks an empty slot. The keys must be unique, a repeated key would make a long run
+    of probes; a key shared by many records refers to a list of them.
+    :param entries: The pairs (hash, reference) (iterable).
+    :param count: The number of entries (integer).
+    :return: The slots (array of 64-bit integers).
+    """
+
+    size = 8
+    while size < count * 2:
+        size *= 2
+    mask = size - 1
+    slots = array('q', bytes(16 * size))
+    for value, reference in entries:
+        slot = value & mask
+        while slots[2 * slot + 1]:
+            slot = (slot + 1) & mask
+        slots[2 * slot] = value
+        slots[2 * slot + 1] = reference + 1
+    return slots
+
+
+def probe(slots, value):
+
+    """
+    :param slots: A hash table built by hash_index (sequence of integers).
+    :param value: The hash of the key (integer).
+    :return: A generator of the references stored with this hash (more than one only on a hash collision),
+    the caller compares the keys.
+    """
+
+    mask = len(slots) // 2 - 1
+    slot = value & mask
+    while reference := slots[2 * slot + 1]:
+        if slots[2 * slot] == value:
+            yield reference - 1
+        slot = (slot + 1) & mask
+
+
+def write_snapshot(path, seq, clients, phones):
+
+    """
+    Writes a snapshot file. The file is written next to path and renamed over it, so a reader opens either
+    the old or the new snapshot, and a reader that has the old one mapped keeps reading it.
+    :param path: The path to the snapshot file (string).
+    :param seq: The change log seq the data is current to (integer).
+    :param clients: {client_id: (name, surname, email)}.
+    :param phones: {phone_id: (client_id, phone, phone_key or None)}.
+    :return: None.
+    """
+
+    ids = array('q', sorted(clients))
+    position = {client_id: i for i, client_id in enumerate(ids)}
+    owned = sorted((position[client_id], phone_id) for phone_id, (client_id, _, _) in phones.items()
+                   if client_id in position)
+    strings, string_offsets = bytearray(), array('q', [0])
+    for client_id in ids:
+        for value in clients[client_id]:
+            strings += (value or '').encode()
+            string_offsets.append(len(strings))
+    phone_offsets, phone_ids, phone_clients, phone_keys = array('q', [0] * (len(ids) + 1)), array('q'), \
+        array('q'), array('q')
+    for i, phone_id in owned:
+        _, phone, key = phones[phone_id]
+        strings += (phone or '').encode()
+        string_offsets.append(len(strings))
+        phone_offsets[i + 1] += 1
+        phone_ids.append(phone_id)
+        phone_clients.append(i)
+        phone_keys.append(NO_PHONE_KEY if key is None else key)
+    for i in range(len(ids)):
+        phone_offsets[i + 1] += phone_offsets[i]
+    # Names and surnames share one index, as in find_client where either of them matches. A name refers
+    # to the list of its clients in name_clients, in the order of client_id.
+    names = {}
+    for i, client_id in enumerate(ids):
+        for value in {name.lower() for name in clients[client_id][:2]}:
+            names.setdefault(value, array('q')).append(i)
+    name_offsets, name_clients = array('q', [0]), array('q')
+    for positions in names.values():
+        name_clients.extend(positions)
+        name_offsets.append(len(name_clients))
+    sections = {
+        'ids': ids,
+        'string_offsets': string_offsets,
+        'phone_offsets': phone_offsets,
+        'phone_ids': phone_ids,
+        'phone_clients': phone_clients,
+        'phone_keys': phone_keys,
+        'name_offsets': name_offsets,
+        'name_clients': name_clients,
+        'email_index': hash_index(((key_hash(clients[client_id][2].encode()), i)
+                                   for i, client_id in enumerate(ids)), len(ids)),
+        'name_index': hash_index(((key_hash(name.encode()), k) for k, name in enumerate(names)), len(names)),
+        'phone_index': hash_index(((phone_hash(key), p) for p, key in enumerate(phone_keys)
+                                   if key != NO_PHONE_KEY), len(phone_keys)),
+    }
+    layout, offset = [], HEADER.size
+    for name in SECTIONS:
+        layout.extend((offset, len(sections[name])))
+        offset += sections[name].itemsize * len(sections[name])
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, seq, time.time(), len(ids), len(phone_ids), len(strings),
+                         *layout)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            for name in SECTIONS:
+                sections[name].tofile(f)
+            f.write(strings)
+        # mkstemp creates the file readable by the owner only, the snapshot is shared with other processes.
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class Snapshot:
+
+    """
+    Read-only lookups in a snapshot file without a database connection. The file is memory-mapped, so opening
+    it reads only the header, and every process that opens the same file shares its pages in the page cache.
+    find_client and find_client_by_id return the same results as the functions of main.py, without the messages.
+    seq and built_at tell how stale the snapshot is.
+    """
+
+    def __init__(self, path):
+
+        """
+        Maps a snapshot file.
+        :param path: The path to the snapshot file (string).
+        :raises ValueError: If the file is not a snapshot or has another format version.
+        """
+
+        self.path = path
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, self.seq, self.built_at, self.clients, self.phones, strings_size, *layout = \
+                HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f'Файл {self.path} не является снимком клиентов версии {FORMAT_VERSION}.')
+        view = memoryview(self._mmap)
+        self._views = [view]
+        for name, offset, length in zip(SECTIONS, layout[::2], layout[1::2]):
+            self._views.append(view[offset:offset + 8 * length])
+            self._views.append(self._views[-1].cast('q'))
+            setattr(self, f'_{name}', self._views[-1])
+        offset = layout[-2] + 8 * layout[-1]
+        self._strings = view[offset:offset + strings_size]
+        self._views.append(self._strings)
+
+    def close(self):
+
+        """
+        Unmaps the file.
+        :return: None.
+        """
+
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    @property
+    def age(self):
+
+        """
+        :return: The seconds since the snapshot was built (float).
+        """
+
+        return time.time() - self.built_at
+
+    def refresh(self):
+
+        """
+        Maps the file again if it has been replaced by a newer snapshot since it was opened.
+        :return: True if the newer snapshot is now used.
+        """
+
+        if os.stat(self.path).st_ino == self._inode:
+            return False
+        self.close()
+        self._open()
+        return True
+
+    def _string(self, i):
+        return str(self._strings[self._string_offsets[i]:self._string_offsets[i + 1]], 'utf-8')
+
+    def _client(self, i):
+        first = 3 * self.clients
+        phones = tuple(self._string(first + p) for p in range(self._phone_offsets[i], self._phone_offsets[i + 1]))
+        return Client(self._ids[i], self._string(3 * i), self._string(3 * i + 1), self._string(3 * i + 2), phones)
+
+    def find_client_by_id(self, client_id):
+
+        """
+        Finds a client by their ID.
+        :param client_id: The ID of the client (integer).
+        :return: The client data (Client), or None if there is no such client.
+        """
+
+        i = bisect.bisect_left(self._ids, client_id)
+        if i < self.clients and self._ids[i] == client_id:
+            return self._client(i)
+        return None
+
+    def find_client(self, data):
+
+        """
+        Searches for clients by email, phone number, name or surname (names case-insensitively), see main.find_client.
+        :param data: The data for search query (string).
+        :return: The list of found clients (list of Client).
+        """
+
+        kind = search_kind(data)
+        if kind == 'email':
+            return [self._client(i) for i in probe(self._email_index, key_hash(data.encode()))
+                    if self._string(3 * i + 2) == data][:1]
+        if kind == 'phone':
+            if (key := phone_key(data)) is None:
+                return []
+            return [self._client(self._phone_clients[p]) for p in probe(self._phone_index, phone_hash(key))
+                    if self._phone_keys[p] == key][:1]
+        lowered = data.lower()
+        for k in probe(self._name_index, key_hash(lowered.encode())):
+            positions = self._name_clients[self._name_offsets[k]:self._name_offsets[k + 1]]
+            if lowered in (self._string(3 * positions[0]).lower(), self._string(3 * positions[0] + 1).lower()):
+                return [self._client(i) for i in positions]
+        return []
+
+    def contents(self):
+
+        """
+        :return: A tuple ({client_id: (name, surname, email)}, {phone_id: (client_id, phone, phone_key or None)}),
+        the form write_snapshot takes.
+        """
+
+        clients = {self._ids[i]: (self._string(3 * i), self._string(3 * i + 1), self._string(3 * i + 2))
+                   for i in range(self.clients)}
+        first = 3 * self.clients
+        phones = {self._phone_ids[p]: (self._ids[self._phone_clients[p]], self._string(first + p),
+                                       None if self._phone_keys[p] == NO_PHONE_KEY else self._phone_keys[p])
+                  for p in range(self.phones)}
+        return clients, phones
+
+
+def read_tables(conn, fetch_size=FETCH_SIZE):
+
+    """
+    Reads all clients and phones and the change log seq they are current to from one transaction snapshot.
+    The changes are numbered first, so every change up to the seq is part of the data read. A change committed
+    after the numbering may be read too, it gets a greater seq and is applied again by the next incremental
+    build, which is harmless because a change carries the whole row.
+    :param conn: A connection object representing the connection to the database.
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: A tuple (seq, clients, phones) in the form write_snapshot takes.
+    """
+
+    with conn.cursor() as cur:
+        assign_change_seqs(cur)
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+        cur.execute("SELECT coalesce(max(seq), 0) FROM client_changes;")
+        seq = cur.fetchone()[0]
+    clients, phones = {}, {}
+    for name, sql in (('snapshot_clients', SNAPSHOT_CLIENTS_SQL), ('snapshot_phones', SNAPSHOT_PHONES_SQL)):
+        with conn.cursor(name=name) as server_cur:
+            server_cur.itersize = fetch_size
+            server_cur.execute(sql)
+            for row in server_cur:
+                if name == 'snapshot_clients':
+                    clients[row[0]] = row[1:]
+                else:
+                    phones[row[0]] = row[1:]
+    conn.rollback()
+    return seq, clients, phones
+
+
+def apply_changes(clients, phones, changes):
+
+    """
+    Applies change log entries to the contents of a snapshot.
+    :param clients: {client_id: (name, surname, email)}, changed in place.
+    :param phones: {phone_id: (client_id, phone, phone_key or None)}, changed in place.
+    :param changes: The changes in the order of seq (iterable of Change).
+    :return: The seq of the last change, or None if there were no changes.
+    """
+
+    seq = None
+    for change in changes:
+        table = clients if change.entity == 'client' else phones
+        if change.operation == 'delete':
+            table.pop(change.entity_id, None)
+        elif change.entity == 'client':
+            table[change.entity_id] = (change.data['name'], change.data['surname'], change.data['email'])
+        else:
+            table[change.entity_id] = (change.data['client_id'], change.data['phone'], change.data['phone_key'])
+        seq = change.seq
+    return seq
+
+
+def build_snapshot(conn, path, incremental=True, fetch_size=FETCH_SIZE):
+
+    """
+    Builds or updates a snapshot file of all clients and phones. If the file exists and incremental is set,
+    only the changes made after its seq are read from the change log and applied, otherwise the tables
+    are read in full.
+    :param conn: A connection object representing the connection to the database.
+    :param path: The path to the snapshot file (string).
+    :param incremental: Whether an existing snapshot is updated from the change log (boolean, optional,
+    default True).
+    :param fetch_size: The number of rows fetched from the server at once (integer, optional, default 10000).
+    :return: A BuildResult.
+    """
+
+    started = time.perf_counter()
+    previous = None
+    if incremental and os.path.exists(path):
+        try:
+            previous = Snapshot(path)
+        except ValueError as error:
+            print(error, 'Снимок будет построен заново.')
+    if previous is not None:
+        with previous:
+            seq = previous.seq
+            clients, phones = previous.contents()
+        with conn.cursor() as cur:
+            changes = list(changes_since(cur, seq, limit=None, itersize=fetch_size))
+        conn.rollback()
+        seq = apply_changes(clients, phones, changes) or seq
+        result = BuildResult(seq, len(clients), len(phones), len(changes))
+    else:
+        seq, clients, phones = read_tables(conn, fetch_size)
+        result = BuildResult(seq, len(clients), len(phones))
+    # Written even without changes: built_at then tells that the snapshot was current at this time.
+    write_snapshot(path, seq, clients, phones)
+    elapsed = time.perf_counter() - started
+    print(f"Снимок {path}: клиентов {result.clients}, телефонов {result.phones}, изменения до №{result.seq}"
+          f"{'' if result.changes is None else f', применено изменений: {result.changes}'} за {elapsed:.2f} сек.")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Снимок клиентов и телефонов для поиска без подключения к базе.')
+    parser.add_argument('path', help='файл снимка')
+    parser.add_argument('--full', action='store_true', help='построить заново, а не дополнить из журнала изменений')
+    parser.add_argument('--fetch-size', type=int, default=FETCH_SIZE, help='строк за одно обращение к серверу')
+    args = parser.parse_args()
+    user = User()
+    conn = psycopg2.connect(**user.connect_params())
+    try:
+        build_snapshot(conn, args.path, not args.full, args.fetch_size)
+    finally:
+        conn.close()
@@ -0,0 +1,146 @@
+import re
+import threading
+import weakref
+from typing import NamedTuple
+
+from psycopg2 import errors, extensions
+
+PLACEHOLDER = re.compile(r'%%|%\((\w+)\)s|%s')
+
+
+class Statement(NamedTuple):
+
+    """
+    A registered statement: the original SQL with psycopg2 placeholders and its server-side form with $n parameters.
+    """
+
+    name: str
+    sql: str
+    body: str
+    params: tuple
+
+
+def to_positional(sql):
+
+    """
+    Converts psycopg2 placeholders to the $n parameters of PREPARE. A named parameter used several times
+    becomes one $n, "%%" is kept because the EXECUTE statement is formatted by psycopg2 again.
+    :param sql: The statement with %s or %(name)s placeholders (string).
+    :return: A tuple (statement with $n parameters, tuple of parameter names or of None for %s).
+    """
+
+    names = []
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%%'
+        name = match.group(1)
+        if name is None or name not in names:
+            names.append(name)
+            return f'${len(names)}'
+        return f'${names.index(name) + 1}'
+
+    return PLACEHOLDER.sub(replace, sql), tuple(names)
+
+
+class StatementRegistry:
+
+    """
+    Hot-path statements prepared once per connection and then run with EXECUTE, so the server does not parse
+    and plan them on every call. The registry remembers which statements every connection has prepared;
+    a new connection (or a reconnected one, it gets another backend) prepares them on first use, a statement
+    invalidated by a schema change is prepared again. With enabled = False the statements are sent as plain SQL,
+    e.g. behind a transaction-pooling pgbouncer.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, name, sql):
+
+        """
+        Adds a statement to the registry.
+        :param name: The name of the prepared statement, a valid SQL identifier (string).
+        :param sql: The statement with %s or %(name)s placeholders (string).
+        :return: The Statement.
+        :raises ValueError: If the name is already taken by another statement.
+        """
+
+        if (known := self.statements.get(name)) is not None:
+            # The same module imported twice (e.g. main.py run as a script) registers the same statements again.
+            if known.sql == sql:
+                return known
+            raise ValueError(f'Statement {name} is already registered.')
+        body, params = to_positional(sql)
+        self.statements[name] = statement = Statement(name, sql, body, params)
+        return statement
+
+    def prepared(self, conn):
+
+        """
+        :param conn: A connection object.
+        :return: The set of statement names prepared on the current backend of the connection.
+        """
+
+        pid = conn.get_backend_pid()
+        with self._lock:
+            known = self._prepared.get(conn)
+            if known is None or known[0] != pid:
+                known = self._prepared[conn] = (pid, set())
+            return known[1]
+
+    def execute(self, cur, statement, params=()):
+
+        """
+        Executes a registered statement, preparing it on the connection first if needed. If the server has lost
+        or invalidated the statement and no transaction was open before the call, the transaction is rolled back
+        and the statement is prepared again; inside a transaction the error is raised and the next call prepares
+        the statement.
+        :param cur: A cursor object used to execute SQL commands.
+        :param statement: The statement (Statement).
+        :param params: The parameters (tuple for %s, dict for %(name)s placeholders).
+        :return: None, the results are read from the cursor.
+        """
+
+        if not self.enabled:
+            cur.execute(statement.sql, params)
+            return
+        conn = cur.connection
+        values = [params[name] for name in statement.params] if isinstance(params, dict) else list(params)
+        run = f"EXECUTE {statement.name}({', '.join(['%s'] * len(values))});" if values else \
+            f"EXECUTE {statement.name};"
+        idle = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        prepared = self.prepared(conn)
+        deallocate = False
+        for attempt in range(2):
+            try:
+                if deallocate:
+                    cur.execute(f"DEALLOCATE {statement.name};")
+                    prepared.discard(statement.name)
+                if statement.name not in prepared:
+                    # The empty parameters make psycopg2 turn "%%" back into "%".
+                    cur.execute(f"PREPARE {statement.name} AS {statement.body};", ())
+                    prepared.add(statement.name)
+                cur.execute(run, values)
+                return
+            except errors.DuplicatePreparedStatement:
+                prepared.add(statement.name)
+                if attempt or not idle:
+                    raise
+            except errors.InvalidSqlStatementName:
+                prepared.discard(statement.name)
+                if attempt or not idle:
+                    raise
+            except errors.FeatureNotSupported:
+                # "cached plan must not change result type" after a schema change: the server keeps
+                # the statement, so it is replaced on the retry or left for the next call to replace.
+                deallocate = True
+                if attempt or not idle:
+                    raise
+            conn.rollback()
+
+
+statements = StatementRegistry()
@@ -0,0 +1,270 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple
+
+CACHE_SIZE = 100000
+CHUNK_SIZE = 1000
+
+
+class ValidationResult(NamedTuple):
+
+    """
+    The result of validating one value: the normalized value or the error message.
+    """
+
+    value: str
+    normalized: str = None
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def check_mail(email):
+
+    """
+    Validates an email address without printing anything.
+    :param email: The email address to validate (string).
+    :return: A tuple (normalized email or None, error message or None).
+    """
+
+    # phonenumbers and email_validator are imported on first use, they take most of the start-up time.
+    from email_validator import validate_email
+
+    try:
+        return validate_email(email, check_deliverability=False).normalized, None
+    except (ValueError, TypeError) as e:
+        return None, str(e)
+
+
+def check_phone(phone):
+
+    """
+    Validates a phone number without printing anything.
+    :param phone: The phone number to validate (string).
+    :return: A tuple (formatted international phone number or None, error message or None).
+    """
+
+    import phonenumbers
+
+    try:
+        p = phonenumbers.parse(phone)
+    except Exception:
+        return None, f'Номер {phone} не существует.'
+    if not phonenumbers.is_valid_number(p):
+        return None, f'Номер {phone} не валиден.'
+    return phonenumbers.format_number(p, phonenumbers.PhoneNumberFormat.INTERNATIONAL), None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def phone_key(phone):
+
+    """
+    Computes the canonical key of a phone number: the digits of its E.164 form as an integer, so
+    "+7 956 294-85-73" and "+79562948573" get the same key. Phones are stored, compared and indexed by this key.
+    :param phone: The phone number in international format (string).
+    :return: The key (integer), or None if the number cannot be parsed.
+    """
+
+    import phonenumbers
+
+    try:
+        return int(phonenumbers.format_number(phonenumbers.parse(phone), phonenumbers.PhoneNumberFormat.E164)[1:])
+    except Exception:
+        return None
+
+
+def _check_chunk(check, values):
+    return [check(value) for value in values]
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+_MISSING = object()
+
+
+class Memo:
+
+    """
+    A thread-safe bounded LRU memo of a check function. Unlike functools.lru_cache it can be looked up
+    and filled separately, so results computed in worker processes are remembered too.
+    """
+
+    def __init__(self, check, maxsize):
+        self.check = check
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __call__(self, value):
+        if (result := self.get(value)) is _MISSING:
+            result = self.check(value)
+            self.put(value, result)
+        return result
+
+    def get(self, value):
+
+        """
+        :param value: The checked value.
+        :return: The remembered result, or _MISSING.
+        """
+
+        with self._lock:
+            if (result := self._results.get(value, _MISSING)) is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._results.move_to_end(value)
+            return result
+
+    def put(self, value, result):
+        with self._lock:
+            self._results[value] = result
+            self._results.move_to_end(value)
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
+
+
+class Validator:
+
+    """
+    Email and phone validation with a bounded memo of the results, so repeated values are validated once.
+    The batch methods return structured results instead of printing and can spread large inputs over processes:
+    only the values missing from the memo are sent to a process pool, which is kept between calls (close() stops it),
+    and the results are added to the memo.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+
+        """
+        :param cache_size: The maximum number of remembered emails and, separately, phones (integer, optional,
+        default 100000).
+        """
+
+        self._mail = Memo(check_mail, cache_size)
+        self._phone = Memo(check_phone, cache_size)
+        self._pool = None
+        self._pool_size = None
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def mail(self, email):
+
+        """
+        Validates an email address.
+        :param email: The email address to validate (string).
+        :return: A ValidationResult.
+        """
+
+        return ValidationResult(email, *self._mail(email))
+
+    def phone(self, phone):
+
+        """
+        Validates a phone number.
+        :param phone: The phone number to validate (string).
+        :return: A ValidationResult.
+        """
+
+        return ValidationResult(phone, *self._phone(phone))
+
+    def mails(self, emails, processes=None, chunksize=CHUNK_SIZE):
+
+        """
+        Validates many email addresses.
+        :param emails: The email addresses to validate (iterable of strings).
+        :param processes: The number of worker processes, None validates in the current process (optional).
+        :param chunksize: The number of values sent to a worker process at once (integer, optional, default 1000).
+        :return: A list of ValidationResult in the order of the input.
+        """
+
+        return self._validate_many(emails, self._mail, processes, chunksize)
+
+    def phones(self, phones, processes=None, chunksize=CHUNK_SIZE):
+
+        """
+        Validates many phone numbers.
+        :param phones: The phone numbers to validate (iterable of strings).
+        :param processes: The number of worker processes, None validates in the current process (optional).
+        :param chunksize: The number of values sent to a worker process at once (integer, optional, default 1000).
+        :return: A list of ValidationResult in the order of the input.
+        """
+
+        return self._validate_many(phones, self._phone, processes, chunksize)
+
+    def cache_info(self):
+
+        """
+        :return: A dict with the statistics of the memos (hits, misses, maxsize, currsize) for emails and phones.
+        """
+
+        return {'mails': self._mail.cache_info()._asdict(), 'phones': self._phone.cache_info()._asdict()}
+
+    def close(self):
+
+        """
+        Stops the worker processes, the next call with processes starts them again.
+        :return: None.
+        """
+
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._pool, self._pool_size = None, None
+
+    def _workers(self, processes):
+
+        """
+        :param processes: The number of worker processes (integer).
+        :return: The process pool of the validator, created on first use or when the number of processes changes.
+        """
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._pool_lock:
+            if self._pool_size != processes:
+                if self._pool is not None:
+                    self._pool.shutdown()
+                self._pool, self._pool_size = ProcessPoolExecutor(processes), processes
+            return self._pool
+
+    def _validate_many(self, values, memo, processes, chunksize):
+        values = list(values)
+        results, missing = {}, []
+        for value in dict.fromkeys(values):
+            if (result := memo.get(value)) is _MISSING:
+                missing.append(value)
+            else:
+                results[value] = result
+        if not processes or processes < 2 or len(missing) <= chunksize:
+            for value in missing:
+                results[value] = result = memo.check(value)
+                memo.put(value, result)
+        else:
+            chunks = [missing[i:i + chunksize] for i in range(0, len(missing), chunksize)]
+            pool = self._workers(processes)
+            for chunk, checked in zip(chunks, pool.map(_check_chunk, [memo.check] * len(chunks), chunks)):
+                for value, result in zip(chunk, checked):
+                    results[value] = result
+                    memo.put(value, result)
+        return [ValidationResult(value, *results[value]) for value in values]
+
+
+validator = Validator()
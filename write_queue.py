@@ -0,0 +1,390 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+
+import psycopg2
+from psycopg2 import Error, InterfaceError, OperationalError
+
+from instrumentation import InstrumentedCursor, instrumented
+from main import AddClientResult, PhoneOutcome, User
+from validation import phone_key
+
+MAX_ITEMS = 500
+MAX_DELAY_MS = 10
+MAX_QUEUED = 10000
+
+INSERT_CLIENTS_SQL = """
+    WITH new AS (
+        SELECT DISTINCT ON (email) *
+          FROM unnest(%(names)s::varchar[], %(surnames)s::varchar[], %(emails)s::varchar[]) WITH ORDINALITY
+               AS n(name, surname, email, ord)
+         ORDER BY email, ord
+    )
+    INSERT INTO clients(name, surname, email)
+    SELECT name, surname, email
+      FROM new
+     ORDER BY ord
+    ON CONFLICT (email) DO NOTHING
+      RETURNING client_id, email;
+"""
+INSERT_PHONES_SQL = """
+    WITH wanted AS (
+        SELECT DISTINCT ON (phone_key) *
+          FROM unnest(%(client_ids)s::integer[], %(phones)s::text[], %(phone_keys)s::bigint[]) WITH ORDINALITY
+               AS w(client_id, phone, phone_key, ord)
+         WHERE EXISTS (SELECT 1 FROM clients c WHERE c.client_id = w.client_id)
+         ORDER BY phone_key, ord
+    )
+    INSERT INTO phones(client_id, phone, phone_key)
+    SELECT client_id, phone, phone_key
+      FROM wanted
+     ORDER BY ord
+    ON CONFLICT (phone_key) DO NOTHING
+      RETURNING phone_id, client_id, phone_key;
+"""
+
+
+class WriteError(Exception):
+
+    """
+    A write rejected by the database. The other writes of the same batch are committed.
+    """
+
+    def __init__(self, message, client_id=None):
+        super().__init__(message)
+        self.client_id = client_id
+
+
+class DuplicateEmail(WriteError):
+
+    """
+    A client with this email already exists, client_id is the id of that client.
+    """
+
+
+class DuplicatePhone(WriteError):
+
+    """
+    The phone is registered already, client_id is the id of its owner.
+    """
+
+
+class ClientNotFound(WriteError):
+
+    """
+    There is no client with this id.
+    """
+
+
+class ConnectionLost(WriteError):
+
+    """
+    The connection broke while the batch was written, none of its writes is reported as done. If it broke
+    during the commit, the writes may still be in the database: a repeated add_client then gets DuplicateEmail.
+    The next batch is written over a new connection.
+    """
+
+
+class ClientItem(NamedTuple):
+    name: str
+    surname: str
+    email: str
+    phones: tuple
+    future: Future
+
+
+class PhoneItem(NamedTuple):
+    client_id: int
+    phone: str
+    key: int
+    future: Future
+
+
+class FlushItem(NamedTuple):
+    future: Future
+
+
+_CLOSE = object()
+
+
+@instrumented
+def write_batch(cur, items):
+
+    """
+    Inserts the clients and phones of a batch with two multi-row statements in the current transaction.
+    Only the outcomes are computed, the futures are resolved by the caller after the commit.
+    :param cur: A cursor object used to execute SQL commands.
+    :param items: The writes (list of ClientItem and PhoneItem).
+    :return: A list of pairs (item, result or WriteError).
+    """
+
+    clients = [item for item in items if isinstance(item, ClientItem)]
+    outcomes = {}
+    created = {}
+    if clients:
+        cur.execute(INSERT_CLIENTS_SQL, {'names': [item.name.capitalize() for item in clients],
+                                         'surnames': [item.surname.capitalize() for item in clients],
+                                         'emails': [item.email for item in clients]})
+        created = {email: client_id for client_id, email in cur.fetchall()}
+        existing = {}
+        if missing := {item.email for item in clients} - created.keys():
+            cur.execute("SELECT email, client_id FROM clients WHERE email = ANY(%s);", (list(missing),))
+            existing = dict(cur.fetchall())
+        owners = {}
+        for item in clients:
+            # A repeated email in the batch is a duplicate of its first occurrence.
+            if item.email in created and item.email not in owners:
+                owners[item.email] = item
+            else:
+                client_id = created.get(item.email, existing.get(item.email))
+                outcomes[item] = DuplicateEmail(f'Клиент с email {item.email} уже есть в базе данных.', client_id)
+    phones = [(created[item.email], phone, key, item) for item in clients if item not in outcomes
+              for phone in item.phones if (key := phone_key(phone)) is not None]
+    phones.extend((item.client_id, item.phone, item.key, item) for item in items if isinstance(item, PhoneItem))
+    inserted, taken = {}, {}
+    if phones:
+        cur.execute(INSERT_PHONES_SQL, {'client_ids': [client_id for client_id, _, _, _ in phones],
+                                        'phones': [phone for _, phone, _, _ in phones],
+                                        'phone_keys': [key for _, _, key, _ in phones]})
+        inserted = {key: (phone_id, client_id) for phone_id, client_id, key in cur.fetchall()}
+        if missing := {key for _, _, key, _ in phones} - inserted.keys():
+            cur.execute("SELECT phone_key, client_id FROM phones WHERE phone_key = ANY(%s::bigint[]);",
+                        (list(missing),))
+            taken = dict(cur.fetchall())
+    claimed = set()
+    for client_id, phone, key, item in phones:
+        phone_id, owner = inserted.get(key, (None, taken.get(key)))
+        # Only the first write of a key in the batch gets the new phone, the others see it as taken.
+        added = phone_id is not None and key not in claimed and owner == client_id
+        if added:
+            claimed.add(key)
+        if isinstance(item, PhoneItem):
+            if added:
+                outcomes[item] = phone_id
+            elif owner is not None:
+                outcomes[item] = DuplicatePhone(f"Номер {phone} уже зарегистрирован для клиента id {owner}.", owner)
+            else:
+                outcomes[item] = ClientNotFound(f"Клиента с id {client_id} нет в базе данных.", client_id)
+        else:
+            phone_outcomes = outcomes.setdefault(item, {})
+            phone_outcomes[phone] = (PhoneOutcome('added', phone_id, client_id) if added
+                                     else PhoneOutcome('taken', None, owner))
+    for item in clients:
+        if item not in outcomes or isinstance(outcomes[item], dict):
+            found = outcomes.get(item, {})
+            client_id = created[item.email]
+            outcomes[item] = AddClientResult(client_id, True, {
+                phone: found.get(phone, PhoneOutcome('invalid')) for phone in item.phones})
+    return [(item, outcomes[item]) for item in items]
+
+
+class WriteQueue:
+
+    """
+    Write-behind queue for high-rate add_client and add_phone traffic. The calls return futures at once,
+    a worker thread collects the writes into batches of up to max_items (or what has arrived in max_delay_ms)
+    and inserts every batch with multi-row statements in one transaction, so many writes share one commit.
+    The queue holds at most max_queued writes, a full queue blocks the callers. close() writes everything
+    queued before it returns; it is also called at interpreter exit.
+    """
+
+    def __init__(self, user=None, max_items=MAX_ITEMS, max_delay_ms=MAX_DELAY_MS, max_queued=MAX_QUEUED):
+
+        """
+        Opens the connection of the worker and starts it.
+        :param user: The connection settings (User, optional, default is read from .env).
+        :param max_items: The maximum number of writes in one transaction (integer, optional, default 500).
+        :param max_delay_ms: How long the worker waits for more writes after the first write of a batch
+        (number, optional, default 10).
+        :param max_queued: The maximum number of waiting writes (integer, optional, default 10000).
+        """
+
+        self._user = user or User()
+        self.max_items = max_items
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue(max_queued)
+        self._closed = False
+        self._putting = 0
+        self._state = threading.Condition()
+        self._conn = self._connect()
+        self._worker = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_client(self, name, surname, email, phones=None, timeout=None):
+
+        """
+        Queues a new client with their phones.
+        :param name: The client's first name (string).
+        :param surname: The client's last name (string).
+        :param email: The client's email address (string).
+        :param phones: The client's phone numbers (list of strings, optional, default None).
+        :param timeout: How long to wait while the queue is full, in seconds (number, optional, default None -
+        without a limit); queue.Full is raised after it.
+        :return: A Future with the AddClientResult, or with DuplicateEmail.
+        """
+
+        phones = tuple(phone for phone in phones or [] if phone is not None)
+        return self._put(ClientItem(name, surname, email, phones, Future()), timeout)
+
+    def add_phone(self, client_id, phone, timeout=None):
+
+        """
+        Queues a phone number for an existing client.
+        :param client_id: The ID of the client (integer).
+        :param phone: The phone number (string).
+        :param timeout: How long to wait while the queue is full, see add_client.
+        :return: A Future with the id of the new phone, or with DuplicatePhone, ClientNotFound or ValueError.
+        """
+
+        if (key := phone_key(phone)) is None:
+            future = Future()
+            future.set_exception(ValueError(f'Номер {phone} не существует.'))
+            return future
+        return self._put(PhoneItem(client_id, phone, key, Future()), timeout)
+
+    def flush(self, timeout=None):
+
+        """
+        Waits until every write queued before the call is committed.
+        :param timeout: The maximum wait in seconds (number, optional, default None - without a limit).
+        :return: None.
+        """
+
+        self._put(FlushItem(Future()), timeout).result(timeout)
+
+    def close(self):
+
+        """
+        Writes everything queued, stops the worker and closes its connection. Later writes raise RuntimeError.
+        :return: None.
+        """
+
+        with self._state:
+            if self._closed:
+                return
+            self._closed = True
+            # The puts that passed the closed check must land before the close marker, or they would wait forever.
+            self._state.wait_for(lambda: not self._putting)
+        self._queue.put(_CLOSE)
+        atexit.unregister(self.close)
+        self._worker.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def _put(self, item, timeout):
+        # A full queue blocks outside the lock, so each caller waits only for its own timeout.
+        with self._state:
+            if self._closed:
+                raise RuntimeError('Очередь записи закрыта.')
+            self._putting += 1
+        try:
+            self._queue.put(item, timeout=timeout)
+        finally:
+            with self._state:
+                self._putting -= 1
+                self._state.notify_all()
+        return item.future
+
+    def _connect(self):
+        return psycopg2.connect(**self._user.connect_params(), cursor_factory=InstrumentedCursor)
+
+    def _disconnect(self):
+        try:
+            self._conn.close()
+        except Error:
+            pass
+        self._conn = None
+
+    def _run(self):
+        while True:
+            batch, closing = self._collect()
+            if batch:
+                self._write(batch)
+            if closing:
+                return
+
+    def _collect(self):
+
+        """
+        Waits for the first write and collects more until the batch is full, max_delay has passed,
+        a flush is requested or the queue is closed.
+        :return: A tuple (list of items, whether the queue is closed).
+        """
+
+        batch = []
+        deadline = None
+        while len(batch) < self.max_items:
+            try:
+                item = self._queue.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return batch, True
+            batch.append(item)
+            if isinstance(item, FlushItem):
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.max_delay
+        return batch, False
+
+    def _write(self, batch):
+
+        """
+        Writes a batch in one transaction and resolves the futures after the commit. If a statement fails
+        (e.g. a client deleted concurrently, or a too long name), the batch is written again item by item,
+        each after a savepoint, so only the failing items get the error. If the connection breaks (e.g. the server
+        process is terminated), the batch fails with ConnectionLost and the next batch opens a new connection.
+        :param batch: The items (list).
+        :return: None.
+        """
+
+        flushes = [item for item in batch if isinstance(item, FlushItem)]
+        items = [item for item in batch if not isinstance(item, FlushItem)]
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+            with self._conn.cursor() as cur:
+                try:
+                    results = write_batch(cur, items) if items else []
+                except Error:
+                    self._conn.rollback()
+                    results = []
+                    for item in items:
+                        cur.execute("SAVEPOINT write_queue_item;")
+                        try:
+                            results.extend(write_batch(cur, [item]))
+                            cur.execute("RELEASE SAVEPOINT write_queue_item;")
+                        except Error as error:
+                            cur.execute("ROLLBACK TO SAVEPOINT write_queue_item;")
+                            results.append((item, error))
+            self._conn.commit()
+        except (OperationalError, InterfaceError) as error:
+            if self._conn is not None:
+                self._disconnect()
+            lost = ConnectionLost(f'Соединение с базой данных потеряно, пакет из {len(items)} записей не записан: '
+                                  f'{str(error).strip()}')
+            lost.__cause__ = error
+            results = [(item, lost) for item in items]
+        except Exception as error:
+            try:
+                self._conn.rollback()
+            except Error:
+                pass
+            results = [(item, error) for item in items]
+        for item, result in results:
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+        for item in flushes:
+            item.future.set_result(None)